@@ -2,9 +2,10 @@
 from django.contrib import admin
 from .models import (
     Subject, Teacher, SchoolClass, Student,
-    StudentGuardian, ScheduleEntry, Attendance,
-    Grade, GradeScale, GPAConfig
+    StudentGuardian, ScheduleEntry, Attendance, AttendanceDailyRollup,
+    Grade, GradeScale, GPAConfig, StudentSubjectScore, ReportCardSnapshot
 )
+from .scores import sync_grade_scores
 
 # -----------------------------
 # Core models
@@ -54,6 +55,31 @@ class AttendanceAdmin(admin.ModelAdmin):
     list_filter   = ("status", "date", "clazz", "subject")
     search_fields = ("student__first_name", "student__last_name", "clazz__name", "subject__name")
 
+    # keep the AttendanceDailyRollup rows in sync with admin edits
+    def save_model(self, request, obj, form, change):
+        old = Attendance.objects.filter(pk=obj.pk).values_list("clazz_id", "date").first() if change else None
+        super().save_model(request, obj, form, change)
+        classes, dates = {obj.clazz_id}, {obj.date}
+        if old:
+            classes.add(old[0])
+            dates.add(old[1])
+        AttendanceDailyRollup.refresh(classes, dates)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        AttendanceDailyRollup.refresh([obj.clazz_id], [obj.date])
+
+    def delete_queryset(self, request, queryset):
+        pairs = list(queryset.values_list("clazz_id", "date"))
+        super().delete_queryset(request, queryset)
+        AttendanceDailyRollup.refresh({p[0] for p in pairs}, {p[1] for p in pairs})
+
+
+@admin.register(AttendanceDailyRollup)
+class AttendanceDailyRollupAdmin(admin.ModelAdmin):
+    list_display  = ("id", "date", "clazz", "present", "absent", "late", "excused", "absent_students", "updated_at")
+    list_filter   = ("date", "clazz")
+
 
 # -----------------------------
 # Grades & config
@@ -65,6 +91,39 @@ class GradeAdmin(admin.ModelAdmin):
     list_filter   = ("type", "subject", "date", "term")
     search_fields = ("student__first_name", "student__last_name", "subject__name")
 
+    # keep the StudentSubjectScore read model in sync with admin edits
+    def save_model(self, request, obj, form, change):
+        old = Grade.objects.filter(pk=obj.pk).values_list("student_id", "subject_id").first() if change else None
+        super().save_model(request, obj, form, change)
+        students, subjects = {obj.student_id}, {obj.subject_id}
+        if old:
+            students.add(old[0])
+            subjects.add(old[1])
+        sync_grade_scores(students, subjects)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        sync_grade_scores([obj.student_id], [obj.subject_id])
+
+    def delete_queryset(self, request, queryset):
+        pairs = list(queryset.values_list("student_id", "subject_id"))
+        super().delete_queryset(request, queryset)
+        sync_grade_scores({p[0] for p in pairs}, {p[1] for p in pairs})
+
+
+@admin.register(StudentSubjectScore)
+class StudentSubjectScoreAdmin(admin.ModelAdmin):
+    list_display  = ("id", "student", "subject", "term", "exam_avg", "final_avg", "score", "updated_at")
+    list_filter   = ("term", "subject")
+    search_fields = ("student__first_name", "student__last_name", "subject__name")
+
+
+@admin.register(ReportCardSnapshot)
+class ReportCardSnapshotAdmin(admin.ModelAdmin):
+    list_display  = ("id", "student", "clazz", "term", "avg_overall", "class_rank", "attendance_pct", "generated_at")
+    list_filter   = ("term", "clazz")
+    search_fields = ("student__first_name", "student__last_name")
+
 
 @admin.register(GradeScale)
 class GradeScaleAdmin(admin.ModelAdmin):
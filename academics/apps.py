@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class AcademicsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'academics'
\ No newline at end of file
+    name = 'academics'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,80 @@
+# academics/management/commands/generate_report_cards.py
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+
+from academics.models import Grade, Student
+
+
+def _init_worker():
+    # forked workers must not reuse the parent's DB sockets; spawned ones need setup
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _run_class(class_id, term, date_from, date_to):
+    from academics.report_cards import build_class_report_cards
+    try:
+        return class_id, build_class_report_cards(class_id, term, date_from, date_to)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Generate ReportCardSnapshot rows for every student of a term, one class per worker task."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--term", required=True, help="e.g. 2025-1")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="process pool size (1 = run in-process)")
+        parser.add_argument("--class", dest="class_ids", type=int, action="append",
+                            help="limit to class id (repeatable)")
+        parser.add_argument("--from", dest="date_from", help="attendance window start (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", help="attendance window end (YYYY-MM-DD)")
+
+    def handle(self, *args, **opts):
+        term = opts["term"]
+        try:
+            d1 = date.fromisoformat(opts["date_from"]) if opts["date_from"] else None
+            d2 = date.fromisoformat(opts["date_to"]) if opts["date_to"] else None
+        except ValueError:
+            raise CommandError("--from/--to must be YYYY-MM-DD")
+        if d1 is None and d2 is None:
+            # default attendance window: the span of the term's grades
+            span = Grade.objects.filter(term=term).aggregate(d1=Min("date"), d2=Max("date"))
+            d1, d2 = span["d1"], span["d2"]
+
+        class_ids = opts["class_ids"] or list(
+            Student.objects.filter(clazz__isnull=False)
+            .order_by("clazz_id").values_list("clazz_id", flat=True).distinct()
+        )
+        workers = max(1, min(opts["workers"], len(class_ids) or 1))
+        self.stdout.write(
+            f"term={term} classes={len(class_ids)} workers={workers} attendance={d1}..{d2}"
+        )
+
+        started = time.monotonic()
+        students = 0
+        if workers == 1:
+            from academics.report_cards import build_class_report_cards
+            for cid in class_ids:
+                students += build_class_report_cards(cid, term, d1, d2)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(_run_class, cid, term, d1, d2) for cid in class_ids]
+                for fut in as_completed(futures):
+                    _, n = fut.result()
+                    students += n
+
+        elapsed = time.monotonic() - started
+        rate = students / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Report cards: {students} students in {elapsed:.1f}s ({rate:.1f} students/sec)"
+        ))
@@ -0,0 +1,39 @@
+# academics/management/commands/rebuild_attendance_rollups.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from academics.models import Attendance, AttendanceDailyRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild AttendanceDailyRollup rows from Attendance (optionally for a date range)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD (inclusive)")
+        parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD (inclusive)")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        try:
+            d1 = date.fromisoformat(opts["date_from"]) if opts["date_from"] else None
+            d2 = date.fromisoformat(opts["date_to"]) if opts["date_to"] else None
+        except ValueError:
+            raise CommandError("--from/--to must be YYYY-MM-DD")
+
+        attendance = Attendance.objects.all()
+        rollups = AttendanceDailyRollup.objects.all()
+        if d1:
+            attendance = attendance.filter(date__gte=d1)
+            rollups = rollups.filter(date__gte=d1)
+        if d2:
+            attendance = attendance.filter(date__lte=d2)
+            rollups = rollups.filter(date__lte=d2)
+
+        with transaction.atomic():
+            rollups.delete()
+            rows = AttendanceDailyRollup.build_rows(attendance)
+            AttendanceDailyRollup.objects.bulk_create(rows, batch_size=opts["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"AttendanceDailyRollup rebuilt: {len(rows)} rows"))
@@ -0,0 +1,40 @@
+# academics/management/commands/rebuild_subject_scores.py
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from academics.models import Grade, StudentSubjectScore
+
+
+class Command(BaseCommand):
+    help = "Rebuild the StudentSubjectScore table from all exam/final grades."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch_size"]
+        grades = (
+            Grade.objects.filter(type__in=("exam", "final"))
+            .order_by("student_id", "subject_id", "date", "id")
+            .values_list("student_id", "subject_id", "term", "type", "score")
+            .iterator(chunk_size=batch_size)
+        )
+
+        created = 0
+        with transaction.atomic():
+            StudentSubjectScore.objects.all().delete()
+            batch = []
+            # grades arrive grouped by (student, subject) → memory stays per-pair
+            for _, pair in groupby(grades, key=lambda g: (g[0], g[1])):
+                batch.extend(StudentSubjectScore.build_rows(pair))
+                if len(batch) >= batch_size:
+                    StudentSubjectScore.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            if batch:
+                StudentSubjectScore.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"StudentSubjectScore rebuilt: {created} rows"))
@@ -187,6 +187,100 @@ class Attendance(models.Model):
         super().save(*args, **kwargs)
 
 
+class AttendanceDailyRollup(models.Model):
+    """
+    Per-(class, day) attendance counts for dashboards and the absent list.
+
+    Counts are per attendance row (lesson); absent_student_ids holds the
+    distinct students with at least one 'absent' row that day.
+    Kept in sync by `refresh()` from the attendance write paths;
+    `manage.py rebuild_attendance_rollups` rebuilds it.
+    """
+    clazz = models.ForeignKey('SchoolClass', on_delete=models.CASCADE, related_name='attendance_rollups')
+    date = models.DateField()
+    present = models.PositiveIntegerField(default=0)
+    absent = models.PositiveIntegerField(default=0)
+    late = models.PositiveIntegerField(default=0)
+    excused = models.PositiveIntegerField(default=0)
+    absent_students = models.PositiveIntegerField(default=0)
+    absent_student_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['clazz', 'date'], name='uniq_att_rollup_class_date'),
+        ]
+        indexes = [models.Index(fields=['date', 'clazz'])]
+        ordering = ['-date', 'clazz_id']
+
+    def __str__(self):
+        return f"{self.date} {self.clazz} absent={self.absent_students}"
+
+    @classmethod
+    def build_rows(cls, attendance_qs):
+        """Aggregate an Attendance queryset into unsaved rollup rows (2 queries)."""
+        counts = (
+            attendance_qs.order_by()
+            .values("clazz_id", "date")
+            .annotate(
+                n_present=models.Count("id", filter=Q(status="present")),
+                n_absent=models.Count("id", filter=Q(status="absent")),
+                n_late=models.Count("id", filter=Q(status="late")),
+                n_excused=models.Count("id", filter=Q(status="excused")),
+            )
+        )
+        absent_ids = {}
+        for clazz_id, day, student_id in (
+            attendance_qs.filter(status="absent")
+            .order_by("clazz_id", "date", "student_id")
+            .values_list("clazz_id", "date", "student_id")
+            .distinct()
+        ):
+            absent_ids.setdefault((clazz_id, day), []).append(student_id)
+
+        rows = []
+        for c in counts:
+            ids = absent_ids.get((c["clazz_id"], c["date"]), [])
+            rows.append(cls(
+                clazz_id=c["clazz_id"],
+                date=c["date"],
+                present=c["n_present"],
+                absent=c["n_absent"],
+                late=c["n_late"],
+                excused=c["n_excused"],
+                absent_students=len(ids),
+                absent_student_ids=ids,
+            ))
+        return rows
+
+    @classmethod
+    def refresh(cls, class_ids, dates):
+        """Recompute the rollups of the given classes × days from Attendance."""
+        class_ids, dates = set(class_ids), set(dates)
+        if not class_ids or not dates:
+            return
+        rows = cls.build_rows(Attendance.objects.filter(clazz_id__in=class_ids, date__in=dates))
+        keep = {(r.clazz_id, str(r.date)) for r in rows}
+        stale = [
+            pk for pk, clazz_id, day in cls.objects.filter(
+                clazz_id__in=class_ids, date__in=dates
+            ).values_list("id", "clazz_id", "date")
+            if (clazz_id, str(day)) not in keep
+        ]
+        if stale:
+            cls.objects.filter(id__in=stale).delete()
+        if rows:
+            cls.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["clazz", "date"],
+                update_fields=[
+                    "present", "absent", "late", "excused",
+                    "absent_students", "absent_student_ids", "updated_at",
+                ],
+            )
+
+
 class GradeScale(models.Model):
     """Mapping 2..5 → GPA points (editable by Admin)."""
     name = models.CharField(max_length=50, default='Default')
@@ -242,3 +336,145 @@ class Grade(models.Model):
 
     def __str__(self):
         return f"{self.student} {self.subject} {self.type} {self.score}"
+
+
+class StudentSubjectScore(models.Model):
+    """
+    Denormalized exam/final averages per (student, subject, term).
+
+    Rows with term == ALL_TERMS hold the roll-up across every term, so any
+    read (with or without ?term=) is one row per student/subject.
+    Kept in sync by `refresh()` from the grade write paths;
+    `manage.py rebuild_subject_scores` rebuilds the whole table.
+    """
+    ALL_TERMS = "*"
+
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name='subject_scores')
+    subject = models.ForeignKey('Subject', on_delete=models.CASCADE, related_name='student_scores')
+    term = models.CharField(max_length=20, blank=True)
+    exam_count = models.PositiveIntegerField(default=0)
+    final_count = models.PositiveIntegerField(default=0)
+    exam_avg = models.FloatField(null=True, blank=True)
+    final_avg = models.FloatField(null=True, blank=True)
+    subject_avg = models.FloatField(null=True, blank=True)   # all exam+final scores
+    latest_final = models.IntegerField(null=True, blank=True)
+    score = models.FloatField(null=True, blank=True)         # latest FINAL else exam average
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subject', 'term'],
+                                    name='uniq_score_student_subject_term'),
+        ]
+        indexes = [models.Index(fields=['term', 'subject'])]
+
+    def __str__(self):
+        return f"{self.student} {self.subject} {self.term or '-'} {self.score}"
+
+    @classmethod
+    def build_rows(cls, grades):
+        """
+        Fold (student_id, subject_id, term, type, score) tuples — ordered by
+        date, id — into unsaved rows: one per term plus the ALL_TERMS roll-up.
+        Averages follow `_subject_breakdown` / `_subject_score_for_student`.
+        """
+        acc = {}
+        for student_id, subject_id, term, gtype, score in grades:
+            for t in (term, cls.ALL_TERMS):
+                a = acc.setdefault((student_id, subject_id, t), {"exam": [], "final": []})
+                a[gtype].append(score)
+
+        def avg(arr):
+            return round(sum(arr) / len(arr), 2) if arr else None
+
+        rows = []
+        for (student_id, subject_id, term), a in acc.items():
+            exams, finals = a["exam"], a["final"]
+            latest_final = finals[-1] if finals else None
+            if latest_final is not None:
+                score = float(latest_final)
+            else:
+                score = float(sum(exams) / len(exams)) if exams else None
+            rows.append(cls(
+                student_id=student_id,
+                subject_id=subject_id,
+                term=term,
+                exam_count=len(exams),
+                final_count=len(finals),
+                exam_avg=avg(exams),
+                final_avg=avg(finals),
+                subject_avg=avg(exams + finals),
+                latest_final=latest_final,
+                score=score,
+            ))
+        return rows
+
+    @classmethod
+    def refresh(cls, student_ids, subject_ids):
+        """
+        Recompute every row for the given students × subjects from `Grade`.
+        Constant number of queries; call once per write batch.
+        """
+        student_ids, subject_ids = set(student_ids), set(subject_ids)
+        if not student_ids or not subject_ids:
+            return
+        grades = (
+            Grade.objects.filter(
+                student_id__in=student_ids,
+                subject_id__in=subject_ids,
+                type__in=("exam", "final"),
+            )
+            .order_by("date", "id")
+            .values_list("student_id", "subject_id", "term", "type", "score")
+        )
+        rows = cls.build_rows(grades)
+        keep = {(r.student_id, r.subject_id, r.term) for r in rows}
+
+        stale = [
+            pk for pk, *key in cls.objects.filter(
+                student_id__in=student_ids, subject_id__in=subject_ids
+            ).values_list("id", "student_id", "subject_id", "term")
+            if tuple(key) not in keep
+        ]
+        if stale:
+            cls.objects.filter(id__in=stale).delete()
+        if rows:
+            cls.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["student", "subject", "term"],
+                update_fields=[
+                    "exam_count", "final_count", "exam_avg", "final_avg",
+                    "subject_avg", "latest_final", "score", "updated_at",
+                ],
+            )
+
+
+class ReportCardSnapshot(models.Model):
+    """
+    Term report card per student, written by `manage.py generate_report_cards`.
+    `subjects` holds [{"subject_id", "name", "exam_avg", "final_avg",
+    "subject_avg", "score"}] in class-subject order.
+    """
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name='report_cards')
+    clazz = models.ForeignKey('SchoolClass', on_delete=models.SET_NULL, null=True, related_name='report_cards')
+    term = models.CharField(max_length=20)
+    subjects = models.JSONField(default=list, blank=True)
+    avg_overall = models.FloatField(default=0.0)
+    class_rank = models.PositiveIntegerField(null=True, blank=True)
+    class_size = models.PositiveIntegerField(default=0)
+    att_present = models.PositiveIntegerField(default=0)
+    att_absent = models.PositiveIntegerField(default=0)
+    att_late = models.PositiveIntegerField(default=0)
+    att_excused = models.PositiveIntegerField(default=0)
+    attendance_pct = models.FloatField(null=True, blank=True)   # (present + late) / all lessons
+    generated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'term'], name='uniq_report_card_student_term'),
+        ]
+        ordering = ['term', 'clazz_id', 'class_rank']
+
+    def __str__(self):
+        return f"{self.student} {self.term} avg={self.avg_overall}"
@@ -0,0 +1,90 @@
+# academics/report_cards.py
+from django.db.models import Count, Q
+
+from .models import Attendance, ReportCardSnapshot, StudentSubjectScore, Subject
+from .scores import rank_class, subjects_for_class
+
+
+def build_class_report_cards(class_id, term, date_from=None, date_to=None) -> int:
+    """
+    Compute and upsert the ReportCardSnapshot rows of one class for `term`.
+    Constant number of queries per class; returns the number of students.
+
+    Subject scores come from StudentSubjectScore (the `_subject_breakdown`
+    rules), rank from `rank_class`, attendance from the optional date window.
+    """
+    subject_ids = subjects_for_class(class_id)
+    names = dict(Subject.objects.filter(id__in=subject_ids).values_list("id", "name"))
+
+    ranking = rank_class(class_id, subject_ids, term=term)
+    if not ranking:
+        return 0
+
+    scores = {}
+    for row in StudentSubjectScore.objects.filter(
+        student__clazz_id=class_id, subject_id__in=subject_ids, term=term
+    ).values_list("student_id", "subject_id", "exam_avg", "final_avg", "subject_avg", "score"):
+        scores[(row[0], row[1])] = row[2:]
+
+    att = Attendance.objects.filter(student__clazz_id=class_id)
+    if date_from:
+        att = att.filter(date__gte=date_from)
+    if date_to:
+        att = att.filter(date__lte=date_to)
+    att_by_student = {
+        r["student_id"]: r
+        for r in att.order_by().values("student_id").annotate(
+            present=Count("id", filter=Q(status="present")),
+            absent=Count("id", filter=Q(status="absent")),
+            late=Count("id", filter=Q(status="late")),
+            excused=Count("id", filter=Q(status="excused")),
+        )
+    }
+
+    cards = []
+    for r in ranking:
+        sid = r["student_id"]
+        subjects = []
+        for subj in subject_ids:
+            row = scores.get((sid, subj))
+            if row is None:
+                continue
+            exam_avg, final_avg, subject_avg, score = row
+            subjects.append({
+                "subject_id": subj,
+                "name": names.get(subj, f"Subject #{subj}"),
+                "exam_avg": exam_avg,
+                "final_avg": final_avg,
+                "subject_avg": subject_avg,
+                "score": round(score, 2) if score is not None else None,
+            })
+        a = att_by_student.get(sid, {})
+        present, absent = a.get("present", 0), a.get("absent", 0)
+        late, excused = a.get("late", 0), a.get("excused", 0)
+        total = present + absent + late + excused
+        cards.append(ReportCardSnapshot(
+            student_id=sid,
+            clazz_id=class_id,
+            term=term,
+            subjects=subjects,
+            avg_overall=r["avg"],
+            class_rank=r["rank"],
+            class_size=len(ranking),
+            att_present=present,
+            att_absent=absent,
+            att_late=late,
+            att_excused=excused,
+            attendance_pct=round((present + late) * 100 / total, 1) if total else None,
+        ))
+
+    ReportCardSnapshot.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=["student", "term"],
+        update_fields=[
+            "clazz", "subjects", "avg_overall", "class_rank", "class_size",
+            "att_present", "att_absent", "att_late", "att_excused",
+            "attendance_pct", "generated_at",
+        ],
+    )
+    return len(cards)
@@ -0,0 +1,170 @@
+# academics/scores.py
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ScheduleEntry, Student, StudentSubjectScore, Subject
+
+RANK_CACHE_TIMEOUT = 60 * 30   # upper bound for staleness (e.g. a student moved class)
+RANK_LOCK_TIMEOUT = 10         # seconds a worker may hold the recompute lock
+
+
+def subjects_for_class(class_id: int) -> list[int]:
+    """
+    Distinct subject IDs taught to the class (based on schedule).
+    Falls back to all Subjects if the class has no schedule yet.
+    """
+    if not class_id:
+        return list(Subject.objects.values_list("id", flat=True))
+    ids = (
+        ScheduleEntry.objects.filter(clazz_id=class_id)
+        .values_list("subject_id", flat=True)
+        .distinct()
+    )
+    ids = list(ids)
+    if not ids:
+        ids = list(Subject.objects.values_list("id", flat=True))
+    return ids
+
+
+# =========================
+# Set-based AVERAGE engine
+# =========================
+
+def _score_rows(term: str | None):
+    return StudentSubjectScore.objects.filter(
+        term=term or StudentSubjectScore.ALL_TERMS
+    )
+
+
+def class_subject_scores(class_id, subject_ids, term: str | None = None) -> dict:
+    """
+    Representative score per (student_id, subject_id) for a whole class:
+      - Latest FINAL score if available
+      - else average of EXAM scores
+
+    Read from the StudentSubjectScore table in ONE query (one row per
+    student/subject, the ALL_TERMS roll-up when no term is given).
+    """
+    rows = _score_rows(term).filter(
+        student__clazz_id=class_id,
+        subject_id__in=subject_ids,
+        score__isnull=False,
+    ).values_list("student_id", "subject_id", "score")
+    return {(student_id, subject_id): score for student_id, subject_id, score in rows}
+
+
+def student_subject_scores(student_id, subject_ids, term: str | None = None) -> dict:
+    """
+    {subject_id: StudentSubjectScore} for one student — O(subjects) rows,
+    used by the parent overview instead of aggregating raw grades.
+    """
+    rows = _score_rows(term).filter(student_id=student_id, subject_id__in=subject_ids)
+    return {r.subject_id: r for r in rows}
+
+
+def rank_class(class_id, subject_ids, term: str | None = None) -> list[dict]:
+    """
+    Ranking rows for `SchoolClassViewSet.average_ranking`:
+      [{"student_id", "name", "avg", "count_subjects", "rank"}, ...]
+
+    Constant number of queries regardless of class size / subject count.
+    """
+    students = (
+        Student.objects.filter(clazz_id=class_id)
+        .order_by("last_name", "first_name")
+        .values_list("id", "first_name", "last_name")
+    )
+    scores_by_key = class_subject_scores(class_id, subject_ids, term=term)
+
+    ranking = []
+    for student_id, first_name, last_name in students:
+        # keep subject order so float sums match the per-subject loop exactly
+        scores = [
+            scores_by_key[(student_id, sid)]
+            for sid in subject_ids
+            if (student_id, sid) in scores_by_key
+        ]
+        avg = (sum(scores) / len(scores)) if scores else 0.0
+        ranking.append(
+            {
+                "student_id": student_id,
+                "name": f"{last_name} {first_name}",
+                "avg": round(avg, 2),
+                "count_subjects": len(scores),
+            }
+        )
+
+    ranking.sort(key=lambda x: x["avg"], reverse=True)
+    for i, row in enumerate(ranking, start=1):
+        row["rank"] = i
+    return ranking
+
+
+# =========================
+# Cached rank snapshots
+# =========================
+
+def _rank_version_key(class_id) -> str:
+    return f"class-rank:ver:{class_id}"
+
+
+def bump_rank_version(class_ids):
+    """Invalidate every cached snapshot (all terms) of the given classes."""
+    for cid in {str(c) for c in class_ids if c}:
+        key = _rank_version_key(cid)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+
+
+def sync_grade_scores(student_ids, subject_ids):
+    """
+    Single entry point after any grade write: refresh the
+    StudentSubjectScore rows and invalidate the affected class rankings.
+    """
+    student_ids = set(student_ids)
+    StudentSubjectScore.refresh(student_ids, subject_ids)
+    class_ids = list(
+        Student.objects.filter(id__in=student_ids)
+        .values_list("clazz_id", flat=True)
+        .distinct()
+    )
+    # after commit, so a concurrent miss cannot re-cache the pre-write ranking
+    transaction.on_commit(lambda: bump_rank_version(class_ids))
+
+
+def class_rank_snapshot(class_id, term: str | None = None) -> list[dict]:
+    """
+    Ranking rows of `rank_class`, cached per (class, term) under a version
+    that `bump_rank_version` increments whenever a grade of the class changes.
+
+    Concurrent misses are coalesced: only the worker that wins `cache.add`
+    on the lock key recomputes; the others poll for its result and only
+    fall back to computing themselves if it does not show up in time.
+    """
+    version = cache.get_or_set(_rank_version_key(class_id), 1, None)
+    key = f"class-rank:{class_id}:{term or StudentSubjectScore.ALL_TERMS}:{version}"
+
+    ranking = cache.get(key)
+    if ranking is not None:
+        return ranking
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, RANK_LOCK_TIMEOUT):
+        deadline = time.monotonic() + RANK_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            ranking = cache.get(key)
+            if ranking is not None:
+                return ranking
+        return rank_class(class_id, subjects_for_class(class_id), term=term)
+
+    try:
+        ranking = rank_class(class_id, subjects_for_class(class_id), term=term)
+        cache.set(key, ranking, RANK_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return ranking
@@ -4,7 +4,8 @@ from django.contrib.auth import get_user_model
 
 from .models import (
     Subject, Teacher, SchoolClass, Student,
-    StudentGuardian, ScheduleEntry, Attendance, Grade, GradeScale, GPAConfig
+    StudentGuardian, ScheduleEntry, Attendance, Grade, GradeScale, GPAConfig,
+    ReportCardSnapshot
 )
 
 User = get_user_model()
@@ -214,6 +215,20 @@ class ChildOverviewSerializer(serializers.Serializer):
     class_size = serializers.IntegerField()
 
 
+class ReportCardSnapshotSerializer(serializers.ModelSerializer):
+    student_name = serializers.SerializerMethodField()
+    class_name = serializers.CharField(source='clazz.name', default='', read_only=True)
+
+    class Meta:
+        model = ReportCardSnapshot
+        fields = ('id', 'student', 'student_name', 'clazz', 'class_name', 'term', 'subjects',
+                  'avg_overall', 'class_rank', 'class_size', 'att_present', 'att_absent',
+                  'att_late', 'att_excused', 'attendance_pct', 'generated_at')
+
+    def get_student_name(self, obj):
+        return f"{obj.student.last_name} {obj.student.first_name}".strip()
+
+
 # =========================
 # Directory / lightweight serializers (for list/search UIs)
 # =========================
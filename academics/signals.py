@@ -0,0 +1,25 @@
+# academics/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Student
+from .scores import bump_rank_version
+
+
+# class rank snapshots list the class's students by name, so enrolling,
+# moving, renaming or removing a student invalidates the old and new class
+
+@receiver(pre_save, sender=Student, dispatch_uid="rank-student-pre-save")
+def _remember_class(sender, instance, **kwargs):
+    instance._rank_old_clazz_id = (
+        Student.objects.filter(pk=instance.pk).values_list("clazz_id", flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Student, dispatch_uid="rank-student-save")
+@receiver(post_delete, sender=Student, dispatch_uid="rank-student-delete")
+def _bump_class_rank(sender, instance, **kwargs):
+    class_ids = [instance.clazz_id, getattr(instance, "_rank_old_clazz_id", None)]
+    transaction.on_commit(lambda: bump_rank_version(class_ids))
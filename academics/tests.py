@@ -1,3 +1,207 @@
+# academics/tests.py
+import os
+import random
+import time
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from .models import Attendance, Grade, SchoolClass, ScheduleEntry, Student, StudentSubjectScore, Subject, Teacher
+from .scores import class_rank_snapshot, class_subject_scores, rank_class, sync_grade_scores
+
+STUDENTS, SUBJECTS = 40, 15
+
+
+def _seed_class(n_students=STUDENTS, n_subjects=SUBJECTS, seed=1):
+    """A class with a weekly schedule and 0..4 exam/final grades per student and subject."""
+    rnd = random.Random(seed)
+    clazz = SchoolClass.objects.create(name="7-A", level=7)
+    teacher = Teacher.objects.create(user=User.objects.create_user(phone="+998900000001", password="x", role="teacher"))
+    subjects = [Subject.objects.create(name=f"Fan {i}", code=f"F{i}") for i in range(n_subjects)]
+    ScheduleEntry.objects.bulk_create(
+        ScheduleEntry(
+            clazz=clazz, subject=s, teacher=teacher, weekday=1 + i % 6,
+            start_time=f"{8 + i // 6}:00", end_time=f"{8 + i // 6}:45",
+        )
+        for i, s in enumerate(subjects)
+    )
+    students = Student.objects.bulk_create(
+        Student(first_name=f"Ism{i}", last_name=f"Familiya{rnd.randint(0, 9)}", clazz=clazz)
+        for i in range(n_students)
+    )
+    d0 = date(2025, 9, 1)
+    Grade.objects.bulk_create(
+        Grade(
+            student=st, subject=s, date=d0 + timedelta(days=rnd.randint(0, 60)),
+            term=rnd.choice(("2025-1", "2025-2")), type=rnd.choice(("exam", "exam", "final", "daily")),
+            score=rnd.randint(2, 5),
+        )
+        for st in students for s in subjects for _ in range(rnd.randint(0, 4))
+    )
+    StudentSubjectScore.refresh([st.id for st in students], [s.id for s in subjects])
+    return clazz, students, [s.id for s in subjects]
+
+
+def _expected_scores(class_id, subject_ids, term=None):
+    """Latest FINAL else average of EXAMs, straight from Grade (the pre-engine rule)."""
+    grades = Grade.objects.filter(student__clazz_id=class_id, subject_id__in=subject_ids, type__in=("exam", "final"))
+    if term:
+        grades = grades.filter(term=term)
+    finals, exams = {}, {}
+    for sid, subj, kind, score in grades.order_by("date", "id").values_list("student_id", "subject_id", "type", "score"):
+        if kind == "final":
+            finals[(sid, subj)] = score
+        else:
+            exams.setdefault((sid, subj), []).append(score)
+    out = {k: sum(v) / len(v) for k, v in exams.items()}
+    out.update(finals)
+    return out
+
+
+class ClassRankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clazz, cls.students, cls.subject_ids = _seed_class()
+
+    def test_class_subject_scores_is_one_query(self):
+        for term in (None, "2025-1"):
+            with self.assertNumQueries(1):
+                scores = class_subject_scores(self.clazz.id, self.subject_ids, term=term)
+            expected = _expected_scores(self.clazz.id, self.subject_ids, term=term)
+            self.assertEqual(scores.keys(), expected.keys())
+            for key, score in expected.items():
+                self.assertAlmostEqual(scores[key], score)
+
+    def test_rank_class_is_two_queries(self):
+        with self.assertNumQueries(2):   # students + scores, whatever the class size
+            ranking = rank_class(self.clazz.id, self.subject_ids)
+        self.assertEqual(len(ranking), STUDENTS)
+        self.assertEqual([r["rank"] for r in ranking], list(range(1, STUDENTS + 1)))
+        self.assertEqual(ranking, sorted(ranking, key=lambda r: r["avg"], reverse=True))
+
+        expected = _expected_scores(self.clazz.id, self.subject_ids)
+        for row in ranking:
+            scores = [expected[(row["student_id"], s)] for s in self.subject_ids if (row["student_id"], s) in expected]
+            self.assertEqual(row["count_subjects"], len(scores))
+            self.assertEqual(row["avg"], round(sum(scores) / len(scores), 2) if scores else 0.0)
+
+    @skipUnless(os.environ.get("BENCHMARK"), "timing benchmark; run with BENCHMARK=1")
+    def test_benchmark_rank_class(self):
+        runs = 20
+        started = time.perf_counter()
+        for _ in range(runs):
+            rank_class(self.clazz.id, self.subject_ids)
+        per_call = (time.perf_counter() - started) / runs
+        # the per-student loop it replaced took ~1,000 queries on this class
+        print(f"\nrank_class {STUDENTS}x{SUBJECTS}: {per_call * 1000:.1f} ms/call over {runs} runs")
+
+
+class RankSnapshotInvalidationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clazz, cls.students, cls.subject_ids = _seed_class(n_students=3, n_subjects=2)
+        cls.other = SchoolClass.objects.create(name="7-B", level=7)
+
+    def setUp(self):
+        cache.clear()
+
+    def _ids(self, clazz):
+        return sorted(r["student_id"] for r in class_rank_snapshot(clazz.id))
+
+    def test_student_enroll_move_delete_refresh_snapshots(self):
+        self.assertEqual(self._ids(self.clazz), sorted(s.id for s in self.students))
+        self.assertEqual(self._ids(self.other), [])
+
+        moved = self.students[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.clazz = self.other
+            moved.save()
+        self.assertNotIn(moved.id, self._ids(self.clazz))
+        self.assertEqual(self._ids(self.other), [moved.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Student.objects.create(first_name="Yangi", last_name="O'quvchi", clazz=self.clazz)
+        self.assertIn(new.id, self._ids(self.clazz))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.delete()
+        self.assertEqual(self._ids(self.other), [])
+
+    def test_grade_sync_bumps_after_commit(self):
+        before = class_rank_snapshot(self.clazz.id)
+        student, subject_id = self.students[1], self.subject_ids[0]
+        Grade.objects.filter(student=student, subject_id=subject_id).delete()
+        Grade.objects.create(student=student, subject_id=subject_id, type="final", score=5)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            sync_grade_scores([student.id], [subject_id])
+        self.assertEqual(class_rank_snapshot(self.clazz.id), before)   # not before commit
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(class_rank_snapshot(self.clazz.id), before)
+
+
+class AttendanceBulkMarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clazz, cls.students, _ = _seed_class(n_students=STUDENTS, n_subjects=1)
+        cls.schedule = ScheduleEntry.objects.get(clazz=cls.clazz)
+        cls.admin = User.objects.create_user(phone="+998900000002", password="x", role="admin")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _mark(self, students, status="present"):
+        return self.client.post("/api/attendance/bulk-mark/", {
+            "class": self.clazz.id, "date": "2025-09-15", "schedule": self.schedule.id,
+            "entries": [{"student": s.id, "status": status} for s in students],
+        }, format="json")
+
+    def test_full_class_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            self._mark(self.students[:3])
+        Attendance.objects.all().delete()
+        with self.assertNumQueries(len(few)):
+            res = self._mark(self.students)
+        self.assertEqual((res.data["inserted"], res.data["updated"], res.data["unchanged"]), (STUDENTS, 0, 0))
+
+        res = self._mark(self.students[:5], status="absent")
+        self.assertEqual((res.data["inserted"], res.data["updated"], res.data["unchanged"]), (0, 5, 0))
+        res = self._mark(self.students)
+        self.assertEqual((res.data["inserted"], res.data["updated"], res.data["unchanged"]), (0, 5, STUDENTS - 5))
+        self.assertEqual(Attendance.objects.filter(status="present").count(), STUDENTS)
+
+    def test_string_ids_are_accepted_and_bad_ids_reported(self):
+        res = self.client.post("/api/attendance/bulk-mark/", {
+            "class": str(self.clazz.id), "date": "2025-09-15", "schedule": self.schedule.id,
+            "entries": [
+                {"student": str(self.students[0].id), "status": "late"},
+                {"student": "abc", "status": "present"},
+                {"student": [1], "status": "present"},
+            ],
+        }, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["inserted"], 1)
+        self.assertEqual(res.data["invalid"], ["abc", [1]])
+        self.assertEqual(Attendance.objects.get().status, "late")
+
 
-# Create your tests here.
+class AbsentListTests(TestCase):
+    def test_substitute_teacher_sees_absences_they_marked(self):
+        clazz, students, _ = _seed_class(n_students=2, n_subjects=1)
+        schedule = ScheduleEntry.objects.get(clazz=clazz)
+        substitute = User.objects.create_user(phone="+998900000003", password="x", role="teacher")
+        teacher = Teacher.objects.create(user=substitute)
+        Attendance.objects.create(
+            student=students[0], clazz=clazz, date=date(2025, 9, 15), schedule=schedule, teacher=teacher, status="absent",
+        )
+        client = APIClient()
+        client.force_authenticate(substitute)
+        res = client.get("/api/attendance/absent/", {"date": "2025-09-15"})
+        self.assertEqual([(r["student_id"], r["class_name"]) for r in res.data], [(students[0].id, "7-A")])
@@ -12,10 +12,10 @@ from .views import (
     ClassDirectoryViewSet, StudentDirectoryViewSet,
 
     # Utility / dashboards
-    TeacherDashViewSet, ParentViewSet,
+    TeacherDashViewSet, ParentViewSet, ReportCardView,
 
     # Operator & stats
-    OperatorEnrollView, SchoolStatsView, StaffDirectoryView, StaffSetPasswordView, ParentDirectoryViewSet,
+    OperatorEnrollView, SchoolStatsView, LeaderboardView, AttendanceStatsView, StaffDirectoryView, StaffSetPasswordView, ParentDirectoryViewSet,
     StaffDeleteView,
 )
 
@@ -57,10 +57,13 @@ urlpatterns = [
     # Parent helpers
     path('parent/children/', parent_children, name='parent-children'),
     path('parent/child/<int:student_id>/overview/', parent_child_overview, name='parent-child-overview'),
+    path('report-cards/<int:student_id>/', ReportCardView.as_view(), name='report-card'),
 
     # Operator enroll + School stats
     path('operator/enroll/', OperatorEnrollView.as_view(), name='operator-enroll'),
     path('stats/school/', SchoolStatsView.as_view(), name='school-stats'),
+    path('stats/leaderboard/', LeaderboardView.as_view(), name='stats-leaderboard'),
+    path('stats/attendance/', AttendanceStatsView.as_view(), name='stats-attendance'),
     path('staff/directory/', StaffDirectoryView.as_view(), name='staff-directory'),
     path('staff/set-password/', StaffSetPasswordView.as_view(), name='staff-set-password'),
     path('staff/delete/', StaffDeleteView.as_view(), name='staff-delete'),
@@ -1,4 +1,5 @@
 # academics/views.py
+import json
 import traceback
 from collections import defaultdict
 from datetime import date, timedelta
@@ -6,8 +7,23 @@ from datetime import date, timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models, transaction
-from django.db.models import Count, Q, Min
-from django.db.models.functions import TruncMonth
+from django.db.models import (
+    Avg,
+    Case,
+    Count,
+    Exists,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+    Window,
+)
+from django.db.models.functions import Coalesce, Rank, TruncMonth
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
@@ -16,22 +32,32 @@ from rest_framework.views import APIView
 
 from .models import (
     Attendance,
+    AttendanceDailyRollup,
     GPAConfig,
     Grade,
     GradeScale,
+    ReportCardSnapshot,
     ScheduleEntry,
     SchoolClass,
     Student,
     StudentGuardian,
+    StudentSubjectScore,
     Subject,
     Teacher,
 )
 from .permissions import IsAdminOrRegistrarWrite, IsAdminOrTeacherWrite
+from .scores import (
+    class_rank_snapshot,
+    student_subject_scores,
+    subjects_for_class,
+    sync_grade_scores,
+)
 from .serializers import (
     AttendanceSerializer,
     ClassMiniSerializer,
     GPAConfigSerializer,
     GradeScaleSerializer,
+    ReportCardSnapshotSerializer,
     GradeSerializer,
     ScheduleEntrySerializer,
     SchoolClassSerializer,
@@ -45,76 +71,6 @@ User = get_user_model()
 ALLOW_DAILY = bool(getattr(settings, "ALLOW_DAILY_GRADES", True))  # backend flag
 
 
-# =========================
-# Helpers (AVERAGE system)
-# =========================
-
-def _subjects_for_class(class_id: int) -> list[int]:
-    """
-    Distinct subject IDs taught to the class (based on schedule).
-    Falls back to all Subjects if the class has no schedule yet.
-    """
-    if not class_id:
-        return list(Subject.objects.values_list("id", flat=True))
-    ids = (
-        ScheduleEntry.objects.filter(clazz_id=class_id)
-        .values_list("subject_id", flat=True)
-        .distinct()
-    )
-    ids = list(ids)
-    if not ids:
-        ids = list(Subject.objects.values_list("id", flat=True))
-    return ids
-
-
-def _subject_breakdown(student_id: int, subject_id: int, term: str | None = None):
-    """
-    Returns (exam_avg, final_avg, subject_avg) for one student/subject.
-
-    subject_avg = average of ALL available exam+final scores.
-    (Daily is not included in the "average" badge unless you change the rule.)
-    """
-    qs = Grade.objects.filter(student_id=student_id, subject_id=subject_id)
-    if term:
-        qs = qs.filter(term=term)
-
-    exams = list(qs.filter(type="exam").values_list("score", flat=True))
-    finals = list(qs.filter(type="final").values_list("score", flat=True))
-
-    def avg(arr):
-        return round(sum(arr) / len(arr), 2) if arr else None
-
-    exam_avg = avg(exams)
-    final_avg = avg(finals)
-    all_scores = exams + finals
-    subject_avg = avg(all_scores)
-    return exam_avg, final_avg, subject_avg
-
-
-def _subject_score_for_student(student_id: int, subject_id: int, term: str | None = None):
-    """
-    Representative score used in overall average:
-      - Latest FINAL score if available
-      - else average of EXAM scores
-      - else None
-
-    (Daily is not used here by design.)
-    """
-    qs = Grade.objects.filter(student_id=student_id, subject_id=subject_id)
-    if term:
-        qs = qs.filter(term=term)
-
-    final = qs.filter(type="final").order_by("-date", "-id").first()
-    if final and final.score is not None:
-        return float(final.score)
-
-    exam_scores = list(qs.filter(type="exam").values_list("score", flat=True))
-    if exam_scores:
-        return float(sum(exam_scores) / len(exam_scores))
-
-    return None
-
-
 # =========================
 # CRUD ViewSets
 # =========================
@@ -222,23 +178,179 @@ class SchoolClassViewSet(viewsets.ModelViewSet):
         return start, end
 
     # ---- Attendance grid for a class (Mon..Sat) ----
+    # day aggregate = worst lesson status of the day
+    DAY_STATUS_SEVERITY = {"present": 0, "excused": 1, "late": 2, "absent": 3}
+    ATTENDANCE_GRID_MAX_WEEKS = 8
+
     @action(detail=True, methods=["get"])
     def attendance_grid(self, request, pk=None):
+        """
+        GET /api/classes/{id}/attendance_grid/?week_of=YYYY-MM-DD&weeks=1&mode=lessons
+          - grid:    {student_id: {date: status}} — per-day aggregate computed
+                     in SQL (absent > late > excused > present)
+          - mode=lessons adds the exact per-lesson cells:
+              slots:   {date: [{"slot", "schedule", "subject", "start_time"}]}
+              lessons: {student_id: {date: {slot: status}}}
+            slot = schedule id, or "s<subject_id>" for legacy rows without schedule.
+        """
         d = request.query_params.get("week_of")
-        anchor = date.fromisoformat(d) if d else date.today()
-        start, end = self._week_range(anchor)
+        try:
+            anchor = date.fromisoformat(d) if d else date.today()
+            weeks = int(request.query_params.get("weeks") or 1)
+        except ValueError:
+            return Response({"detail": "week_of must be YYYY-MM-DD, weeks an integer"}, status=400)
+        weeks = min(max(weeks, 1), self.ATTENDANCE_GRID_MAX_WEEKS)
+        start, _ = self._week_range(anchor)
+        end = start + timedelta(weeks=weeks - 1, days=5)
 
         students = list(
             Student.objects.filter(clazz_id=pk)
             .order_by("last_name", "first_name")
             .values("id", "first_name", "last_name")
         )
-        att = Attendance.objects.filter(clazz_id=pk, date__range=(start, end))
+        att = Attendance.objects.filter(clazz_id=pk, date__range=(start, end)).order_by()
+
+        status_of = {v: k for k, v in self.DAY_STATUS_SEVERITY.items()}
+        day_rows = (
+            att.values("student_id", "date")
+            .annotate(
+                severity=Max(
+                    Case(
+                        *[When(status=k, then=Value(v)) for k, v in self.DAY_STATUS_SEVERITY.items()],
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    )
+                )
+            )
+            .values_list("student_id", "date", "severity")
+        )
         grid = defaultdict(dict)
-        for a in att:
-            grid[a.student_id][a.date.isoformat()] = a.status
-        days = [(start + timedelta(days=i)).isoformat() for i in range(6)]
-        return Response({"students": students, "days": days, "grid": grid})
+        for student_id, day, severity in day_rows:
+            grid[student_id][day.isoformat()] = status_of[severity]
+
+        days = [
+            (start + timedelta(weeks=w, days=i)).isoformat()
+            for w in range(weeks)
+            for i in range(6)
+        ]
+        payload = {"students": students, "days": days, "grid": grid}
+
+        if request.query_params.get("mode") == "lessons":
+            slots = defaultdict(dict)
+            lessons = defaultdict(lambda: defaultdict(dict))
+            rows = att.order_by("date", "schedule__start_time", "subject_id").values_list(
+                "student_id", "date", "schedule_id", "subject_id", "schedule__start_time", "status"
+            )
+            for student_id, day, schedule_id, subject_id, start_time, st in rows:
+                day = day.isoformat()
+                slot = str(schedule_id) if schedule_id else f"s{subject_id}"
+                lessons[student_id][day][slot] = st
+                if slot not in slots[day]:
+                    slots[day][slot] = {
+                        "slot": slot,
+                        "schedule": schedule_id,
+                        "subject": subject_id,
+                        "start_time": start_time.strftime("%H:%M") if start_time else None,
+                    }
+            payload["slots"] = {day: list(v.values()) for day, v in slots.items()}
+            payload["lessons"] = lessons
+
+        return Response(payload)
+
+    # ---- Unified gradebook (columnar) ----
+    GRADEBOOK_COLUMNS = ["student", "subject", "date", "type", "score", "id"]
+    GRADEBOOK_CHUNK = 2000
+
+    @action(detail=True, methods=["get"])
+    def gradebook(self, request, pk=None):
+        """
+        GET /api/classes/{id}/gradebook/?types=exam,final,daily&term=&from=&to=&stream=1
+        Columnar matrix (students × subjects × dates), built from values_list:
+          {
+            "students": [{"id", "first_name", "last_name"}],
+            "subjects": [{"id", "name"}],
+            "dates":    ["YYYY-MM-DD"],
+            "types":    ["exam", ...],
+            "columns":  ["student", "subject", "date", "type", "score", "id"],
+            "cells":    [[student_idx, subject_idx, date_idx, type_idx, score, grade_id], ...]
+          }
+        Indexes point into the dimension arrays. ?stream=1 streams the same
+        JSON document chunk by chunk (whole-year gradebooks).
+        """
+        qp = request.query_params
+        valid_types = [k for k, _ in Grade.TYPE]
+        types = [t for t in (qp.get("types") or "exam,final").split(",") if t]
+        if not types or any(t not in valid_types for t in types):
+            return Response({"detail": f"types must be a subset of {','.join(valid_types)}"}, status=400)
+        try:
+            d1 = date.fromisoformat(qp["from"]) if qp.get("from") else None
+            d2 = date.fromisoformat(qp["to"]) if qp.get("to") else None
+        except ValueError:
+            return Response({"detail": "invalid date (YYYY-MM-DD)"}, status=400)
+
+        grades = Grade.objects.filter(student__clazz_id=pk, type__in=types).order_by()
+        if qp.get("term"):
+            grades = grades.filter(term=qp["term"])
+        if d1:
+            grades = grades.filter(date__gte=d1)
+        if d2:
+            grades = grades.filter(date__lte=d2)
+
+        students = list(
+            Student.objects.filter(clazz_id=pk)
+            .order_by("last_name", "first_name")
+            .values("id", "first_name", "last_name")
+        )
+        subjects = list(
+            Subject.objects.filter(id__in=grades.values("subject_id"))
+            .order_by("name")
+            .values("id", "name")
+        )
+        dates = list(grades.order_by("date").values_list("date", flat=True).distinct())
+
+        student_ix = {r["id"]: i for i, r in enumerate(students)}
+        subject_ix = {r["id"]: i for i, r in enumerate(subjects)}
+        date_ix = {d: i for i, d in enumerate(dates)}
+        type_ix = {t: i for i, t in enumerate(types)}
+
+        header = {
+            "students": students,
+            "subjects": subjects,
+            "dates": [d.isoformat() for d in dates],
+            "types": types,
+            "columns": self.GRADEBOOK_COLUMNS,
+        }
+        rows = (
+            grades.order_by("date", "id")
+            .values_list("student_id", "subject_id", "date", "type", "score", "id")
+        )
+
+        def cells(it):
+            # the cell read is a later query than the header (and streams
+            # lazily), so grades written in between may point outside the
+            # header's dimensions: those are skipped, never a KeyError mid-stream
+            for student_id, subject_id, day, typ, score, grade_id in it:
+                ix = (student_ix.get(student_id), subject_ix.get(subject_id), date_ix.get(day))
+                if None in ix:
+                    continue
+                yield [*ix, type_ix[typ], score, grade_id]
+
+        if qp.get("stream") not in ("1", "true"):
+            return Response({**header, "cells": list(cells(rows))})
+
+        def stream():
+            yield json.dumps(header)[:-1] + ', "cells": ['
+            buf, first = [], True
+            for cell in cells(rows.iterator(chunk_size=self.GRADEBOOK_CHUNK)):
+                buf.append(json.dumps(cell))
+                if len(buf) >= self.GRADEBOOK_CHUNK:
+                    yield ("" if first else ",") + ",".join(buf)
+                    buf, first = [], False
+            if buf:
+                yield ("" if first else ",") + ",".join(buf)
+            yield "]}"
+
+        return StreamingHttpResponse(stream(), content_type="application/json")
 
     # ---- Exam gradebook ----
     @action(detail=True, methods=["get"])
@@ -248,10 +360,9 @@ class SchoolClassViewSet(viewsets.ModelViewSet):
         if term:
             grades = grades.filter(term=term)
         data = defaultdict(list)
-        for g in grades.order_by("date"):
-            data[g.student_id].append(
-                {"subject": g.subject_id, "date": g.date, "score": g.score}
-            )
+        rows = grades.order_by("date").values_list("student_id", "subject_id", "date", "score")
+        for student_id, subject_id, day, score in rows:
+            data[student_id].append({"subject": subject_id, "date": day, "score": score})
         return Response(data)
 
     # ---- Final gradebook ----
@@ -262,10 +373,9 @@ class SchoolClassViewSet(viewsets.ModelViewSet):
         if term:
             grades = grades.filter(term=term)
         data = defaultdict(list)
-        for g in grades.order_by("date"):
-            data[g.student_id].append(
-                {"subject": g.subject_id, "date": g.date, "score": g.score}
-            )
+        rows = grades.order_by("date").values_list("student_id", "subject_id", "date", "score")
+        for student_id, subject_id, day, score in rows:
+            data[student_id].append({"subject": subject_id, "date": day, "score": score})
         return Response(data)
 
     # ---- Average ranking for a class ----
@@ -275,35 +385,10 @@ class SchoolClassViewSet(viewsets.ModelViewSet):
         GET /api/classes/{id}/average_ranking/?term=2025-1 (optional)
         Ranking by arithmetic average across the class's subjects.
         Subject score = latest FINAL else average of EXAMs.
+        Served from the cached per-(class, term) snapshot (see scores.class_rank_snapshot).
         """
         term = request.query_params.get("term") or None
-
-        students = Student.objects.filter(clazz_id=pk).order_by(
-            "last_name", "first_name"
-        )
-        subject_ids = _subjects_for_class(pk)
-
-        ranking = []
-        for s in students:
-            scores = []
-            for sid in subject_ids:
-                sc = _subject_score_for_student(s.id, sid, term=term)
-                if sc is not None:
-                    scores.append(sc)
-            avg = (sum(scores) / len(scores)) if scores else 0.0
-            ranking.append(
-                {
-                    "student_id": s.id,
-                    "name": f"{s.last_name} {s.first_name}",
-                    "avg": round(avg, 2),
-                    "count_subjects": len(scores),
-                }
-            )
-
-        ranking.sort(key=lambda x: x["avg"], reverse=True)
-        for i, row in enumerate(ranking, start=1):
-            row["rank"] = i
-
+        ranking = class_rank_snapshot(pk, term=term)
         return Response({"class_id": pk, "ranking": ranking})
 
 
@@ -435,81 +520,195 @@ class AttendanceViewSet(viewsets.ModelViewSet):
 
         return qs
 
-    # ---- bulk mark: used by teacher page ----
-    @action(detail=False, methods=["post"], url_path="bulk-mark")
-    def bulk_mark(self, request):
-        """
-        Payload:
-        {
-          "class": <id>, "date": "YYYY-MM-DD",
-          "schedule": <id or null>,   # NEW (preferred)
-          "subject":  <id or null>,   # legacy fallback
-          "entries": [{"student":id, "status":"present|absent|late|excused", "note":""}]
-        }
-        """
-        u = request.user
-        if getattr(u, "role", None) not in ("admin", "teacher", "registrar", "operator"):
-            return Response({"detail": "Forbidden"}, status=403)
+    # ---- keep AttendanceDailyRollup in sync on CRUD writes ----
+    def perform_create(self, serializer):
+        a = serializer.save()
+        AttendanceDailyRollup.refresh([a.clazz_id], [a.date])
 
-        clazz = request.data.get("class")
-        dt = request.data.get("date")
-        schedule_id = request.data.get("schedule")
-        subject = request.data.get("subject")
-        entries = request.data.get("entries", [])
+    def perform_update(self, serializer):
+        old = serializer.instance
+        class_ids, dates = {old.clazz_id}, {old.date}
+        a = serializer.save()
+        AttendanceDailyRollup.refresh(class_ids | {a.clazz_id}, dates | {a.date})
 
-        if not clazz or not dt or not isinstance(entries, list):
-            return Response({"detail": "class, date and entries are required"}, status=400)
+    def perform_destroy(self, instance):
+        clazz_id, day = instance.clazz_id, instance.date
+        instance.delete()
+        AttendanceDailyRollup.refresh([clazz_id], [day])
+
+    # ---- shared bulk engine for bulk_mark / mark ----
+    def _write_marks(self, request, clazz, dt, schedule_id, subject, marks):
+        """
+        Upsert one day's marks for a class in a constant number of queries.
+
+        marks: [(student_id, status, note), ...] — last entry per student wins;
+        ids are coerced with int() ("12" is fine) and unparsable ones are
+        reported back under "invalid".
+        Key per row: (student, date, schedule) when a schedule is given,
+        else legacy (student, date, subject). Only rows whose status/note
+        actually change are written; conflicts on the unique constraints are
+        handled by the insert itself.
+        Returns a Response: {"ok", "ids", "inserted", "updated", "unchanged", "invalid"}.
+        """
         try:
             date.fromisoformat(dt)
         except Exception:
             return Response({"detail": "invalid date (YYYY-MM-DD)"}, status=400)
+        try:
+            clazz = int(clazz)
+        except Exception:
+            return Response({"detail": "class must be an id"}, status=400)
 
-        # Validate/resolve schedule if provided
+        # Validate/resolve schedule once (no lazy self.schedule per row)
         sch = None
         if schedule_id:
-            try:
-                sch = ScheduleEntry.objects.select_related("clazz", "subject").get(
-                    id=schedule_id
-                )
-            except ScheduleEntry.DoesNotExist:
+            sch = (
+                ScheduleEntry.objects.filter(id=schedule_id)
+                .only("id", "clazz_id", "subject_id", "teacher_id")
+                .first()
+            )
+            if sch is None:
                 return Response({"detail": "schedule not found"}, status=404)
-            if int(sch.clazz_id) != int(clazz):
+            if int(sch.clazz_id) != clazz:
                 return Response(
                     {"detail": "schedule does not belong to provided class"}, status=400
                 )
 
+        u = request.user
         try:
             t = u.teacher_profile if getattr(u, "role", None) == "teacher" else None
         except Teacher.DoesNotExist:
             t = None
 
-        ids = []
-        for e in entries:
-            sid = e.get("student")
-            st = e.get("status")
-            if not sid or st not in ("present", "absent", "late", "excused"):
-                continue
+        wanted, invalid = {}, []
+        for sid, st, note in marks:
+            try:
+                wanted[int(sid)] = (st, note)
+            except (TypeError, ValueError):
+                invalid.append(sid)
 
-            # Unique key prefers schedule; else legacy subject
-            key = {"student_id": sid, "date": dt}
-            if sch is not None:
-                key["schedule_id"] = sch.id
+        # Student membership: a single set query
+        members = set(
+            Student.objects.filter(clazz_id=clazz, id__in=list(wanted)).values_list("id", flat=True)
+        )
+        outsiders = [sid for sid in wanted if sid not in members]
+        if outsiders:
+            return Response(
+                {"detail": f"students {outsiders} do not belong to class {clazz}"}, status=400
+            )
+
+        # Unique key prefers schedule; else legacy subject
+        key = {"date": dt}
+        if sch is not None:
+            key["schedule_id"] = sch.id
+        else:
+            key["subject_id"] = subject
+        # what Attendance.save() would fill from the schedule
+        fields = {
+            "clazz_id": clazz,
+            "teacher_id": t.id if t else (sch.teacher_id if sch else None),
+        }
+        if sch is not None:
+            fields["subject_id"] = sch.subject_id
+
+        existing = {}
+        for row_id, sid, st, note in (
+            Attendance.objects.filter(student_id__in=list(wanted), **key)
+            .order_by("id")
+            .values_list("id", "student_id", "status", "note")
+        ):
+            existing.setdefault(sid, (row_id, st, note))
+
+        to_create, to_update, unchanged = [], [], 0
+        for sid, (st, note) in wanted.items():
+            cur = existing.get(sid)
+            if cur is None:
+                to_create.append(Attendance(student_id=sid, status=st, note=note, **key, **fields))
+            elif (cur[1], cur[2]) != (st, note):
+                to_update.append(Attendance(id=cur[0], student_id=sid, status=st, note=note, **key, **fields))
             else:
-                key["subject_id"] = subject
+                unchanged += 1
 
-            defaults = {
-                "status": st,
-                "note": e.get("note", ""),
-                "clazz_id": clazz,
-                "teacher": t,
+        write_fields = ["status", "note", "clazz", "teacher", "subject"]
+        created_ids = {}
+        inserted = len(to_create)
+        with transaction.atomic():
+            if to_create:
+                new_sids = [a.student_id for a in to_create]
+                if sch is not None:
+                    Attendance.objects.bulk_create(
+                        to_create,
+                        update_conflicts=True,
+                        unique_fields=["student", "date", "schedule"],
+                        update_fields=write_fields,
+                    )
+                else:
+                    # legacy key is a partial unique index (no ON CONFLICT target) →
+                    # rows a concurrent request inserted meanwhile keep their marks
+                    # and are not counted as inserted
+                    before = set(
+                        Attendance.objects.filter(student_id__in=new_sids, **key)
+                        .values_list("student_id", flat=True)
+                    )
+                    Attendance.objects.bulk_create(
+                        [a for a in to_create if a.student_id not in before], ignore_conflicts=True
+                    )
+                    inserted = len(to_create) - len(before)
+                created_ids = dict(
+                    Attendance.objects.filter(student_id__in=new_sids, **key).values_list("student_id", "id")
+                )
+                for a in to_create:
+                    a.id = created_ids.get(a.student_id)
+            if to_update:
+                Attendance.objects.bulk_update(to_update, write_fields)
+            if to_create or to_update:
+                AttendanceDailyRollup.refresh([clazz], [dt])
+
+        ids = [existing[sid][0] if sid in existing else created_ids.get(sid) for sid in wanted]
+        return Response(
+            {
+                "ok": True,
+                "ids": ids,
+                "inserted": inserted,
+                "updated": len(to_update),
+                "unchanged": unchanged + len(to_create) - inserted,
+                "invalid": invalid,
             }
-            if sch is not None:
-                defaults.setdefault("subject_id", getattr(sch, "subject_id", None))
+        )
 
-            obj, _ = Attendance.objects.update_or_create(**key, defaults=defaults)
-            ids.append(obj.id)
+    # ---- bulk mark: used by teacher page ----
+    @action(detail=False, methods=["post"], url_path="bulk-mark")
+    def bulk_mark(self, request):
+        """
+        Payload:
+        {
+          "class": <id>, "date": "YYYY-MM-DD",
+          "schedule": <id or null>,   # NEW (preferred)
+          "subject":  <id or null>,   # legacy fallback
+          "entries": [{"student":id, "status":"present|absent|late|excused", "note":""}]
+        }
+        Returns: {"ok": true, "ids": [...], "inserted": n, "updated": n, "unchanged": n, "invalid": [...]}
+        """
+        u = request.user
+        if getattr(u, "role", None) not in ("admin", "teacher", "registrar", "operator"):
+            return Response({"detail": "Forbidden"}, status=403)
+
+        clazz = request.data.get("class")
+        dt = request.data.get("date")
+        entries = request.data.get("entries", [])
 
-        return Response({"ok": True, "ids": ids})
+        if not clazz or not dt or not isinstance(entries, list):
+            return Response({"detail": "class, date and entries are required"}, status=400)
+
+        marks = [
+            (e.get("student"), e.get("status"), e.get("note", ""))
+            for e in entries
+            if isinstance(e, dict) and e.get("student")
+            and e.get("status") in ("present", "absent", "late", "excused")
+        ]
+        return self._write_marks(
+            request, clazz, dt, request.data.get("schedule"), request.data.get("subject"), marks
+        )
 
     # ---- simple mark: used by operator page (boolean present) ----
     @action(detail=False, methods=["post"], url_path="mark")
@@ -523,6 +722,7 @@ class AttendanceViewSet(viewsets.ModelViewSet):
           "subject":  <id or null>,   # legacy fallback
           "items": [{"student": id, "present": true|false}]
         }
+        Returns: {"ok": true, "ids": [...], "inserted": n, "updated": n, "unchanged": n, "invalid": [...]}
         """
         u = request.user
         if getattr(u, "role", None) not in ("admin", "registrar", "operator", "teacher"):
@@ -530,58 +730,21 @@ class AttendanceViewSet(viewsets.ModelViewSet):
 
         clazz = request.data.get("class_id")
         dt = request.data.get("date")
-        schedule_id = request.data.get("schedule")
-        subject = request.data.get("subject")
         items = request.data.get("items", [])
 
         if not clazz or not dt or not isinstance(items, list):
             return Response(
                 {"detail": "class_id, date and items are required"}, status=400
             )
-        try:
-            date.fromisoformat(dt)
-        except Exception:
-            return Response({"detail": "invalid date (YYYY-MM-DD)"}, status=400)
-
-        sch = None
-        if schedule_id:
-            try:
-                sch = ScheduleEntry.objects.select_related("clazz", "subject").get(
-                    id=schedule_id
-                )
-            except ScheduleEntry.DoesNotExist:
-                return Response({"detail": "schedule not found"}, status=404)
-            if int(sch.clazz_id) != int(clazz):
-                return Response(
-                    {"detail": "schedule does not belong to provided class"}, status=400
-                )
-
-        try:
-            t = u.teacher_profile if getattr(u, "role", None) == "teacher" else None
-        except Teacher.DoesNotExist:
-            t = None
-
-        ids = []
-        for it in items:
-            sid = it.get("student")
-            if not sid:
-                continue
-            status_val = "present" if bool(it.get("present")) else "absent"
 
-            key = {"student_id": sid, "date": dt}
-            if sch is not None:
-                key["schedule_id"] = sch.id
-            else:
-                key["subject_id"] = subject
-
-            defaults = {"status": status_val, "note": "", "clazz_id": clazz, "teacher": t}
-            if sch is not None:
-                defaults.setdefault("subject_id", getattr(sch, "subject_id", None))
-
-            obj, _ = Attendance.objects.update_or_create(**key, defaults=defaults)
-            ids.append(obj.id)
-
-        return Response({"ok": True, "ids": ids})
+        marks = [
+            (it.get("student"), "present" if bool(it.get("present")) else "absent", "")
+            for it in items
+            if isinstance(it, dict) and it.get("student")
+        ]
+        return self._write_marks(
+            request, clazz, dt, request.data.get("schedule"), request.data.get("subject"), marks
+        )
 
     # ---- read back saved marks for a class/day (+ optional schedule/subject) ----
     @action(detail=False, methods=["get"], url_path="by-class-day")
@@ -614,6 +777,12 @@ class AttendanceViewSet(viewsets.ModelViewSet):
     # ---- "Kelmaganlar" list (1 row per student for the day) ----
     @action(detail=False, methods=["get"], url_path="absent")
     def absent(self, request):
+        """
+        GET /api/attendance/absent/?date=YYYY-MM-DD&class=<id?>
+        Read from AttendanceDailyRollup: one indexed read for the day's
+        rollups + one read for the absent students (teachers: + one read of
+        the absences they marked themselves, e.g. as a substitute).
+        """
         date_str = request.query_params.get("date")
         if not date_str:
             return Response({"detail": "date is required (YYYY-MM-DD)"}, status=400)
@@ -622,37 +791,57 @@ class AttendanceViewSet(viewsets.ModelViewSet):
         except Exception:
             return Response({"detail": "invalid date (YYYY-MM-DD)"}, status=400)
 
+        rollups = AttendanceDailyRollup.objects.filter(
+            date=date_str, absent_students__gt=0
+        ).select_related("clazz")
         class_id = request.query_params.get("class")
-        base_qs = self.get_queryset().filter(date=date_str, status="absent")
         if class_id:
-            base_qs = base_qs.filter(clazz_id=class_id)
+            rollups = rollups.filter(clazz_id=class_id)
 
-        ids_qs = (
-            base_qs.values("student_id")
-            .annotate(first_id=Min("id"))
-            .values_list("first_id", flat=True)
-        )
-        qs = Attendance.objects.filter(id__in=ids_qs).select_related("student", "clazz")
+        u = request.user
+        role = getattr(u, "role", None)
+        child_ids = None
+        marked = []   # teacher: absences they marked outside their own classes (substitute lessons)
+        if role == "teacher":
+            try:
+                t = u.teacher_profile
+            except Teacher.DoesNotExist:
+                return Response([])
+            rollups = rollups.filter(
+                Q(clazz__class_teacher=t)
+                | Exists(ScheduleEntry.objects.filter(clazz_id=OuterRef("clazz_id"), teacher=t))
+            )
+            marked = Attendance.objects.filter(date=date_str, status="absent", teacher=t)
+            if class_id:
+                marked = marked.filter(clazz_id=class_id)
+            marked = marked.order_by("id").values_list("student_id", "clazz__name")
+        elif role == "parent":
+            child_ids = set(
+                StudentGuardian.objects.filter(guardian=u).values_list("student_id", flat=True)
+            )
+
+        class_of = {}
+        for r in rollups:
+            for sid in r.absent_student_ids:
+                if child_ids is None or sid in child_ids:
+                    class_of.setdefault(sid, r.clazz.name)
+        for sid, class_name in marked:
+            class_of.setdefault(sid, class_name or "")
 
+        students = Student.objects.filter(id__in=list(class_of)).values(
+            "id", "first_name", "last_name", "parent_phone"
+        )
         rows = []
-        for a in qs:
-            s = a.student
+        for s in sorted(students, key=lambda x: x["id"]):
             full_name = (
-                f"{getattr(s, 'last_name', '')} {getattr(s, 'first_name', '')}".strip()
-                or getattr(s, "full_name", "")
-                or f"#{s.id}"
-            )
-            class_name = (
-                a.clazz.name
-                if a.clazz
-                else (getattr(s.clazz, "name", "") if getattr(s, "clazz", None) else "")
+                f"{s['last_name'] or ''} {s['first_name'] or ''}".strip() or f"#{s['id']}"
             )
             rows.append(
                 {
-                    "student_id": s.id,
+                    "student_id": s["id"],
                     "full_name": full_name,
-                    "class_name": class_name,
-                    "parent_phone": getattr(s, "parent_phone", "") or "",
+                    "class_name": class_of[s["id"]],
+                    "parent_phone": s["parent_phone"] or "",
                 }
             )
         return Response(rows)
@@ -699,7 +888,25 @@ class GradeViewSet(viewsets.ModelViewSet):
         # Admin/registrar/operator/accountant can see all
         return qs
 
+    # --------- Keep StudentSubjectScore in sync on CRUD writes ---------
+    def perform_create(self, serializer):
+        g = serializer.save()
+        sync_grade_scores([g.student_id], [g.subject_id])
+
+    def perform_update(self, serializer):
+        old = serializer.instance
+        students, subjects = {old.student_id}, {old.subject_id}
+        g = serializer.save()
+        sync_grade_scores(students | {g.student_id}, subjects | {g.subject_id})
+
+    def perform_destroy(self, instance):
+        student_id, subject_id = instance.student_id, instance.subject_id
+        instance.delete()
+        sync_grade_scores([student_id], [subject_id])
+
     # --------- WRITE: Bulk set daily|exam|final (atomic) ---------
+    BULK_SET_MAX_ENTRIES = 2000
+
     @action(detail=False, methods=["post"], url_path="bulk-set")
     def bulk_set(self, request):
         """
@@ -707,8 +914,16 @@ class GradeViewSet(viewsets.ModelViewSet):
         {
           "class": <id>, "date":"YYYY-MM-DD", "subject": <id>,
           "type":"daily|exam|final", "term":"2025-1",
-          "entries":[{"student":<id>, "score":2..5, "comment":""}, ...]   # max 300 per call
+          "entries":[{"student":<id>, "score":2..5, "comment":""}, ...]   # max 2000 per call
         }
+        Each entry may also carry its own "subject" and/or "date" (overriding the
+        top-level ones), so a whole gradebook sheet can be sent in one request.
+
+        Rows are matched on (student, subject, date, type): existing rows are read
+        in one query, new ones go through bulk_create, changed ones through
+        bulk_update and unchanged ones are skipped — the query count does not
+        depend on the number of entries.
+        Returns: {"ok": true, "ids": [...], "created": n, "updated": n, "unchanged": n}
         """
         u = request.user
         role = getattr(u, "role", None)
@@ -724,12 +939,14 @@ class GradeViewSet(viewsets.ModelViewSet):
         entries = data.get("entries") or []
 
         # Basic checks
-        if not clazz or not dt_str or not subject_id:
+        if not clazz:
             return Response({"detail": "class, date and subject are required"}, status=400)
-        try:
-            dt = date.fromisoformat(dt_str)
-        except Exception:
-            return Response({"detail": "invalid date (use YYYY-MM-DD)"}, status=400)
+        default_dt = None
+        if dt_str:
+            try:
+                default_dt = date.fromisoformat(dt_str)
+            except Exception:
+                return Response({"detail": "invalid date (use YYYY-MM-DD)"}, status=400)
 
         allowed = ("exam", "final") + (("daily",) if ALLOW_DAILY else ())
         if gtype not in allowed:
@@ -746,16 +963,15 @@ class GradeViewSet(viewsets.ModelViewSet):
 
         if not isinstance(entries, list) or not entries:
             return Response({"detail": "entries must be a non-empty list"}, status=400)
-        if len(entries) > 300:
-            return Response({"detail": "too many entries (max 300 per request)"}, status=400)
+        if len(entries) > self.BULK_SET_MAX_ENTRIES:
+            return Response(
+                {"detail": f"too many entries (max {self.BULK_SET_MAX_ENTRIES} per request)"},
+                status=400,
+            )
 
         if term and len(term) > 20:
             return Response({"detail": "term is too long (max 20 characters)"}, status=400)
 
-        # Validate subject exists
-        if not Subject.objects.filter(id=subject_id).exists():
-            return Response({"detail": "subject not found"}, status=404)
-
         # Validate class exists & preload students
         class_student_ids = set(
             Student.objects.filter(clazz_id=clazz).values_list("id", flat=True)
@@ -763,24 +979,6 @@ class GradeViewSet(viewsets.ModelViewSet):
         if not class_student_ids:
             return Response({"detail": "class not found or has no students"}, status=404)
 
-        # If teacher, ensure they are allowed to write this class/subject
-        teacher_obj = None
-        if role == "teacher":
-            try:
-                teacher_obj = u.teacher_profile
-            except Teacher.DoesNotExist:
-                teacher_obj = None
-            allowed_scope = (
-                SchoolClass.objects.filter(id=clazz, class_teacher=teacher_obj).exists()
-                or ScheduleEntry.objects.filter(
-                    clazz_id=clazz, subject_id=subject_id, teacher=teacher_obj
-                ).exists()
-            )
-            if not allowed_scope:
-                return Response(
-                    {"detail": "Forbidden: not assigned to this class/subject"}, status=403
-                )
-
         # Validate all entries first (no partial writes)
         seen = set()
         cleaned = []
@@ -797,12 +995,29 @@ class GradeViewSet(viewsets.ModelViewSet):
                     status=400,
                 )
 
+            e_subject = e.get("subject", subject_id)
+            e_date = default_dt
+            if e.get("date"):
+                try:
+                    e_date = date.fromisoformat(str(e["date"]).strip())
+                except Exception:
+                    return Response(
+                        {"detail": f"entries[{i}].date invalid (use YYYY-MM-DD)"}, status=400
+                    )
+            if not e_subject or e_date is None:
+                return Response({"detail": "class, date and subject are required"}, status=400)
+            try:
+                e_subject = int(e_subject)
+            except Exception:
+                return Response({"detail": f"entries[{i}].subject must be an id"}, status=400)
+
             # avoid duplicate student rows in one payload
-            if sid in seen:
+            key = (sid, e_subject, e_date)
+            if key in seen:
                 return Response(
                     {"detail": f"duplicate entry for student {sid} in payload"}, status=400
                 )
-            seen.add(sid)
+            seen.add(key)
 
             # score must be int in 2..5
             try:
@@ -820,27 +1035,79 @@ class GradeViewSet(viewsets.ModelViewSet):
                     {"detail": f"entries[{i}].comment too long (max 255)"}, status=400
                 )
 
-            cleaned.append((sid, score_int, comment))
+            cleaned.append((key, score_int, comment))
+
+        subject_ids = {key[1] for key, _, _ in cleaned}
+
+        # Validate subjects exist
+        if Subject.objects.filter(id__in=subject_ids).count() != len(subject_ids):
+            return Response({"detail": "subject not found"}, status=404)
+
+        # If teacher, ensure they are allowed to write this class/subject(s)
+        teacher_obj = None
+        if role == "teacher":
+            try:
+                teacher_obj = u.teacher_profile
+            except Teacher.DoesNotExist:
+                teacher_obj = None
+            if not SchoolClass.objects.filter(id=clazz, class_teacher=teacher_obj).exists():
+                taught = set(
+                    ScheduleEntry.objects.filter(
+                        clazz_id=clazz, subject_id__in=subject_ids, teacher=teacher_obj
+                    ).values_list("subject_id", flat=True)
+                )
+                if taught != subject_ids:
+                    return Response(
+                        {"detail": "Forbidden: not assigned to this class/subject"}, status=403
+                    )
+        teacher_id = teacher_obj.id if teacher_obj else None
+
+        # One read for every (student, subject, date) touched by the payload
+        existing = {}
+        for g in Grade.objects.filter(
+            student_id__in={key[0] for key in seen},
+            subject_id__in=subject_ids,
+            date__in={key[2] for key in seen},
+            type=gtype,
+        ).order_by("id").only("id", "student_id", "subject_id", "date", "score", "comment", "teacher_id", "term"):
+            existing.setdefault((g.student_id, g.subject_id, g.date), g)
+
+        to_create, to_update, unchanged = [], [], 0
+        rows = []
+        for key, score_int, comment in cleaned:
+            g = existing.get(key)
+            if g is None:
+                g = Grade(
+                    student_id=key[0], subject_id=key[1], date=key[2], type=gtype,
+                    score=score_int, comment=comment, teacher_id=teacher_id, term=term,
+                )
+                to_create.append(g)
+            elif (g.score, g.comment, g.teacher_id, g.term) != (score_int, comment, teacher_id, term):
+                g.score, g.comment, g.teacher_id, g.term = score_int, comment, teacher_id, term
+                to_update.append(g)
+            else:
+                unchanged += 1
+            rows.append(g)
 
         # Atomic upsert
-        ids = []
         with transaction.atomic():
-            for sid, score_int, comment in cleaned:
-                obj, _ = Grade.objects.update_or_create(
-                    student_id=sid,
-                    subject_id=subject_id,
-                    date=dt,
-                    type=gtype,  # daily | exam | final
-                    defaults={
-                        "score": score_int,
-                        "comment": comment,
-                        "teacher": teacher_obj if role == "teacher" else None,
-                        "term": term,
-                    },
-                )
-                ids.append(obj.id)
+            if to_create:
+                Grade.objects.bulk_create(to_create)
+            if to_update:
+                Grade.objects.bulk_update(to_update, ["score", "comment", "teacher", "term"])
+            if gtype != "daily" and (to_create or to_update):
+                sync_grade_scores({key[0] for key in seen}, subject_ids)
 
-        return Response({"ok": True, "ids": ids}, status=200)
+        return Response(
+            {
+                "ok": True,
+                "ids": [g.id for g in rows],
+                "created": len(to_create),
+                "updated": len(to_update),
+                "unchanged": unchanged,
+            },
+            status=200,
+        )
 
     # --------- READ: Filtered list for a class ---------
     @action(detail=False, methods=["get"], url_path="by-class")
@@ -995,7 +1262,7 @@ class GradeViewSet(viewsets.ModelViewSet):
 
         # subjects for this student's class
         subj_ids = (
-            _subjects_for_class(s.clazz_id)
+            subjects_for_class(s.clazz_id)
             if s.clazz_id
             else list(Subject.objects.values_list("id", flat=True))
         )
@@ -1100,7 +1367,7 @@ class ParentViewSet(viewsets.ViewSet):
 
         # ---- Average-based summary (exam+final) ----
         subject_ids = (
-            _subjects_for_class(s.clazz_id)
+            subjects_for_class(s.clazz_id)
             if s.clazz_id
             else list(Subject.objects.values_list("id", flat=True))
         )
@@ -1110,22 +1377,24 @@ class ParentViewSet(viewsets.ViewSet):
         subject_scores = {}
         scores_for_overall = []
 
+        score_rows = student_subject_scores(s.id, subject_ids, term=None)
         for sid in subject_ids:
-            exam_avg, final_avg, subject_avg = _subject_breakdown(s.id, sid, term=None)
+            row = score_rows.get(sid)
+            if row is None:
+                continue
             # show only if there is at least one score
-            if exam_avg is not None or final_avg is not None:
+            if row.exam_avg is not None or row.final_avg is not None:
                 nm = names.get(sid, f"Subject #{sid}")
                 grades_summary[nm] = {
-                    "exam_avg": exam_avg,
-                    "final_avg": final_avg,
-                    "subject_avg": subject_avg,
-                    "gpa_subject": subject_avg,
+                    "exam_avg": row.exam_avg,
+                    "final_avg": row.final_avg,
+                    "subject_avg": row.subject_avg,
+                    "gpa_subject": row.subject_avg,
                 }
             # representative score for overall
-            rep = _subject_score_for_student(s.id, sid, term=None)
-            if rep is not None:
-                subject_scores[nm] = round(rep, 2)
-                scores_for_overall.append(rep)
+            if row.score is not None:
+                subject_scores[nm] = round(row.score, 2)
+                scores_for_overall.append(row.score)
 
         avg_overall = (
             round(sum(scores_for_overall) / len(scores_for_overall), 2)
@@ -1133,15 +1402,11 @@ class ParentViewSet(viewsets.ViewSet):
             else 0.0
         )
 
-        # Rank inside the class using the same averaging rule
-        ranking = (
-            SchoolClassViewSet().average_ranking(request, pk=s.clazz_id).data["ranking"]
-            if s.clazz_id
-            else []
-        )
+        # Rank inside the class from the cached class snapshot (same averaging rule)
+        ranking = class_rank_snapshot(s.clazz_id) if s.clazz_id else []
         my_row = next((r for r in ranking if r["student_id"] == s.id), None)
         my_rank = my_row["rank"] if my_row else None
-        class_size = s.clazz.students.count() if s.clazz else 0
+        class_size = len(ranking)
 
         payload = {
             "student": StudentSerializer(s).data,
@@ -1158,6 +1423,36 @@ class ParentViewSet(viewsets.ViewSet):
         return Response(payload)
 
 
+class ReportCardView(APIView):
+    """
+    GET /api/report-cards/<student_id>/?term=2025-1
+    Precomputed term report card (manage.py generate_report_cards).
+    With ?term= returns one card, otherwise every term of the student.
+    Parents may read their own children only.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, student_id):
+        u = request.user
+        role = getattr(u, "role", "")
+        if role == "parent":
+            if not StudentGuardian.objects.filter(guardian=u, student_id=student_id).exists():
+                return Response({"detail": "Forbidden"}, status=403)
+        elif role not in ("admin", "registrar", "operator", "teacher"):
+            return Response({"detail": "Forbidden"}, status=403)
+
+        cards = ReportCardSnapshot.objects.filter(student_id=student_id).select_related(
+            "student", "clazz"
+        )
+        term = request.query_params.get("term")
+        if term:
+            card = cards.filter(term=term).first()
+            if card is None:
+                return Response({"detail": "Report card not generated yet"}, status=404)
+            return Response(ReportCardSnapshotSerializer(card).data)
+        return Response(ReportCardSnapshotSerializer(cards.order_by("term"), many=True).data)
+
+
 class GradeScaleViewSet(viewsets.ModelViewSet):
     """
     Retained for compatibility with existing routes; not used by average logic.
@@ -1401,6 +1696,144 @@ class SchoolStatsView(APIView):
         })
 
 
+class LeaderboardView(APIView):
+    """
+    GET /api/stats/leaderboard/?term=2025-1&level=7&limit=50&after=<cursor>
+    School-wide (or per grade level) ranking by the same average rule as
+    average_ranking, computed in the database:
+      - avg per student from StudentSubjectScore (class subjects only)
+      - class_rank = RANK() OVER (PARTITION BY clazz ORDER BY avg DESC)
+      - rank       = RANK() OVER (ORDER BY avg DESC)
+    Keyset pagination on (rank, student_id): pass "next" back as ?after=.
+    Returns: {"results": [{student_id, name, class_id, class_name, level,
+                           avg, count_subjects, class_rank, rank}], "next": "<cursor>|null"}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+
+    def get(self, request):
+        role = getattr(request.user, "role", "")
+        if role not in ("admin", "registrar", "operator", "teacher"):
+            return Response({"detail": "Forbidden"}, status=403)
+
+        qp = request.query_params
+        term = qp.get("term") or StudentSubjectScore.ALL_TERMS
+        try:
+            limit = min(max(int(qp.get("limit") or self.DEFAULT_LIMIT), 1), self.MAX_LIMIT)
+            level = int(qp["level"]) if qp.get("level") else None
+            after = [int(x) for x in qp["after"].split(":")] if qp.get("after") else None
+        except ValueError:
+            return Response({"detail": "level, limit and after must be integers"}, status=400)
+        if after is not None and len(after) != 2:
+            return Response({"detail": "invalid after cursor"}, status=400)
+
+        # Per-student subject scores restricted to the class's subjects
+        # (all subjects when the class has no schedule yet, as subjects_for_class).
+        class_schedule = ScheduleEntry.objects.filter(clazz_id=OuterRef(OuterRef("clazz_id")))
+        scores = (
+            StudentSubjectScore.objects.filter(
+                student_id=OuterRef("pk"), term=term, score__isnull=False
+            )
+            .filter(Q(subject_id__in=class_schedule.values("subject_id")) | ~Exists(class_schedule))
+            .order_by()
+            .values("student_id")
+        )
+
+        students = Student.objects.filter(clazz__isnull=False)
+        if level is not None:
+            students = students.filter(clazz__level=level)
+
+        qs = (
+            students.annotate(
+                avg=Coalesce(Subquery(scores.annotate(a=Avg("score")).values("a")), Value(0.0)),
+                count_subjects=Coalesce(Subquery(scores.annotate(n=Count("id")).values("n")), Value(0)),
+            )
+            .annotate(
+                class_rank=Window(Rank(), partition_by=[F("clazz_id")], order_by=F("avg").desc()),
+                rank=Window(Rank(), order_by=F("avg").desc()),
+            )
+            .order_by("rank", "id")
+        )
+        if after:
+            qs = qs.filter(Q(rank__gt=after[0]) | Q(rank=after[0], id__gt=after[1]))
+
+        rows = list(
+            qs.values(
+                "id", "first_name", "last_name", "clazz_id", "clazz__name", "clazz__level",
+                "avg", "count_subjects", "class_rank", "rank",
+            )[: limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = [
+            {
+                "student_id": r["id"],
+                "name": f"{r['last_name']} {r['first_name']}",
+                "class_id": r["clazz_id"],
+                "class_name": r["clazz__name"],
+                "level": r["clazz__level"],
+                "avg": round(r["avg"] or 0.0, 2),
+                "count_subjects": r["count_subjects"],
+                "class_rank": r["class_rank"],
+                "rank": r["rank"],
+            }
+            for r in rows
+        ]
+        next_cursor = f"{rows[-1]['rank']}:{rows[-1]['id']}" if has_more else None
+        return Response({"results": results, "next": next_cursor})
+
+
+class AttendanceStatsView(APIView):
+    """
+    GET /api/stats/attendance/?from=YYYY-MM-DD&to=YYYY-MM-DD&class=<id?>
+    School-wide (or per class) attendance per day, read from
+    AttendanceDailyRollup (one indexed range read). Defaults to today.
+    Returns:
+    {
+      "from": "YYYY-MM-DD", "to": "YYYY-MM-DD",
+      "totals": {"present", "absent", "late", "excused", "absent_students"},
+      "days": [{"date", "present", "absent", "late", "excused", "absent_students"}]
+    }
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    MAX_DAYS = 366
+
+    def get(self, request):
+        role = getattr(request.user, "role", "")
+        if role not in ("admin", "registrar", "operator", "teacher"):
+            return Response({"detail": "Forbidden"}, status=403)
+
+        qp = request.query_params
+        try:
+            d1 = date.fromisoformat(qp["from"]) if qp.get("from") else date.today()
+            d2 = date.fromisoformat(qp["to"]) if qp.get("to") else d1
+        except ValueError:
+            return Response({"detail": "invalid date (YYYY-MM-DD)"}, status=400)
+        if d2 < d1 or (d2 - d1).days >= self.MAX_DAYS:
+            return Response({"detail": f"range must be 1..{self.MAX_DAYS} days"}, status=400)
+
+        rollups = AttendanceDailyRollup.objects.filter(date__gte=d1, date__lte=d2)
+        if qp.get("class"):
+            rollups = rollups.filter(clazz_id=qp["class"])
+
+        fields = ("present", "absent", "late", "excused", "absent_students")
+        per_day = (
+            rollups.order_by()
+            .values("date")
+            .annotate(**{f"n_{f}": Coalesce(models.Sum(f), 0) for f in fields})
+            .order_by("date")
+        )
+        days = [
+            {"date": r["date"].isoformat(), **{f: r[f"n_{f}"] for f in fields}}
+            for r in per_day
+        ]
+        totals = {f: sum(d[f] for d in days) for f in fields}
+
+        return Response({"from": d1.isoformat(), "to": d2.isoformat(), "totals": totals, "days": days})
+
+
 # =========================
 # Staff directory & password management (non-parents)
 # =========================
@@ -1,6 +1,6 @@
 # billing/admin.py
 from django.contrib import admin
-from .models import TuitionPlan, Invoice, Payment, SalaryPayout, SalaryMonthLock
+from .models import TuitionPlan, Invoice, Payment, SalaryPayout, SalaryMonthLock, PayrollRate, LedgerEntry, StudentBalance
 from academics.models import Teacher
 
 @admin.register(TuitionPlan)
@@ -10,12 +10,17 @@ class TuitionPlanAdmin(admin.ModelAdmin):
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ("student", "month", "amount_uzs", "discount_uzs", "penalty_uzs", "paid_uzs", "status", "due_date")
+    list_display = ("student", "month", "amount_uzs", "discount_uzs", "penalty_uzs", "penalty_accrued_uzs", "paid_uzs", "status", "due_date")
     list_filter = ("status", "month", "student__clazz")
     search_fields = ("student__first_name", "student__last_name", "student__clazz__name")
     date_hierarchy = "month"
     autocomplete_fields = ("student",)
 
+    def delete_queryset(self, request, queryset):
+        # per-row delete reverses each invoice out of the ledger (Invoice.delete)
+        for inv in queryset:
+            inv.delete()
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ("student", "invoice", "amount_uzs", "method", "paid_at", "receipt_no")
@@ -24,6 +29,28 @@ class PaymentAdmin(admin.ModelAdmin):
     autocomplete_fields = ("student", "invoice")
     date_hierarchy = "paid_at"
 
+    def delete_queryset(self, request, queryset):
+        # per-row delete keeps invoice.paid_uzs in sync (Payment.delete)
+        for p in queryset:
+            p.delete()
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "student", "kind", "amount_uzs", "invoice", "created_at")
+    list_filter = ("kind",)
+    search_fields = ("student__first_name", "student__last_name")
+    raw_id_fields = ("student", "invoice")
+
+    def has_change_permission(self, request, obj=None):
+        return False   # append-only
+
+@admin.register(StudentBalance)
+class StudentBalanceAdmin(admin.ModelAdmin):
+    list_display = ("student", "due_uzs", "paid_uzs", "balance_uzs", "updated_at")
+    search_fields = ("student__first_name", "student__last_name")
+    ordering = ("-balance_uzs",)
+    raw_id_fields = ("student",)
+
 @admin.register(SalaryPayout)
 class SalaryPayoutAdmin(admin.ModelAdmin):
     list_display = ("month", "user_full_name", "user_role", "teacher_specialty", "amount_uzs", "paid", "paid_at")
@@ -33,6 +60,20 @@ class SalaryPayoutAdmin(admin.ModelAdmin):
     autocomplete_fields = ("user",)
     date_hierarchy = "month"
 
+    def _locked(self, obj):
+        return obj is not None and SalaryMonthLock.objects.filter(month=obj.month).exists()
+
+    def has_change_permission(self, request, obj=None):
+        return super().has_change_permission(request, obj) and not self._locked(obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and not self._locked(obj)
+
+    def delete_queryset(self, request, queryset):
+        # per-row delete checks the month lock and invalidates snapshots (SalaryPayout.delete)
+        for p in queryset:
+            p.delete()
+
     def user_full_name(self, obj):
         u = obj.user
         full = f"{(u.first_name or '').strip()} {(u.last_name or '').strip()}".strip()
@@ -51,19 +92,42 @@ class SalaryPayoutAdmin(admin.ModelAdmin):
         return t.specialty.name if getattr(t, "specialty", None) else ""
     teacher_specialty.short_description = "Mutaxassislik"
 
+@admin.register(PayrollRate)
+class PayrollRateAdmin(admin.ModelAdmin):
+    list_display = ("teacher", "subject", "rate_uzs")
+    list_filter = ("subject",)
+    autocomplete_fields = ("teacher", "subject")
+
 @admin.register(SalaryMonthLock)
 class SalaryMonthLockAdmin(admin.ModelAdmin):
-    list_display = ("month", "locked_at", "locked_by")
+    list_display = ("month", "locked_at", "locked_by", "total_uzs", "headcount")
     date_hierarchy = "month"
     autocomplete_fields = ("locked_by",)
 
 
 # billing/admin.py (append)
 from django.contrib import admin
-from .models import Expense
+from .models import Expense, FinancialMonthSnapshot, PenaltyAccrual
 
 @admin.register(Expense)
 class ExpenseAdmin(admin.ModelAdmin):
     list_display = ('date', 'category', 'amount_uzs', 'method', 'reason', 'created_by')
     list_filter  = ('category', 'method', 'date')
     search_fields = ('reason',)
+
+    def delete_queryset(self, request, queryset):
+        # per-row delete invalidates closed-month summary snapshots (Expense.delete)
+        for e in queryset:
+            e.delete()
+
+
+@admin.register(FinancialMonthSnapshot)
+class FinancialMonthSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('month', 'income', 'expense', 'salaries', 'stale', 'version', 'computed_at')
+    date_hierarchy = 'month'
+
+
+@admin.register(PenaltyAccrual)
+class PenaltyAccrualAdmin(admin.ModelAdmin):
+    list_display = ('as_of', 'invoices', 'delta_uzs', 'rule', 'created_at')
+    date_hierarchy = 'as_of'
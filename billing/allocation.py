@@ -0,0 +1,108 @@
+# billing/allocation.py
+from decimal import Decimal
+
+from .models import Invoice, LedgerEntry, Payment, TuitionPlan
+from .utils import next_month
+
+ALLOCATE_MAX_MONTHS = 24
+
+
+def allocate_forward(student_id, clazz_id, month, fallback_amount, surplus, *,
+                     method, paid_at, receipt_no='', note=None) -> list:
+    """
+    Spread `surplus` over the student's invoices after `month`, filling unpaid
+    ones and creating missing months (class plan amount, else fallback_amount)
+    up to ALLOCATE_MAX_MONTHS ahead, as child payments. Future invoices are
+    read once under select_for_update, new months and child payments are
+    bulk-inserted, existing invoices updated once each. Must run inside the
+    caller's transaction, with the student row locked so two allocations do
+    not insert the same month.
+    Returns [{invoice, month, amount_uzs, created}].
+    """
+    surplus = Decimal(surplus)
+    if surplus <= 0:
+        return []
+
+    plan_amt = (
+        TuitionPlan.objects.filter(clazz_id=clazz_id)
+        .values_list('amount_uzs', flat=True).first()
+    )
+    months = [next_month(month)]
+    while len(months) < ALLOCATE_MAX_MONTHS:
+        months.append(next_month(months[-1]))
+    existing = {
+        i.month: i
+        for i in Invoice.objects.select_for_update().filter(student_id=student_id, month__in=months)
+    }
+
+    plan = []        # (invoice, amount, created)
+    for m in months:
+        if surplus <= 0:
+            break
+        target = existing.get(m)
+        created = target is None
+        if created:
+            target = Invoice(
+                student_id=student_id,
+                month=m,
+                amount_uzs=plan_amt or fallback_amount,   # fallback to current-month amount
+                discount_uzs=0,
+                penalty_uzs=0,
+                paid_uzs=0,
+                status='unpaid',
+                due_date=m.replace(day=min(10, 28)),     # default due day; tweak if needed
+                notes='Auto-created by overpayment allocation',
+            )
+        need = target.total_due_uzs - target.paid_uzs
+        if need <= 0:
+            continue
+        allocate = min(surplus, need)
+        plan.append((target, allocate, created))
+        surplus -= allocate
+
+    if not plan:
+        return []
+
+    # new months are born with their allocation already applied
+    new_invoices = [t for t, amt, created in plan if created]
+    for t, amt, created in plan:
+        if created:
+            t.paid_uzs = amt
+            t.recompute_status()
+    Invoice.objects.bulk_create(new_invoices)
+    if any(t.pk is None for t in new_invoices):   # backends without RETURNING
+        ids = dict(
+            Invoice.objects.filter(student_id=student_id, month__in=[t.month for t in new_invoices])
+            .values_list('month', 'id')
+        )
+        for t in new_invoices:
+            t.pk = ids[t.month]
+    LedgerEntry.post([
+        e for t in new_invoices
+        for e in LedgerEntry.diff(t.student_id, t.pk, t.ledger_values())
+    ])
+
+    Payment.objects.bulk_create([
+        Payment(
+            student_id=student_id,
+            invoice_id=t.pk,
+            amount_uzs=amt,
+            method=method,
+            paid_at=paid_at,
+            receipt_no=receipt_no,
+            note=note or f"Auto-alloc from {month.strftime('%Y-%m')}",
+        )
+        for t, amt, created in plan
+    ])
+    # bulk_create skips Payment.save → apply the existing invoices' deltas in one pass
+    Invoice.apply_paid_deltas({t.pk: amt for t, amt, created in plan if not created})
+
+    return [
+        {
+            'invoice': t.pk,
+            'month': t.month.strftime('%Y-%m'),
+            'amount_uzs': int(amt),
+            'created': created,
+        }
+        for t, amt, created in plan
+    ]
@@ -0,0 +1,252 @@
+# billing/bank_import.py
+import codecs
+import csv
+import re
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from academics.models import Student
+from .allocation import allocate_forward
+from .models import FinancialMonthSnapshot, Invoice, Payment
+
+# accepted header names (lower-case) per field; first match wins
+COLUMNS = {
+    'date': ('date', 'paid_at', 'sana', 'дата'),
+    'amount': ('amount', 'amount_uzs', 'summa', 'сумма'),
+    'phone': ('phone', 'parent_phone', 'telefon', 'телефон'),
+    'receipt': ('receipt_no', 'receipt', 'chek', 'document', 'doc_no', 'номер документа'),
+    'student': ('student', 'student_id'),
+    'purpose': ('purpose', 'description', 'details', 'izoh', 'назначение платежа'),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y', '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M')
+PHONE_RE = re.compile(r'(?:\+?998)?[\s\-()]*\d{2}[\s\-()]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}')
+IN_CHUNK = 2000
+
+
+def phone_key(p) -> str:
+    """Last 9 digits: '+998 90 123-45-67', '998901234567' and '901234567' share one key."""
+    digits = ''.join(ch for ch in (p or '') if ch.isdigit())
+    return digits[-9:] if len(digits) >= 9 else ''
+
+
+def _amount(s) -> Decimal:
+    s = (s or '').replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(s).quantize(Decimal(1))
+    except InvalidOperation:
+        raise ValueError(f"bad amount {s!r}")
+
+
+def _moment(s, formats):
+    """Parse with the first matching format; it moves to the front since a file keeps one format."""
+    s = (s or '').strip()
+    for i, fmt in enumerate(formats):
+        try:
+            d = datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+        if i:
+            formats.insert(0, formats.pop(i))
+        return timezone.make_aware(d)
+    raise ValueError(f"bad date {s!r}")
+
+
+def read_statement(f):
+    """
+    Stream (line_no, raw_dict, parsed) from a CSV statement given as an
+    iterable of byte lines (uploaded file or file opened 'rb'). The delimiter
+    (',', ';' or tab) is taken from the header; parsed is {date, amount,
+    phone, receipt, student} or an error string.
+    """
+    lines = codecs.iterdecode(f, 'utf-8-sig')
+    first = next(lines, '')
+    delimiter = max(',;\t', key=first.count)
+    reader = csv.reader(chain([first], lines), delimiter=delimiter)
+    header = [h.strip().lower() for h in next(reader, [])]
+    pos = {}
+    for field, names in COLUMNS.items():
+        for n in names:
+            if n in header:
+                pos[field] = header.index(n)
+                break
+    if 'amount' not in pos or 'date' not in pos:
+        raise ValueError("statement needs 'date' and 'amount' columns")
+    formats = list(DATE_FORMATS)
+
+    for line_no, cells in enumerate(reader, start=2):
+        if not any(c.strip() for c in cells):
+            continue
+        get = lambda k: cells[pos[k]].strip() if k in pos and pos[k] < len(cells) else ''
+        raw = dict(zip(header, cells))
+        try:
+            amount = _amount(get('amount'))
+            if amount <= 0:
+                raise ValueError("amount must be positive")
+            phone = phone_key(get('phone'))
+            if not phone and get('purpose'):
+                m = PHONE_RE.search(get('purpose'))
+                phone = phone_key(m.group(0)) if m else ''
+            parsed = {
+                'date': _moment(get('date'), formats),
+                'amount': amount,
+                'phone': phone,
+                'receipt': get('receipt')[:32],
+                'student': int(get('student')) if get('student').isdigit() else None,
+            }
+        except ValueError as e:
+            parsed = str(e)
+        yield line_no, raw, parsed
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), IN_CHUNK):
+        yield items[i:i + IN_CHUNK]
+
+
+def import_statement(f, method='transfer', dry_run=False) -> dict:
+    """
+    Match statement lines to students through a parent_phone index (last 9
+    digits, built once) or an explicit student column, skip lines already
+    imported by receipt_no, and spread each amount over the student's open
+    invoices oldest first; what is left beyond them is carried forward to
+    later months like an overpayment at the desk (allocation.allocate_forward).
+    A line without a receipt_no that matches an earlier payment by student +
+    amount + date may be a re-import or a second genuine transfer, so it is
+    not posted but returned as unmatched for review. Payments are
+    bulk-inserted and every touched invoice is updated once
+    (Invoice.apply_paid_deltas). Returns counts plus unmatched lines for review.
+    """
+    lines, unmatched = [], []
+    for line_no, raw, parsed in read_statement(f):
+        if isinstance(parsed, str):
+            unmatched.append({'line': line_no, 'reason': parsed, 'row': raw})
+        else:
+            lines.append((line_no, raw, parsed))
+
+    by_phone = defaultdict(set)
+    known = set()
+    for sid, phone in Student.objects.values_list('id', 'parent_phone').iterator(chunk_size=5000):
+        known.add(sid)
+        if phone_key(phone):
+            by_phone[phone_key(phone)].add(sid)
+
+    receipts = {p['receipt'] for _, _, p in lines if p['receipt']}
+    seen = set()
+    for chunk in _chunks(receipts):
+        seen.update(Payment.objects.filter(receipt_no__in=chunk).values_list('receipt_no', flat=True))
+
+    resolved, duplicates = [], 0
+    for line_no, raw, p in lines:
+        if p['receipt'] and p['receipt'] in seen:
+            duplicates += 1
+            continue
+        candidates = {p['student']} & known if p['student'] else by_phone.get(p['phone'], set())
+        if len(candidates) != 1:
+            unmatched.append({
+                'line': line_no,
+                'reason': 'ambiguous phone' if candidates else 'no student',
+                'candidates': sorted(candidates),
+                'row': raw,
+            })
+            continue
+        if p['receipt']:
+            seen.add(p['receipt'])   # same receipt twice in one file
+        resolved.append((line_no, raw, p, next(iter(candidates))))
+
+    # lines without a receipt_no are known by (student, amount, paid_at)
+    blank = [(sid, p['date']) for _, _, p, sid in resolved if not p['receipt']]
+    seen_keys = set()
+    for chunk in _chunks(blank):
+        # a line spread over several invoices is one (student, paid_at, note) group
+        seen_keys.update(
+            (r['student_id'], r['total'], r['paid_at'])
+            for r in Payment.objects.filter(
+                receipt_no='', student_id__in={sid for sid, _ in chunk}, paid_at__in={d for _, d in chunk},
+            ).values('student_id', 'paid_at', 'note').annotate(total=Sum('amount_uzs')).order_by()
+        )
+    matched = []
+    for line_no, raw, p, sid in resolved:
+        # a statement lists each transfer once, so repeats inside this file are
+        # separate payments; only a match against what is already posted is doubtful
+        if not p['receipt'] and (sid, p['amount'], p['date']) in seen_keys:
+            unmatched.append({'line': line_no, 'reason': 'possible duplicate', 'candidates': [sid], 'row': raw})
+            continue
+        matched.append((line_no, raw, p, sid))
+
+    with transaction.atomic():
+        clazz_of = {}
+        if not dry_run:
+            # students before invoices, the order PaymentViewSet.create locks in:
+            # carrying a surplus forward may insert the student's later months
+            for chunk in _chunks(sorted({m[3] for m in matched})):
+                clazz_of.update(
+                    Student.objects.select_for_update().filter(pk__in=chunk).order_by('pk').values_list('pk', 'clazz_id')
+                )
+        open_invoices = defaultdict(list)   # student -> [[id, remaining, month, amount]] oldest first
+        for chunk in _chunks({m[3] for m in matched}):
+            rows = Invoice.objects.filter(~Q(status='paid'), student_id__in=chunk)
+            if not dry_run:   # a preview writes nothing, so it need not block posting
+                rows = rows.select_for_update()
+            rows = rows.order_by('student_id', 'month').values_list(
+                'id', 'student_id', 'month', 'amount_uzs', 'discount_uzs', 'penalty_uzs', 'paid_uzs',
+            )
+            for pk, sid, month, amount, discount, penalty, paid in rows:
+                open_invoices[sid].append([pk, amount - discount + penalty - paid, month, amount])
+
+        payments, deltas, imported, total = [], defaultdict(Decimal), 0, Decimal(0)
+        surplus = []   # (sid, newest open invoice, amount, line_no, parsed)
+        for line_no, raw, p, sid in matched:
+            queue = open_invoices.get(sid)
+            if not queue:
+                unmatched.append({'line': line_no, 'reason': 'no open invoice', 'candidates': [sid], 'row': raw})
+                continue
+            left = p['amount']
+            for slot in queue:
+                part = min(left, max(slot[1], Decimal(0)))
+                if part <= 0:
+                    continue
+                payments.append(Payment(
+                    student_id=sid, invoice_id=slot[0], amount_uzs=part, method=method,
+                    paid_at=p['date'], receipt_no=p['receipt'], note=f"Bank import, line {line_no}",
+                ))
+                deltas[slot[0]] += part
+                slot[1] -= part
+                left -= part
+                if left <= 0:
+                    break
+            if left > 0:
+                surplus.append((sid, queue[-1], left, line_no, p))
+            imported += 1
+            total += p['amount']
+
+        allocated = []
+        if not dry_run:
+            Payment.objects.bulk_create(payments, batch_size=1000)
+            # bulk_create skips Payment.save → one UPDATE per touched invoice + ledger
+            Invoice.apply_paid_deltas(deltas)
+            for sid, (_, _, month, amount), left, line_no, p in surplus:
+                # same note as the line's own payments: a re-import sums them as one transfer
+                allocated += allocate_forward(
+                    sid, clazz_of[sid], month, amount, left, method=method, paid_at=p['date'],
+                    receipt_no=p['receipt'], note=f"Bank import, line {line_no}",
+                )
+            FinancialMonthSnapshot.invalidate({p.paid_at for p in payments})
+
+    unmatched.sort(key=lambda u: u['line'])
+    return {
+        'dry_run': dry_run,
+        'imported': imported,
+        'payments': len(payments) + len(allocated),
+        'invoices': len(deltas.keys() | {a['invoice'] for a in allocated}),
+        'amount_uzs': int(total),
+        'carried_forward_uzs': int(sum(left for _, _, left, _, _ in surplus)),
+        'duplicates': duplicates,
+        'unmatched': unmatched,
+    }
@@ -0,0 +1,36 @@
+# billing/caching.py
+from django.core.cache import cache
+
+BILLING_VERSION_KEY = 'billing:ver'
+FORECAST_VERSION_KEY = 'billing:forecast:ver'
+
+
+def _version(key) -> int:
+    return cache.get_or_set(key, 1, None)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def billing_version() -> int:
+    """Version of billing money data; part of every cached billing report key."""
+    return _version(BILLING_VERSION_KEY)
+
+
+def bump_billing_version():
+    """Invalidate every cached billing report (called on each ledger post)."""
+    _bump(BILLING_VERSION_KEY)
+
+
+def forecast_version() -> int:
+    """Version of tuition plans + enrollment; part of the income forecast cache key."""
+    return _version(FORECAST_VERSION_KEY)
+
+
+def bump_forecast_version():
+    """Invalidate the cached income forecast (TuitionPlan / Student changes, see billing.signals)."""
+    _bump(FORECAST_VERSION_KEY)
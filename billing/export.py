@@ -0,0 +1,55 @@
+# billing/export.py
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+
+class CSVStreamRenderer(BaseRenderer):
+    """Lets ?format=csv pass DRF content negotiation; the view streams the body itself."""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)   # errors only
+
+
+class NDJSONStreamRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_rows(rows, fmt, columns, filename):
+    """
+    StreamingHttpResponse over an iterable of dicts as CSV (`columns` in
+    order, header first) or NDJSON (one JSON object per line).
+    """
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+
+        def body():
+            yield '\ufeff'   # BOM so Excel opens UTF-8 correctly
+            yield writer.writerow(columns)
+            for r in rows:
+                yield writer.writerow([r.get(c, '') for c in columns])
+
+        resp = StreamingHttpResponse(body(), content_type='text/csv; charset=utf-8')
+        resp['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    else:
+        resp = StreamingHttpResponse(
+            (json.dumps(r, ensure_ascii=False) + '\n' for r in rows),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+    resp['X-Accel-Buffering'] = 'no'   # let nginx pass chunks through
+    return resp
@@ -0,0 +1,91 @@
+# billing/forecast.py
+from datetime import timedelta
+
+from django.db.models import Count, F, Sum
+
+from academics.models import SchoolClass, Student
+from .models import Invoice, TuitionPlan
+from .utils import next_month
+
+LOOKBACK_MONTHS = 12
+
+
+def _month_back(month, n):
+    for _ in range(n):
+        month = (month - timedelta(days=1)).replace(day=1)
+    return month
+
+
+def income_forecast(current_month, months, lookback=LOOKBACK_MONTHS) -> dict:
+    """
+    Expected tuition income for the `months` months after `current_month`.
+    Per class: billed = TuitionPlan.amount_uzs x active students, expected =
+    billed x the class's collection rate (paid / due of its students'
+    invoices over the last `lookback` closed months; the school-wide rate
+    when a class has no history). Four queries build aligned per-class
+    arrays; months are then columns of one class x month pass.
+    {
+      "months": ["YYYY-MM", ...], "lookback_months": n, "collection_rate": 0.93,
+      "totals":  {"billed": [...], "expected": [...], "billed_total": uzs, "expected_total": uzs},
+      "classes": [{"class_id", "class_name", "students", "plan_uzs", "collection_rate", "billed": [...], "expected": [...]}]
+    }
+    """
+    plans = dict(TuitionPlan.objects.values_list('clazz_id', 'amount_uzs'))
+    heads = dict(
+        Student.objects.filter(status='active', clazz__isnull=False)
+        .values('clazz_id').annotate(n=Count('id')).order_by().values_list('clazz_id', 'n')
+    )
+    history = {
+        r['student__clazz_id']: (r['due'] or 0, r['paid'] or 0)
+        for r in Invoice.objects.filter(
+            month__gte=_month_back(current_month, lookback), month__lt=current_month, student__clazz__isnull=False,
+        ).values('student__clazz_id').annotate(
+            due=Sum(F('amount_uzs') - F('discount_uzs') + F('penalty_uzs')), paid=Sum('paid_uzs'),
+        ).order_by()
+    }
+    names = dict(SchoolClass.objects.filter(id__in=plans.keys() | heads.keys()).values_list('id', 'name'))
+
+    # aligned per-class arrays
+    class_ids = sorted(names, key=lambda cid: names[cid])
+    plan = [int(plans.get(cid) or 0) for cid in class_ids]
+    students = [heads.get(cid, 0) for cid in class_ids]
+    due_all = sum(d for d, _ in history.values())
+    school_rate = min(float(sum(p for _, p in history.values()) / due_all), 1.0) if due_all > 0 else 1.0
+    rate = [
+        min(max(float(history[cid][1] / history[cid][0]), 0.0), 1.0)
+        if cid in history and history[cid][0] > 0 else school_rate
+        for cid in class_ids
+    ]
+
+    month_list = [next_month(current_month)]
+    while len(month_list) < months:
+        month_list.append(next_month(month_list[-1]))
+
+    # plans and enrollment are today's, so every forecast month shares one column
+    billed_col = [p * n for p, n in zip(plan, students)]
+    expected_col = [round(b * r) for b, r in zip(billed_col, rate)]
+    billed_month, expected_month = sum(billed_col), sum(expected_col)
+
+    return {
+        'months': [m.strftime('%Y-%m') for m in month_list],
+        'lookback_months': lookback,
+        'collection_rate': round(school_rate, 4),
+        'totals': {
+            'billed': [billed_month] * months,
+            'expected': [expected_month] * months,
+            'billed_total': billed_month * months,
+            'expected_total': expected_month * months,
+        },
+        'classes': [
+            {
+                'class_id': cid,
+                'class_name': names[cid],
+                'students': n,
+                'plan_uzs': p,
+                'collection_rate': round(r, 4),
+                'billed': [b] * months,
+                'expected': [e] * months,
+            }
+            for cid, n, p, r, b, e in zip(class_ids, students, plan, rate, billed_col, expected_col)
+        ],
+    }
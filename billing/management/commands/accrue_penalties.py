@@ -0,0 +1,55 @@
+# billing/management/commands/accrue_penalties.py
+from datetime import date
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from billing.penalties import accrue_penalties, penalty_rule
+
+
+class Command(BaseCommand):
+    help = (
+        "Accrue late-payment penalties on open invoices overdue at --as-of. "
+        "Idempotent: each invoice is moved to its rule target, so reruns never double-charge. "
+        "Rule defaults come from settings.BILLING_PENALTY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--as-of", help="YYYY-MM-DD (default: today)")
+        parser.add_argument("--flat", type=int, help="flat UZS once an invoice is late")
+        parser.add_argument("--percent-per-day", help="percent of (amount - discount) per late day, e.g. 0.1")
+        parser.add_argument("--cap", type=int, help="max penalty per invoice in UZS (0 = no cap)")
+        parser.add_argument("--grace-days", type=int, help="days after due_date before penalties start")
+        parser.add_argument("--dry-run", action="store_true", help="report what would change, do not write")
+        parser.add_argument("--reset", action="store_true",
+                            help="allow an empty rule (flat and percent 0): reverses the accrued penalties "
+                                 "of open invoices overdue at --as-of (paid invoices keep theirs)")
+
+    def handle(self, *args, **opts):
+        try:
+            as_of = date.fromisoformat(opts["as_of"]) if opts["as_of"] else timezone.localdate()
+            rule = penalty_rule(
+                flat_uzs=opts["flat"],
+                percent_per_day=opts["percent_per_day"],
+                cap_uzs=opts["cap"],
+                grace_days=opts["grace_days"],
+            )
+        except Exception as e:
+            raise CommandError(f"Invalid option: {e}")
+        if not (rule["flat_uzs"] or rule["percent_per_day"]):
+            if not opts["reset"]:
+                raise CommandError("Penalty rule is empty (flat and percent_per_day are 0), which would reverse "
+                                   "the accrued penalties of open overdue invoices. "
+                                   "Configure BILLING_PENALTY or pass --reset.")
+            self.stdout.write(self.style.WARNING(
+                f"--reset: accrued penalties of open invoices overdue at {as_of} will be reversed."
+            ))
+
+        t0 = perf_counter()
+        run = accrue_penalties(as_of, rule, dry_run=opts["dry_run"], log=self.stdout.write)
+        took = perf_counter() - t0
+        prefix = "Would change" if opts["dry_run"] else "Changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {run.invoices} invoices as of {as_of}, {run.delta_uzs:+} UZS in {took:.2f}s"
+        ))
@@ -0,0 +1,37 @@
+# billing/management/commands/import_bank_statement.py
+import json
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.bank_import import import_statement
+from billing.models import Payment
+
+
+class Command(BaseCommand):
+    help = "Import a bank statement CSV as payments (same matching as POST /api/billing/payments/import/)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="statement CSV file")
+        parser.add_argument("--method", default="transfer", choices=[m for m, _ in Payment.METHOD])
+        parser.add_argument("--dry-run", action="store_true", help="match only, do not write")
+        parser.add_argument("--unmatched", help="write unmatched lines to this JSON file")
+
+    def handle(self, *args, **opts):
+        t0 = perf_counter()
+        try:
+            with open(opts["path"], "rb") as f:
+                result = import_statement(f, method=opts["method"], dry_run=opts["dry_run"])
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+
+        if opts["unmatched"]:
+            with open(opts["unmatched"], "w", encoding="utf-8") as out:
+                json.dump(result["unmatched"], out, ensure_ascii=False, indent=2)
+        for u in result["unmatched"][:20]:
+            self.stdout.write(f"  line {u['line']}: {u['reason']}")
+        prefix = "Would import" if opts["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {result['imported']} lines ({result['payments']} payments, {result['amount_uzs']} UZS) "
+            f"in {perf_counter() - t0:.2f}s; duplicates {result['duplicates']}, unmatched {len(result['unmatched'])}"
+        ))
@@ -0,0 +1,102 @@
+# billing/management/commands/rebuild_balances.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from billing.models import Invoice, LedgerEntry, StudentBalance
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derive every StudentBalance from the ledger in bulk and report drift. "
+        "--backfill first posts, per invoice and kind, whatever the ledger is "
+        "missing to match the invoice's money fields."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backfill", action="store_true",
+                            help="post the missing part of each invoice's ledger footprint "
+                                 "(invoices created or edited outside Invoice.save)")
+        parser.add_argument("--check", action="store_true", help="report drift only, do not write")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch_size"]
+
+        if opts["backfill"] and not opts["check"]:
+            posted = 0
+            with transaction.atomic():
+                for chunk in self._invoice_chunks(batch_size):
+                    posted += len(self._backfill(chunk))
+            self.stdout.write(f"Backfilled {posted} ledger entries")
+
+        derived = {
+            r["student_id"]: (r["due"] or Decimal(0), -(r["paid"] or Decimal(0)))
+            for r in LedgerEntry.objects.order_by().values("student_id").annotate(
+                due=Sum("amount_uzs", filter=~Q(kind="payment")),
+                paid=Sum("amount_uzs", filter=Q(kind="payment")),
+            )
+        }
+        cached = {
+            sid: (due, paid)
+            for sid, due, paid in StudentBalance.objects.values_list("student_id", "due_uzs", "paid_uzs")
+        }
+        zero = (Decimal(0), Decimal(0))
+        drift = [sid for sid in derived.keys() | cached.keys() if derived.get(sid, zero) != cached.get(sid, zero)]
+        self.stdout.write(f"Students: {len(derived)}, drifted balances: {len(drift)}")
+        if opts["check"] or not drift:
+            return
+
+        rows = [
+            StudentBalance(student_id=sid, due_uzs=due, paid_uzs=paid, balance_uzs=due - paid)
+            for sid in drift
+            for due, paid in [derived.get(sid, zero)]
+        ]
+        with transaction.atomic():
+            StudentBalance.objects.bulk_create(
+                rows,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["student"],
+                update_fields=["due_uzs", "paid_uzs", "balance_uzs", "updated_at"],
+            )
+        self.stdout.write(self.style.SUCCESS(f"StudentBalance fixed: {len(rows)} rows"))
+
+    @staticmethod
+    def _invoice_chunks(batch_size):
+        """Invoice rows in id-keyset pages (no open cursor while entries are inserted)."""
+        last = 0
+        while True:
+            chunk = list(
+                Invoice.objects.filter(id__gt=last).order_by("id")
+                .values_list("id", "student_id", *Invoice.LEDGER_FIELDS)[:batch_size]
+            )
+            if not chunk:
+                return
+            yield chunk
+            last = chunk[-1][0]
+
+    @staticmethod
+    def _backfill(invoices):
+        """
+        Post expected footprint minus what the ledger already holds, per
+        invoice and kind, so partially posted invoices are completed rather
+        than skipped and fully posted ones get nothing.
+        """
+        posted = defaultdict(Decimal)   # (invoice, kind) -> signed sum
+        for invoice_id, kind, total in (
+            LedgerEntry.objects.filter(invoice_id__in=[r[0] for r in invoices])
+            .values("invoice_id", "kind").annotate(total=Sum("amount_uzs"))
+            .order_by().values_list("invoice_id", "kind", "total")
+        ):
+            posted[(invoice_id, kind)] = total
+        entries = []
+        for pk, student_id, *values in invoices:
+            # back to LEDGER_FIELDS terms (payments/discounts are posted negative)
+            old = [sign * posted[(pk, kind)] for kind, sign in LedgerEntry.INVOICE_KINDS]
+            entries += LedgerEntry.diff(student_id, pk, values, old)
+        LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+        return entries
@@ -1,8 +1,13 @@
-from django.db import models
+from datetime import date
+from collections import defaultdict
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from decimal import Decimal
 
-from academics.models import SchoolClass, Student
+from academics.models import SchoolClass, Student, Subject, Teacher
+from .caching import bump_billing_version
 
 AMT = dict(max_digits=12, decimal_places=0, default=0)
 
@@ -24,6 +29,8 @@ class Invoice(models.Model):
     amount_uzs = models.DecimalField(**AMT)
     discount_uzs = models.DecimalField(**AMT)
     penalty_uzs = models.DecimalField(**AMT)
+    # part of penalty_uzs written by `manage.py accrue_penalties` (manual edits stay on top)
+    penalty_accrued_uzs = models.DecimalField(**AMT)
     paid_uzs = models.DecimalField(**AMT)
     status = models.CharField(max_length=10, choices=STATUS, default='unpaid')
     due_date = models.DateField(null=True, blank=True)
@@ -34,11 +41,20 @@ class Invoice(models.Model):
     class Meta:
         unique_together = (('student', 'month'),)
         indexes = [
-            models.Index(fields=['student', 'month']),
-            models.Index(fields=['status', 'month'])
+            # balance/cumulative lookups read the money columns from the index alone (PostgreSQL INCLUDE)
+            models.Index(fields=['student', 'month'], name='invoice_student_month_cov',
+                         include=['amount_uzs', 'discount_uzs', 'penalty_uzs', 'paid_uzs']),
+            models.Index(fields=['status', 'month']),
+            # keyset pages (InvoiceKeysetPagination): all invoices / open ones
+            models.Index(fields=['-month', 'student', 'id'], name='invoice_keyset_idx'),
+            models.Index(fields=['-month', 'student', 'id'], name='invoice_open_keyset_idx', condition=~Q(status='paid')),
+            # debtor aging only scans open invoices
+            models.Index(fields=['due_date'], name='invoice_unpaid_due_idx', condition=~Q(status='paid')),
         ]
         ordering = ['-month', 'student_id']
 
+    LEDGER_FIELDS = ('amount_uzs', 'discount_uzs', 'penalty_uzs', 'paid_uzs')
+
     @property
     def total_due_uzs(self) -> Decimal:
         return (self.amount_uzs - self.discount_uzs + self.penalty_uzs)
@@ -56,6 +72,79 @@ class Invoice(models.Model):
         else:
             self.status = 'unpaid'
 
+    @classmethod
+    def apply_paid_deltas(cls, deltas):
+        """
+        Add {invoice_id: delta_uzs} to paid_uzs and recompute status in the
+        same UPDATE (one per distinct delta). Rows are locked in pk order
+        first, so concurrent postings on the same invoices serialize instead
+        of losing updates. Must run inside a transaction.
+        """
+        deltas = {pk: Decimal(d) for pk, d in deltas.items() if pk and d}
+        if not deltas:
+            return
+        students = dict(
+            cls.objects.select_for_update().filter(pk__in=deltas).order_by('pk').values_list('pk', 'student_id')
+        )
+        groups = defaultdict(list)
+        for pk in sorted(deltas):
+            groups[deltas[pk]].append(pk)
+        for delta, ids in groups.items():
+            total_due = F('amount_uzs') - F('discount_uzs') + F('penalty_uzs')
+            # conditions see the pre-update row, so compare old paid_uzs shifted by delta
+            cls.objects.filter(pk__in=ids).update(
+                status=Case(
+                    When(paid_uzs__gte=total_due - delta, then=Value('paid')),
+                    When(paid_uzs__gt=-delta, then=Value('partial')),
+                    default=Value('unpaid'),
+                ),
+                paid_uzs=F('paid_uzs') + delta,
+                updated_at=timezone.now(),
+            )
+        LedgerEntry.post([
+            LedgerEntry(student_id=students[pk], invoice_id=pk, kind='payment', amount_uzs=-deltas[pk])
+            for pk in sorted(deltas) if pk in students
+        ])
+
+    def ledger_values(self):
+        return tuple(getattr(self, f) for f in self.LEDGER_FIELDS)
+
+    def save(self, *args, **kwargs):
+        # every change of the money fields is mirrored as LedgerEntry deltas
+        with transaction.atomic():
+            old = None
+            update_fields = kwargs.get('update_fields')
+            if self.pk:
+                # locked like Payment.save: a payment committing in between must
+                # not split the row from its ledger diff
+                old = (Invoice.objects.select_for_update().filter(pk=self.pk)
+                       .values_list('student_id', *self.LEDGER_FIELDS).first())
+                if old and update_fields is None and self.paid_uzs != old[-1]:
+                    # paid_uzs belongs to Payment (apply_paid_deltas): never write back a stale copy
+                    self.paid_uzs = old[-1]
+                    self.recompute_status()
+            super().save(*args, **kwargs)
+            new = self.ledger_values()
+            if old and update_fields is not None:
+                new = tuple(n if f in update_fields else o
+                            for f, n, o in zip(self.LEDGER_FIELDS, new, old[1:]))
+            entries = []
+            if old and old[0] != self.student_id:
+                entries += LedgerEntry.diff(old[0], self.pk, (0, 0, 0, 0), old[1:])
+                old = None
+            entries += LedgerEntry.diff(self.student_id, self.pk, new, old[1:] if old else None)
+            LedgerEntry.post(entries)
+            transaction.on_commit(bump_billing_version)   # due_date / status edits too
+
+    def delete(self, *args, **kwargs):
+        # reverse the invoice (and its cascaded payments) out of the ledger
+        with transaction.atomic():
+            old = (Invoice.objects.select_for_update().filter(pk=self.pk)
+                   .values_list('student_id', *self.LEDGER_FIELDS).first())
+            if old:
+                LedgerEntry.post(LedgerEntry.diff(old[0], self.pk, (0, 0, 0, 0), old[1:]))
+            return super().delete(*args, **kwargs)
+
 class Payment(models.Model):
     METHOD = (
         ('cash', 'Naqd'),
@@ -77,13 +166,144 @@ class Payment(models.Model):
         ordering = ['-paid_at']
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Sync invoice totals after payment save
-        inv = self.invoice
-        agg = inv.payments.aggregate(total=models.Sum('amount_uzs'))
-        inv.paid_uzs = agg['total'] or 0
-        inv.recompute_status()
-        inv.save(update_fields=['paid_uzs', 'status', 'updated_at'])
+        # Sync invoice totals incrementally: +new amount, -old amount (edits may move invoices)
+        with transaction.atomic():
+            old = None
+            if self.pk:
+                old = (Payment.objects.select_for_update().filter(pk=self.pk)
+                       .values_list('invoice_id', 'amount_uzs', 'paid_at').first())
+            super().save(*args, **kwargs)
+            deltas = defaultdict(Decimal)
+            deltas[self.invoice_id] += Decimal(self.amount_uzs)
+            if old:
+                deltas[old[0]] -= old[1]
+            Invoice.apply_paid_deltas(deltas)
+            FinancialMonthSnapshot.invalidate([self.paid_at, old[2] if old else None])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            old = (Payment.objects.select_for_update().filter(pk=self.pk)
+                   .values_list('invoice_id', 'amount_uzs', 'paid_at').first())
+            result = super().delete(*args, **kwargs)
+            if old:
+                Invoice.apply_paid_deltas({old[0]: -old[1]})
+                FinancialMonthSnapshot.invalidate([old[2]])
+        return result
+
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only student ledger. amount_uzs is signed: debits (charge,
+    penalty) are positive, credits (discount, payment) negative, so a
+    student's balance is SUM(amount_uzs). Entries are deltas written by the
+    billing write paths (Invoice.save/delete, Invoice.apply_paid_deltas and
+    the bulk paths); `manage.py rebuild_balances` re-derives StudentBalance.
+    """
+    KIND = (
+        ('charge', 'Hisob'),
+        ('penalty', 'Jarima'),
+        ('discount', 'Chegirma'),
+        ('payment', 'Toʻlov'),
+    )
+    # (kind, sign) in Invoice.LEDGER_FIELDS order
+    INVOICE_KINDS = (('charge', 1), ('discount', -1), ('penalty', 1), ('payment', -1))
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='ledger_entries')
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=10, choices=KIND)
+    amount_uzs = models.DecimalField(max_digits=12, decimal_places=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['student', 'id'])]
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.student_id} {self.kind} {self.amount_uzs}"
+
+    @classmethod
+    def diff(cls, student_id, invoice_id, new, old=None):
+        """Unsaved entries moving an invoice's ledger footprint from `old` to `new`
+        (tuples in Invoice.LEDGER_FIELDS order; None = nothing posted yet)."""
+        old = old or (0, 0, 0, 0)
+        entries = []
+        for (kind, sign), n, o in zip(cls.INVOICE_KINDS, new, old):
+            d = Decimal(n or 0) - Decimal(o or 0)
+            if d:
+                entries.append(cls(student_id=student_id, invoice_id=invoice_id, kind=kind, amount_uzs=sign * d))
+        return entries
+
+    @classmethod
+    def post(cls, entries):
+        """Insert entries and move the cached StudentBalance rows in the same transaction."""
+        entries = [e for e in entries if e.amount_uzs]
+        if not entries:
+            return
+        with transaction.atomic():
+            cls.objects.bulk_create(entries, batch_size=1000)
+            StudentBalance.apply(entries)
+            transaction.on_commit(bump_billing_version)
+
+
+class StudentBalance(models.Model):
+    """
+    Cached running balance per student, moved by every LedgerEntry.post.
+    due = charges + penalties - discounts, balance = due - paid (> 0 is debt).
+    """
+    student = models.OneToOneField(Student, on_delete=models.CASCADE, primary_key=True, related_name='ledger_balance')
+    due_uzs = models.DecimalField(**AMT)
+    paid_uzs = models.DecimalField(**AMT)
+    balance_uzs = models.DecimalField(**AMT)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    GROUPED_UPDATE_LIMIT = 50
+
+    class Meta:
+        indexes = [models.Index(fields=['balance_uzs'])]
+
+    def __str__(self):
+        return f"{self.student_id}: {self.balance_uzs}"
+
+    @classmethod
+    def apply(cls, entries):
+        per_student = defaultdict(lambda: [Decimal(0), Decimal(0)])   # [due, paid]
+        for e in entries:
+            if e.kind == 'payment':
+                per_student[e.student_id][1] -= e.amount_uzs
+            else:
+                per_student[e.student_id][0] += e.amount_uzs
+        cls.objects.bulk_create([cls(student_id=sid) for sid in per_student], ignore_conflicts=True)
+
+        # one UPDATE per distinct (due, paid) delta — bulk paths mostly share a few
+        groups = defaultdict(list)
+        for sid, (due, paid) in per_student.items():
+            groups[(due, paid)].append(sid)
+        now = timezone.now()
+        if len(groups) > cls.GROUPED_UPDATE_LIMIT:
+            # many distinct deltas (e.g. penalty accrual, bank import): lock, add in Python, upsert
+            rows = list(cls.objects.select_for_update().filter(student_id__in=per_student).order_by('student_id'))
+            for b in rows:
+                due, paid = per_student[b.student_id]
+                b.due_uzs += due
+                b.paid_uzs += paid
+                b.balance_uzs += due - paid
+                b.updated_at = now
+            cls.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['student'],
+                update_fields=['due_uzs', 'paid_uzs', 'balance_uzs', 'updated_at'],
+            )
+            return
+        for (due, paid), ids in groups.items():
+            cls.objects.filter(student_id__in=ids).update(
+                due_uzs=F('due_uzs') + due,
+                paid_uzs=F('paid_uzs') + paid,
+                balance_uzs=F('balance_uzs') + due - paid,
+                updated_at=now,
+            )
 
 
 
@@ -93,10 +313,16 @@ from django.db import models
 from django.utils import timezone
 from accounts.models import User
 
+class MonthLocked(Exception):
+    """The salary month is finalized (SalaryMonthLock); its payouts are read-only."""
+
+
 class SalaryPayout(models.Model):
     """
     One row per user per month.
     month = first day of month (use utils.parse_month)
+    Rows of a finalized month cannot be saved or deleted (MonthLocked), so
+    SalaryMonthLock.total_uzs / headcount stay the month's real figures.
     """
     month = models.DateField()
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='salary_payouts')
@@ -111,6 +337,58 @@ class SalaryPayout(models.Model):
     def __str__(self):
         return f"{self.month} — {self.user} — {self.amount_uzs} ({'paid' if self.paid else 'unpaid'})"
 
+    @staticmethod
+    def _ensure_unlocked(months):
+        # the caller holds the month (SalaryMonthLock.hold) or the row lock finalize also takes
+        locked = SalaryMonthLock.objects.filter(month__in=[m for m in months if m]).values_list('month', flat=True).first()
+        if locked:
+            raise MonthLocked(locked)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            SalaryMonthLock.hold(self.month)   # the target month may have no row for finalize to lock
+            old = None
+            if self.pk:
+                old = (SalaryPayout.objects.select_for_update().filter(pk=self.pk)
+                       .values_list('month', 'paid_at').first())
+            self._ensure_unlocked([self.month, old[0] if old else None])
+            super().save(*args, **kwargs)
+            FinancialMonthSnapshot.invalidate([self.month, self.paid_at, *(old or ())])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            list(SalaryPayout.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+            self._ensure_unlocked([self.month])
+            result = super().delete(*args, **kwargs)
+            FinancialMonthSnapshot.invalidate([self.month, self.paid_at])
+        return result
+
+
+class PayrollRate(models.Model):
+    """
+    Pay per lesson held (billing.payroll.calculate_month). The most specific
+    row wins: teacher+subject, then teacher, then subject, then the default
+    row with both empty.
+    """
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, null=True, blank=True, related_name='payroll_rates')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, null=True, blank=True, related_name='payroll_rates')
+    rate_uzs = models.DecimalField(max_digits=12, decimal_places=0, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'subject'], name='uniq_payroll_rate_teacher_subject'),
+            # NULLs never collide in the constraint above: one row per fallback level
+            models.UniqueConstraint(fields=['teacher'], condition=Q(subject__isnull=True),
+                                    name='uniq_payroll_rate_teacher_default'),
+            models.UniqueConstraint(fields=['subject'], condition=Q(teacher__isnull=True),
+                                    name='uniq_payroll_rate_subject_default'),
+            models.UniqueConstraint(Coalesce('teacher', Value(0)), condition=Q(teacher__isnull=True, subject__isnull=True),
+                                    name='uniq_payroll_rate_default'),
+        ]
+
+    def __str__(self):
+        return f"{self.teacher or '*'} / {self.subject or '*'}: {self.rate_uzs}"
+
 
 class SalaryMonthLock(models.Model):
     """
@@ -119,10 +397,41 @@ class SalaryMonthLock(models.Model):
     month = models.DateField(unique=True)
     locked_at = models.DateTimeField(default=timezone.now)
     locked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # paid payouts of the month, frozen at finalize (NULL on locks created before this existed)
+    total_uzs = models.DecimalField(max_digits=12, decimal_places=0, null=True, blank=True)
+    headcount = models.PositiveIntegerField(null=True, blank=True)
+
+    # pg_advisory_xact_lock namespace of salary months (key 2: month ordinal)
+    ADVISORY_NS = 0x5A1A
 
     def __str__(self):
         return f"Locked {self.month}"
 
+    @classmethod
+    def hold(cls, month):
+        """Serialize writers of `month`'s payouts with finalize until the
+        transaction ends. A month may have no payout rows to lock, so PostgreSQL
+        takes a transaction-scoped advisory lock; SQLite serializes writers anyway."""
+        if isinstance(month, str):
+            month = date.fromisoformat(month)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [cls.ADVISORY_NS, month.toordinal()])
+
+    @classmethod
+    def finalize(cls, month, user=None):
+        """Lock `month` and store its paid salary total/headcount (one aggregate).
+        Must run inside a transaction; holds the month (hold) and then its
+        payout rows, like billing.payroll.mark_month, so the two serialize."""
+        cls.hold(month)
+        list(SalaryPayout.objects.select_for_update().filter(month=month).order_by('user_id').values_list('pk'))
+        agg = SalaryPayout.objects.filter(month=month, paid=True).aggregate(
+            total=models.Sum('amount_uzs'), n=models.Count('id')
+        )
+        return cls.objects.create(
+            month=month, locked_by=user, total_uzs=agg['total'] or 0, headcount=agg['n'],
+        )
+
 # billing/models.py (add)
 from django.conf import settings
 # billing/models.py
@@ -160,3 +469,96 @@ class Expense(models.Model):
 
     def __str__(self):
         return f"{self.date} {self.get_category_display()} {self.amount_uzs}"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old = None
+            if self.pk:
+                old = Expense.objects.select_for_update().filter(pk=self.pk).values_list('date', flat=True).first()
+            super().save(*args, **kwargs)
+            FinancialMonthSnapshot.invalidate([self.date, old])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            FinancialMonthSnapshot.invalidate([self.date])
+        return result
+
+
+class PenaltyAccrual(models.Model):
+    """
+    One `manage.py accrue_penalties` run: the rule it applied and what it moved.
+    Per-invoice amounts are the run's 'penalty' LedgerEntry rows.
+    """
+    as_of = models.DateField()
+    rule = models.JSONField(default=dict)
+    invoices = models.PositiveIntegerField(default=0)   # invoices whose penalty changed
+    delta_uzs = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.as_of}: {self.invoices} invoices, {self.delta_uzs:+}"
+
+
+class FinancialMonthSnapshot(models.Model):
+    """
+    Frozen SummaryView figures of a closed (fully past) month.
+    Written lazily by billing.summary; a backdated Payment / Expense /
+    SalaryPayout write into a closed month marks that month stale and bumps
+    its version, inside the writer's transaction. A compute only stores its
+    figures if the version it started from is still current (see `store`),
+    so a compute racing an invalidation cannot persist pre-write figures.
+    """
+    month = models.DateField(unique=True)   # first day of month
+    income = models.DecimalField(**AMT)
+    income_by_method = models.JSONField(default=dict)
+    expense = models.DecimalField(**AMT)
+    expense_by_method = models.JSONField(default=dict)
+    salaries = models.DecimalField(**AMT)   # paid salaries, see SummaryView include_salaries
+    stale = models.BooleanField(default=True)          # placeholder / invalidated: recompute on read
+    version = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}: +{self.income} -{self.expense}"
+
+    @classmethod
+    def invalidate(cls, moments):
+        """Mark stale the closed months containing the given dates/datetimes (None ignored)."""
+        months = set()
+        for d in moments:
+            if d is None:
+                continue
+            if isinstance(d, str):
+                d = date.fromisoformat(d[:10])
+            elif hasattr(d, 'hour'):
+                d = timezone.localdate(d) if timezone.is_aware(d) else d.date()
+            months.add(d.replace(day=1))
+        months = {m for m in months if m < timezone.localdate().replace(day=1)}
+        if not months:
+            return
+        # a row must exist to carry the version bump, even while a compute is in flight
+        cls.objects.bulk_create([cls(month=m) for m in months], ignore_conflicts=True)
+        rows = cls.objects.filter(month__in=months)
+        with transaction.atomic():
+            # month order, so writers touching several closed months cannot deadlock
+            list(rows.select_for_update().order_by('month').values_list('pk'))
+            rows.update(stale=True, version=F('version') + 1)
+
+    @classmethod
+    def store(cls, snap, figures) -> bool:
+        """
+        Save `figures` into `snap` unless the month was invalidated since `snap`
+        was read (its version moved on). The UPDATE waits for an uncommitted
+        invalidation and then re-checks the version.
+        """
+        return bool(
+            cls.objects.filter(pk=snap.pk, version=snap.version)
+            .update(**figures, stale=False, computed_at=timezone.now())
+        )
@@ -0,0 +1,212 @@
+# billing/payroll.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import User
+from academics.models import Attendance, Teacher
+from .models import FinancialMonthSnapshot, MonthLocked, PayrollRate, SalaryMonthLock, SalaryPayout
+from .utils import next_month
+
+# roles shown on the salaries page
+STAFF_ROLES = ('teacher', 'accountant', 'registrar', 'operator', 'admin')
+
+
+def _roster(user_ids=None):
+    """Staff rows with teacher specialty in one LEFT JOIN query."""
+    qs = User.objects.filter(role__in=STAFF_ROLES)
+    if user_ids is not None:
+        qs = qs.filter(id__in=user_ids)
+    return qs.order_by('last_name', 'first_name').values(
+        'id', 'first_name', 'last_name', 'phone', 'role', 'teacher_profile__specialty__name',
+    )
+
+
+def month_roster(month) -> dict:
+    """
+    Salaries page payload for `month`: roster, payouts and lock in three queries.
+    {"locked": bool, "items": [{user, full_name, role, specialty, amount_uzs, paid}]}
+    """
+    payouts = {
+        uid: (amount, paid)
+        for uid, amount, paid in SalaryPayout.objects.filter(month=month).values_list('user_id', 'amount_uzs', 'paid')
+    }
+    locked = SalaryMonthLock.objects.filter(month=month).exists()
+    items = []
+    for u in _roster():
+        full = f"{(u['first_name'] or '').strip()} {(u['last_name'] or '').strip()}".strip() or (u['phone'] or '')
+        amount, paid = payouts.get(u['id'], (0, False))
+        items.append({
+            'user': u['id'],
+            'full_name': full,
+            'role': u['role'] or '',
+            'specialty': (u['teacher_profile__specialty__name'] or '') if u['role'] == 'teacher' else '',
+            'amount_uzs': int(amount),
+            'paid': bool(paid),
+        })
+    return {'locked': locked, 'items': items}
+
+
+def mark_month(month, items) -> dict:
+    """
+    Upsert {user, amount_uzs, paid} marks for `month` in one
+    INSERT .. ON CONFLICT (month, user) statement. The month is held
+    (SalaryMonthLock.hold) before the lock check, even when it has no payout
+    rows yet, so a concurrent finalize either sees these marks or rejects them.
+    paid_at is set when a row becomes paid and kept otherwise. Items that
+    cannot be read (not an object, no user, non-integer user or amount) are
+    returned under "invalid" as {index, item, reason}.
+    Raises MonthLocked.
+    """
+    marks, invalid = {}, []
+    for i, it in enumerate(items):
+        if not isinstance(it, dict):
+            invalid.append({'index': i, 'item': it, 'reason': 'not an object'})
+            continue
+        try:
+            uid = int(it.get('user') or 0)
+            amount = int(it.get('amount_uzs') or 0)
+        except (TypeError, ValueError):
+            invalid.append({'index': i, 'item': it, 'reason': 'user and amount_uzs must be integers'})
+            continue
+        if not uid:
+            invalid.append({'index': i, 'item': it, 'reason': 'user required'})
+            continue
+        marks[uid] = (amount, bool(it.get('paid')))   # last mark of a user wins
+
+    with transaction.atomic():
+        SalaryMonthLock.hold(month)
+        existing = {
+            uid: (paid, paid_at)
+            for uid, paid, paid_at in SalaryPayout.objects.select_for_update()
+            .filter(month=month).order_by('user_id').values_list('user_id', 'paid', 'paid_at')
+        }
+        if SalaryMonthLock.objects.filter(month=month).exists():
+            raise MonthLocked(month)
+        staff = {u['id'] for u in _roster(marks)}
+
+        now = timezone.now()
+        rows, moments = [], [month]
+        for uid, (amount, paid) in marks.items():
+            if uid not in staff:
+                continue
+            was_paid, old_paid_at = existing.get(uid, (False, None))
+            paid_at = now if paid and not was_paid else old_paid_at
+            moments += [old_paid_at, paid_at]
+            rows.append(SalaryPayout(month=month, user_id=uid, amount_uzs=amount, paid=paid, paid_at=paid_at))
+
+        SalaryPayout.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['month', 'user'],
+            update_fields=['amount_uzs', 'paid', 'paid_at'],
+        )
+        # bulk_create skips SalaryPayout.save → invalidate closed-month summary snapshots here
+        FinancialMonthSnapshot.invalidate(moments)
+
+    created = sum(1 for r in rows if r.user_id not in existing)
+    return {
+        'created': created,
+        'updated': len(rows) - created,
+        'skipped': sorted(set(marks) - staff),
+        'invalid': invalid,
+    }
+
+
+def lesson_counts(month):
+    """
+    {(teacher_id, subject_id): lessons} for `month`: distinct (schedule, date)
+    pairs with attendance marked, credited to the teacher who marked them
+    (the slot's teacher when unset). When several teachers marked rows of one
+    lesson (a substitute, a late correction), the lesson goes to the one who
+    marked most of them, so it is never paid twice. One grouped query.
+    """
+    rows = (
+        Attendance.objects.filter(date__gte=month, date__lt=next_month(month), schedule__isnull=False)
+        .annotate(t=Coalesce('teacher_id', 'schedule__teacher_id'))
+        .values('schedule_id', 'date', 'schedule__subject_id', 't')
+        .annotate(n=Count('id'))
+        .order_by()
+        .values_list('schedule_id', 'date', 'schedule__subject_id', 't', 'n')
+    )
+    lessons = {}   # (schedule, date) -> (marks, teacher, subject)
+    for schedule_id, day, subject_id, teacher_id, n in rows:
+        best = lessons.get((schedule_id, day))
+        if best is None or (n, -teacher_id) > (best[0], -best[1]):
+            lessons[(schedule_id, day)] = (n, teacher_id, subject_id)
+    counts = defaultdict(int)
+    for _, teacher_id, subject_id in lessons.values():
+        counts[(teacher_id, subject_id)] += 1
+    return counts
+
+
+def calculate_month(month) -> list:
+    """
+    Lessons held x PayrollRate per teacher and subject, in three queries
+    (lessons, rates, teachers). Returns, by name:
+    [{user, teacher, full_name, lessons, amount_uzs, subjects: [{subject, lessons, rate_uzs, amount_uzs}]}]
+    """
+    counts = lesson_counts(month)
+    rates = {(t, s): r for t, s, r in PayrollRate.objects.values_list('teacher_id', 'subject_id', 'rate_uzs')}
+    teachers = {
+        tid: (uid, f"{(first or '').strip()} {(last or '').strip()}".strip() or (phone or ''))
+        for tid, uid, first, last, phone in Teacher.objects.filter(id__in={t for t, _ in counts})
+        .values_list('id', 'user_id', 'user__first_name', 'user__last_name', 'user__phone')
+    }
+
+    per_teacher = {}
+    for (tid, sid), n in sorted(counts.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+        if tid not in teachers:
+            continue
+        rate = next(
+            (rates[k] for k in ((tid, sid), (tid, None), (None, sid), (None, None)) if k in rates),
+            Decimal(0),
+        )
+        uid, full = teachers[tid]
+        row = per_teacher.setdefault(tid, {
+            'user': uid, 'teacher': tid, 'full_name': full, 'lessons': 0, 'amount_uzs': 0, 'subjects': [],
+        })
+        row['lessons'] += n
+        row['amount_uzs'] += int(rate * n)
+        row['subjects'].append({'subject': sid, 'lessons': n, 'rate_uzs': int(rate), 'amount_uzs': int(rate * n)})
+    return sorted(per_teacher.values(), key=lambda r: r['full_name'])
+
+
+def prefill_month(month) -> dict:
+    """
+    Write calculate_month() amounts into the month's SalaryPayout rows in one
+    upsert; unpaid payouts of teachers with no lessons this month are set to 0.
+    Paid rows keep their amount. Serialized with finalize like mark_month.
+    Raises MonthLocked.
+    """
+    calc = calculate_month(month)
+    with transaction.atomic():
+        SalaryMonthLock.hold(month)
+        existing = list(
+            SalaryPayout.objects.select_for_update(of=('self',))
+            .filter(month=month).order_by('user_id').values_list('user_id', 'paid', 'user__role')
+        )
+        if SalaryMonthLock.objects.filter(month=month).exists():
+            raise MonthLocked(month)
+        paid = {uid for uid, is_paid, _ in existing if is_paid}
+        amounts = {r['user']: r['amount_uzs'] for r in calc}
+        idle = [uid for uid, is_paid, role in existing if role == 'teacher' and not is_paid and uid not in amounts]
+        rows = [
+            SalaryPayout(month=month, user_id=uid, amount_uzs=amount)
+            for uid, amount in [*amounts.items(), *((uid, 0) for uid in idle)]
+            if uid not in paid
+        ]
+        SalaryPayout.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['month', 'user'],
+            update_fields=['amount_uzs'],
+        )
+    # only unpaid amounts change, and SummaryView counts paid salaries: snapshots stay valid
+    return {'items': calc, 'written': len(rows), 'zeroed': len(idle), 'kept_paid': len(paid & amounts.keys())}
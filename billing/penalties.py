@@ -0,0 +1,100 @@
+# billing/penalties.py
+from collections import defaultdict
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Invoice, LedgerEntry, PenaltyAccrual
+
+RULE_KEYS = ('flat_uzs', 'percent_per_day', 'cap_uzs', 'grace_days')
+
+
+def penalty_rule(**overrides) -> dict:
+    """settings.BILLING_PENALTY with non-None overrides, normalised to Decimal/int."""
+    rule = dict(getattr(settings, 'BILLING_PENALTY', {}))
+    rule.update({k: v for k, v in overrides.items() if v is not None})
+    return {
+        'flat_uzs': Decimal(rule.get('flat_uzs') or 0),
+        'percent_per_day': Decimal(str(rule.get('percent_per_day') or 0)),
+        'cap_uzs': Decimal(rule.get('cap_uzs') or 0),
+        'grace_days': int(rule.get('grace_days') or 0),
+    }
+
+
+def target_penalty(rule, base, days_late) -> Decimal:
+    """
+    Penalty an invoice should carry after `days_late` days past due (grace
+    already subtracted): flat + percent_per_day% of (amount - discount) per
+    day, capped at cap_uzs (0 = no cap).
+    """
+    if days_late <= 0:
+        return Decimal(0)
+    base = max(Decimal(base), Decimal(0))
+    p = rule['flat_uzs'] + (base * rule['percent_per_day'] * days_late / 100).quantize(Decimal(1), ROUND_HALF_UP)
+    if rule['cap_uzs']:
+        p = min(p, rule['cap_uzs'])
+    return p
+
+
+def accrue_penalties(as_of, rule, dry_run=False, log=None) -> PenaltyAccrual:
+    """
+    Bring penalty_accrued_uzs of every open invoice overdue at `as_of` to its
+    rule target, class by class. The target depends only on (as_of, due_date,
+    amount - discount), so reruns are no-ops and a changed rule or later
+    as_of only moves the difference. Within a class, invoices sharing a
+    target are moved by one UPDATE that also recomputes status; manual
+    penalty edits (penalty_uzs - penalty_accrued_uzs) are kept.
+    """
+    cutoff = as_of - timedelta(days=rule['grace_days'])
+    overdue = Invoice.objects.filter(~Q(status='paid'), due_date__lt=cutoff)
+    class_ids = overdue.order_by().values_list('student__clazz_id', flat=True).distinct()
+
+    run = PenaltyAccrual(as_of=as_of, rule={k: str(rule[k]) for k in RULE_KEYS})
+    for class_id in sorted(class_ids, key=lambda c: (c is None, c)):
+        with transaction.atomic():
+            rows = (
+                overdue.filter(student__clazz_id=class_id)
+                .select_for_update(of=('self',))
+                .order_by('pk')
+                .values_list('pk', 'student_id', 'due_date', 'amount_uzs', 'discount_uzs', 'penalty_accrued_uzs')
+            )
+            groups = defaultdict(list)   # target -> invoice ids
+            entries = []
+            for pk, student_id, due_date, amount, discount, accrued in rows:
+                days_late = (as_of - due_date).days - rule['grace_days']
+                target = target_penalty(rule, amount - discount, days_late)
+                if target == accrued:
+                    continue
+                groups[target].append(pk)
+                entries.append(LedgerEntry(student_id=student_id, invoice_id=pk, kind='penalty', amount_uzs=target - accrued))
+
+            run.invoices += len(entries)
+            run.delta_uzs += sum(e.amount_uzs for e in entries)
+            if log and entries:
+                log(f"class {class_id}: {len(entries)} invoices, {sum(e.amount_uzs for e in entries):+} UZS")
+            if dry_run or not entries:
+                continue
+
+            now = timezone.now()
+            for target, ids in groups.items():
+                new_penalty = F('penalty_uzs') - F('penalty_accrued_uzs') + target
+                # status first: the conditions must see the pre-update penalty
+                Invoice.objects.filter(pk__in=ids).update(
+                    status=Case(
+                        When(paid_uzs__gte=F('amount_uzs') - F('discount_uzs') + new_penalty, then=Value('paid')),
+                        When(paid_uzs__gt=0, then=Value('partial')),
+                        default=Value('unpaid'),
+                    ),
+                    penalty_uzs=new_penalty,
+                    penalty_accrued_uzs=target,
+                    updated_at=now,
+                )
+            LedgerEntry.post(entries)
+
+    if not dry_run:
+        run.save()
+    return run
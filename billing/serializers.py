@@ -33,7 +33,11 @@ class InvoiceSerializer(serializers.ModelSerializer):
         return int(obj.balance_uzs)
 
     def get_cumulative_balance_uzs(self, obj):
-        # context: cum_balances is a dict {(student_id, month_iso): int_balance}
+        # InvoiceViewSet.list annotates cum_balance (?month=); older callers pass
+        # context cum_balances = {(student_id, month_iso): int_balance}
+        cum = getattr(obj, 'cum_balance', None)
+        if cum is not None:
+            return int(cum)
         m = getattr(self, 'context', {}).get('cum_balances', {})
         key = (obj.student_id, obj.month.isoformat())
         val = m.get(key)
@@ -0,0 +1,18 @@
+# billing/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from academics.models import Student
+from .caching import bump_forecast_version
+from .models import TuitionPlan
+
+
+def _bump_forecast_on_commit(sender, **kwargs):
+    # after commit, so a concurrent request cannot re-cache the pre-change forecast
+    transaction.on_commit(bump_forecast_version)
+
+
+# the income forecast is cached until plans or enrollment change
+for _model in (TuitionPlan, Student):
+    post_save.connect(_bump_forecast_on_commit, sender=_model, dispatch_uid=f'forecast-save-{_model.__name__}')
+    post_delete.connect(_bump_forecast_on_commit, sender=_model, dispatch_uid=f'forecast-delete-{_model.__name__}')
@@ -0,0 +1,112 @@
+# billing/summary.py
+from datetime import date, timedelta
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Expense, FinancialMonthSnapshot, Payment, SalaryPayout
+from .utils import next_month
+
+METHODS = ('cash', 'card', 'transfer')
+
+
+def _by_method(qs, date_filter):
+    """One grouped query: total + per-method sums via conditional aggregation."""
+    agg = qs.filter(date_filter).aggregate(
+        total=Sum('amount_uzs'),
+        **{m: Sum('amount_uzs', filter=Q(method=m)) for m in METHODS},
+    )
+    return int(agg.pop('total') or 0), {m: int(agg[m] or 0) for m in METHODS}
+
+
+def period_figures(ranges) -> dict:
+    """Live figures over [(d1, d2), ...] date ranges: 3 queries (payments, expenses, paid salaries)."""
+    pay_q, ex_q, sal_q = Q(pk__in=[]), Q(pk__in=[]), Q(pk__in=[])
+    for d1, d2 in ranges:
+        pay_q |= Q(paid_at__date__gte=d1, paid_at__date__lte=d2)
+        ex_q |= Q(date__gte=d1, date__lte=d2)
+        # salaries by paid_at date, falling back to the month when paid_at is missing
+        sal_q |= Q(paid_at__date__gte=d1, paid_at__date__lte=d2) | Q(paid_at__isnull=True, month__gte=d1, month__lte=d2)
+
+    income, income_by_method = _by_method(Payment.objects.all(), pay_q)
+    expense, expense_by_method = _by_method(Expense.objects.all(), ex_q)
+    salaries = SalaryPayout.objects.filter(sal_q, paid=True).aggregate(total=Sum('amount_uzs'))['total'] or 0
+    return {
+        'income': income,
+        'income_by_method': income_by_method,
+        'expense': expense,
+        'expense_by_method': expense_by_method,
+        'salaries': int(salaries),
+    }
+
+
+def _snapshot_figures(snap) -> dict:
+    return {
+        'income': int(snap.income),
+        'income_by_method': snap.income_by_method,
+        'expense': int(snap.expense),
+        'expense_by_method': snap.expense_by_method,
+        'salaries': int(snap.salaries),
+    }
+
+
+def closed_months_figures(months) -> list:
+    """
+    Figures of closed months: one read of FinancialMonthSnapshot; stale or
+    missing months are computed live and stored when no invalidation raced
+    the computation (FinancialMonthSnapshot.store).
+    """
+    snaps = {s.month: s for s in FinancialMonthSnapshot.objects.filter(month__in=months)}
+    if len(snaps) < len(set(months)):
+        # placeholders first: their version is what the computes below start from
+        FinancialMonthSnapshot.objects.bulk_create(
+            [FinancialMonthSnapshot(month=m) for m in set(months) - snaps.keys()], ignore_conflicts=True,
+        )
+        snaps = {s.month: s for s in FinancialMonthSnapshot.objects.filter(month__in=months)}
+    out = []
+    for month in months:
+        snap = snaps[month]
+        if snap.stale:
+            f = period_figures([(month, next_month(month) - timedelta(days=1))])
+            FinancialMonthSnapshot.store(snap, f)
+            out.append(f)
+        else:
+            out.append(_snapshot_figures(snap))
+    return out
+
+
+def summary_figures(d1: date, d2: date) -> dict:
+    """
+    Figures for [d1, d2]: whole closed months inside the range come from
+    snapshots, the remaining head/tail days (and the current month) are
+    computed live in one pass.
+    """
+    current_month = timezone.localdate().replace(day=1)
+    closed, live = [], []
+    cur = d1
+    while cur <= d2:
+        month = cur.replace(day=1)
+        month_end = next_month(month) - timedelta(days=1)
+        piece_end = min(month_end, d2)
+        if cur == month and piece_end == month_end and month < current_month:
+            closed.append(month)
+        else:
+            live.append((cur, piece_end))
+        cur = piece_end + timedelta(days=1)
+
+    pieces = closed_months_figures(closed)
+    if live:
+        pieces.append(period_figures(live))
+
+    total = {
+        'income': 0, 'expense': 0, 'salaries': 0,
+        'income_by_method': dict.fromkeys(METHODS, 0),
+        'expense_by_method': dict.fromkeys(METHODS, 0),
+    }
+    for p in pieces:
+        for k in ('income', 'expense', 'salaries'):
+            total[k] += p[k]
+        for k in ('income_by_method', 'expense_by_method'):
+            for m in METHODS:
+                total[k][m] += int(p[k].get(m, 0))
+    return total
@@ -1,3 +1,417 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from threading import Barrier, Event, Thread
+from time import sleep
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from academics.models import Attendance, ScheduleEntry, SchoolClass, Student, Subject, Teacher
+from .bank_import import import_statement
+from .caching import forecast_version
+from .models import (
+    Expense, FinancialMonthSnapshot, Invoice, LedgerEntry, MonthLocked, Payment, PayrollRate, SalaryMonthLock, SalaryPayout,
+    StudentBalance, TuitionPlan,
+)
+from .payroll import lesson_counts, mark_month, prefill_month
+from .summary import closed_months_figures, period_figures
+
+
+def _invoice(amount=1_000_000):
+    s = Student.objects.create(first_name='Ali', last_name='Valiyev')
+    return Invoice.objects.create(student=s, month=date(2025, 9, 1), amount_uzs=amount)
+
+
+class PaymentPostingTests(TestCase):
+    def test_create_edit_delete_keep_paid_in_sync(self):
+        inv = _invoice()
+        p = Payment.objects.create(student=inv.student, invoice=inv, amount_uzs=400_000)
+        inv.refresh_from_db()
+        self.assertEqual((inv.paid_uzs, inv.status), (400_000, 'partial'))
+
+        p.amount_uzs = 1_000_000
+        p.save()
+        inv.refresh_from_db()
+        self.assertEqual((inv.paid_uzs, inv.status), (1_000_000, 'paid'))
+
+        # moving a payment to another invoice shifts the amount between both
+        other = Invoice.objects.create(student=inv.student, month=date(2025, 10, 1), amount_uzs=1_000_000)
+        p.invoice = other
+        p.save()
+        inv.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((inv.paid_uzs, inv.status), (0, 'unpaid'))
+        self.assertEqual((other.paid_uzs, other.status), (1_000_000, 'paid'))
+
+        p.delete()
+        other.refresh_from_db()
+        self.assertEqual((other.paid_uzs, other.status), (0, 'unpaid'))
+
+
+    def test_saving_a_stale_invoice_keeps_payments(self):
+        inv = _invoice()
+        stale = Invoice.objects.get(pk=inv.pk)
+        Payment.objects.create(student=inv.student, invoice=inv, amount_uzs=400_000)
+        stale.discount_uzs = 100_000   # an edit made from the pre-payment copy
+        stale.save()
+        inv.refresh_from_db()
+        self.assertEqual((inv.paid_uzs, inv.discount_uzs, inv.status), (400_000, 100_000, 'partial'))
+        balance = StudentBalance.objects.get(student=inv.student)
+        self.assertEqual((balance.due_uzs, balance.paid_uzs), (900_000, 400_000))
+
+
+class RebuildBalancesTests(TestCase):
+    def test_backfill_posts_only_the_missing_part(self):
+        inv = _invoice(500_000)
+        Payment.objects.create(student=inv.student, invoice=inv, amount_uzs=200_000)
+        # a lost payment entry and a discount written around Invoice.save
+        LedgerEntry.objects.filter(kind='payment').delete()
+        Invoice.objects.filter(pk=inv.pk).update(discount_uzs=10_000)
+
+        out = StringIO()
+        call_command('rebuild_balances', '--backfill', stdout=out)
+        self.assertIn('Backfilled 2 ledger entries', out.getvalue())
+        balance = StudentBalance.objects.get(student=inv.student)
+        self.assertEqual((balance.due_uzs, balance.paid_uzs), (490_000, 200_000))
+
+        out = StringIO()
+        call_command('rebuild_balances', '--backfill', stdout=out)
+        self.assertIn('Backfilled 0 ledger entries', out.getvalue())
+
+
+
+class MonthSnapshotTests(TestCase):
+    def test_compute_racing_an_invalidation_is_not_stored(self):
+        month = (timezone.localdate().replace(day=1) - timedelta(days=40)).replace(day=1)
+        inv = _invoice()
+        self.assertEqual(closed_months_figures([month])[0]['income'], 0)
+        started = FinancialMonthSnapshot.objects.get(month=month)   # a compute reads its version...
+        self.assertFalse(started.stale)
+
+        Payment.objects.create(   # ...a backdated payment lands meanwhile...
+            student=inv.student, invoice=inv, amount_uzs=250_000,
+            paid_at=timezone.make_aware(datetime.combine(month, time(10))),
+        )
+        # ...and the compute's pre-payment figures are rejected
+        self.assertFalse(FinancialMonthSnapshot.store(started, period_figures([(month, month)])))
+        self.assertEqual(closed_months_figures([month])[0]['income'], 250_000)
+        self.assertFalse(FinancialMonthSnapshot.objects.get(month=month).stale)
+
+
+    def test_admin_bulk_delete_of_expenses_invalidates_the_month(self):
+        month = (timezone.localdate().replace(day=1) - timedelta(days=40)).replace(day=1)
+        Expense.objects.bulk_create(Expense(date=month, amount_uzs=70_000, method='cash') for _ in range(2))
+        self.assertEqual(closed_months_figures([month])[0]['expense'], 140_000)
+
+        admin = User.objects.create_superuser(phone='+998900000050', password='x')
+        self.client.force_login(admin)
+        r = self.client.post('/admin/billing/expense/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(Expense.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(closed_months_figures([month])[0]['expense'], 0)
+
+
+class SalaryMonthLockTests(TestCase):
+    def test_locked_month_payouts_are_read_only(self):
+        month = date(2025, 9, 1)
+        user = User.objects.create_user(phone='+998900000010', password='x', role='teacher')
+        payout = SalaryPayout.objects.create(month=month, user=user, amount_uzs=3_000_000, paid=True)
+        lock = SalaryMonthLock.finalize(month)
+        self.assertEqual((lock.total_uzs, lock.headcount), (3_000_000, 1))
+
+        payout.amount_uzs = 5_000_000
+        with self.assertRaises(MonthLocked):
+            payout.save()
+        with self.assertRaises(MonthLocked):
+            payout.delete()
+        with self.assertRaises(MonthLocked):
+            SalaryPayout.objects.create(month=month, user=User.objects.create_user(phone='+998900000011', password='x'))
+        self.assertEqual(list(SalaryPayout.objects.values_list('amount_uzs', flat=True)), [3_000_000])
+
+        # moving a payout into the locked month is rejected too
+        other = SalaryPayout.objects.create(month=date(2025, 10, 1), user=user)
+        other.month = month
+        with self.assertRaises(MonthLocked):
+            other.save()
+
+
+
+@override_settings(BILLING_PENALTY={})
+class AccruePenaltiesCommandTests(TestCase):
+    def test_empty_rule_needs_reset(self):
+        inv = _invoice(1_000_000)
+        Invoice.objects.filter(pk=inv.pk).update(due_date=date(2025, 9, 10))
+        call_command('accrue_penalties', '--as-of', '2025-10-10', '--flat', '10000', stdout=StringIO())
+        inv.refresh_from_db()
+        self.assertEqual(inv.penalty_uzs, 10_000)
+
+        with self.assertRaises(CommandError):
+            call_command('accrue_penalties', '--as-of', '2025-10-10', stdout=StringIO())
+        inv.refresh_from_db()
+        self.assertEqual(inv.penalty_uzs, 10_000)
+
+        call_command('accrue_penalties', '--as-of', '2025-10-10', '--reset', stdout=StringIO())
+        inv.refresh_from_db()
+        self.assertEqual((inv.penalty_uzs, inv.penalty_accrued_uzs), (0, 0))
+
+
+
+class BankImportTests(TestCase):
+    def test_lines_without_receipt_already_posted_go_to_review(self):
+        inv = _invoice(1_000_000)
+        Invoice.objects.create(student=inv.student, month=date(2025, 10, 1), amount_uzs=1_000_000)
+        sid = inv.student_id
+        statement = (
+            f'date;amount;student_id;receipt_no\n'
+            f'2025-09-05;1 500 000;{sid};\n'
+            f'2025-09-05;1 500 000;{sid};\n'      # a second transfer, same day and amount
+            f'2025-09-05;200 000;{sid};\n'
+        ).encode()
+
+        result = import_statement(BytesIO(statement), dry_run=True)
+        self.assertEqual((result['imported'], result['duplicates'], result['unmatched']), (3, 0, []))
+        self.assertFalse(Payment.objects.exists())
+
+        result = import_statement(BytesIO(statement))
+        self.assertEqual((result['imported'], result['duplicates'], result['unmatched']), (3, 0, []))
+        result = import_statement(BytesIO(statement))   # the same statement again
+        self.assertEqual(result['imported'], 0)
+        self.assertEqual([(u['line'], u['reason']) for u in result['unmatched']], [
+            (2, 'possible duplicate'), (3, 'possible duplicate'), (4, 'possible duplicate'),
+        ])
+        self.assertEqual(sum(Payment.objects.values_list('amount_uzs', flat=True)), 3_200_000)
+
+    def test_surplus_is_carried_to_later_months(self):
+        inv = _invoice(1_000_000)
+        statement = f'date;amount;student_id;receipt_no\n2025-09-05;2 300 000;{inv.student_id};R-1\n'.encode()
+
+        result = import_statement(BytesIO(statement), dry_run=True)
+        self.assertEqual(result['carried_forward_uzs'], 1_300_000)
+
+        result = import_statement(BytesIO(statement))
+        self.assertEqual((result['payments'], result['invoices']), (3, 3))
+        self.assertEqual(
+            list(Invoice.objects.order_by('month').values_list('month', 'amount_uzs', 'paid_uzs', 'status')),
+            [
+                (date(2025, 9, 1), 1_000_000, 1_000_000, 'paid'),
+                (date(2025, 10, 1), 1_000_000, 1_000_000, 'paid'),
+                (date(2025, 11, 1), 1_000_000, 300_000, 'partial'),
+            ],
+        )
+        self.assertEqual(StudentBalance.objects.get(student=inv.student).paid_uzs, 2_300_000)
+
+
+class SalariesMarkTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(phone='+998900000020', password='x', role='accountant'))
+        self.teacher = User.objects.create_user(phone='+998900000021', password='x', role='teacher')
+
+    def test_unreadable_items_are_reported(self):
+        r = self.client.post('/api/billing/salaries/mark/', {'month': '2025-09', 'items': [
+            {'user': str(self.teacher.id), 'amount_uzs': '450000', 'paid': True},
+            {'user': self.teacher.id, 'amount_uzs': '450000.5'},
+            'oops',
+            {'amount_uzs': 1},
+        ]}, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(r.data['created'], 1)
+        self.assertEqual([(x['index'], x['reason']) for x in r.data['invalid']], [
+            (1, 'user and amount_uzs must be integers'), (2, 'not an object'), (3, 'user required'),
+        ])
+        self.assertEqual(SalaryPayout.objects.get().amount_uzs, 450_000)
+
+    def test_items_must_be_a_list(self):
+        r = self.client.post('/api/billing/salaries/mark/', {'month': '2025-09', 'items': {'user': 1}}, format='json')
+        self.assertEqual(r.status_code, 400)
+
+
+
+class PayrollTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.month = date(2025, 9, 1)
+        cls.clazz = SchoolClass.objects.create(name='5-A', level=5)
+        cls.subject = Subject.objects.create(name='Matematika', code='MATH')
+        cls.teachers = [
+            Teacher.objects.create(user=User.objects.create_user(phone=f'+99890000003{i}', password='x', role='teacher'))
+            for i in range(3)
+        ]
+        cls.slot = ScheduleEntry.objects.create(
+            clazz=cls.clazz, subject=cls.subject, teacher=cls.teachers[0], weekday=1,
+            start_time=time(8), end_time=time(8, 45),
+        )
+        cls.students = Student.objects.bulk_create(
+            Student(first_name=f'Ism{i}', last_name='Familiya', clazz=cls.clazz) for i in range(3)
+        )
+        PayrollRate.objects.create(rate_uzs=50_000)
+
+    def _mark(self, day, teachers):
+        Attendance.objects.bulk_create(
+            Attendance(student=st, clazz=self.clazz, date=day, schedule=self.slot, subject=self.subject, teacher=t)
+            for st, t in zip(self.students, teachers)
+        )
+
+    def test_a_lesson_is_paid_once(self):
+        t0, t1, _ = self.teachers
+        self._mark(date(2025, 9, 1), [t0, t0, t0])
+        self._mark(date(2025, 9, 8), [t1, t1, None])   # substitute; one row left to the slot teacher
+        self.assertEqual(dict(lesson_counts(self.month)), {(t0.id, self.subject.id): 1, (t1.id, self.subject.id): 1})
+
+    def test_prefill_zeroes_teachers_without_lessons(self):
+        t0, t1, t2 = self.teachers
+        self._mark(date(2025, 9, 1), [t0, t0, t0])
+        SalaryPayout.objects.create(month=self.month, user=t1.user, amount_uzs=400_000)
+        SalaryPayout.objects.create(month=self.month, user=t2.user, amount_uzs=300_000, paid=True)
+
+        result = prefill_month(self.month)
+        self.assertEqual((result['written'], result['zeroed']), (2, 1))
+        self.assertEqual(
+            dict(SalaryPayout.objects.filter(month=self.month).values_list('user_id', 'amount_uzs')),
+            {t0.user_id: 50_000, t1.user_id: 0, t2.user_id: 300_000},
+        )
+
+    def test_one_rate_per_fallback_level(self):
+        t0 = self.teachers[0]
+        PayrollRate.objects.create(teacher=t0, rate_uzs=1)
+        PayrollRate.objects.create(subject=self.subject, rate_uzs=2)
+        for kwargs in ({}, {'teacher': t0}, {'subject': self.subject}):
+            with self.subTest(**kwargs), self.assertRaises(IntegrityError), transaction.atomic():
+                PayrollRate.objects.create(rate_uzs=3, **kwargs)
+
+
+
+class ForecastCacheTests(TestCase):
+    def test_plan_change_bumps_the_version_after_commit(self):
+        clazz = SchoolClass.objects.create(name='6-A', level=6)
+        with self.captureOnCommitCallbacks(execute=True):
+            plan = TuitionPlan.objects.create(clazz=clazz, amount_uzs=1_000_000)
+        before = forecast_version()
+        plan.amount_uzs = 1_200_000
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            plan.save()
+        self.assertEqual(forecast_version(), before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(forecast_version(), before + 1)
+
+
+
+class GenerateInvoicesTests(TestCase):
+    def test_invoice_created_meanwhile_is_not_charged_twice(self):
+        clazz = SchoolClass.objects.create(name='4-A', level=4)
+        TuitionPlan.objects.create(clazz=clazz, amount_uzs=800_000)
+        students = Student.objects.bulk_create(
+            Student(first_name=f'Ism{i}', last_name='Familiya', clazz=clazz) for i in range(2)
+        )
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(phone='+998900000040', password='x', role='accountant'))
+
+        manager_cls = type(Invoice.objects)
+        real_bulk_create = manager_cls.bulk_create
+
+        def racing_bulk_create(manager, objs, *args, **kwargs):
+            if manager.model is Invoice and objs:
+                # a manual create wins the (student, month) conflict
+                Invoice.objects.create(student=students[0], month=date(2025, 9, 1), amount_uzs=500_000)
+            return real_bulk_create(manager, objs, *args, **kwargs)
+
+        with patch.object(manager_cls, 'bulk_create', racing_bulk_create):
+            r = client.post('/api/billing/invoices/generate/?month=2025-09')
+        self.assertEqual(r.data['created'], 1)
+        for student, due in zip(students, (500_000, 800_000)):
+            self.assertEqual(StudentBalance.objects.get(student=student).due_uzs, due)
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks (PostgreSQL)')
+class PaymentConcurrencyTests(TransactionTestCase):
+    def test_parallel_postings_do_not_lose_updates(self):
+        inv = _invoice()
+        workers = 8
+        barrier = Barrier(workers)
+        errors = []
+
+        def post():
+            try:
+                barrier.wait()
+                Payment.objects.create(student_id=inv.student_id, invoice_id=inv.id, amount_uzs=125_000)
+            except Exception as e:  # surfaced by the assertion below
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=post) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        inv.refresh_from_db()
+        self.assertEqual((inv.paid_uzs, inv.status), (1_000_000, 'paid'))
+
+    def test_parallel_overpayments_create_each_month_once(self):
+        inv = _invoice()
+        admin = User.objects.create_user(phone='+998900000009', password='x', role='admin')
+        workers = 4
+        barrier = Barrier(workers)
+        errors = []
+
+        def overpay():
+            try:
+                client = APIClient()
+                client.force_authenticate(admin)
+                barrier.wait()
+                r = client.post('/api/billing/payments-model/', {
+                    'student': inv.student_id, 'invoice': inv.id, 'amount_uzs': 1_500_000, 'method': 'cash',
+                }, format='json')
+                if r.status_code != 201:
+                    errors.append((r.status_code, r.content))
+            except Exception as e:  # surfaced by the assertion below
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=overpay) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        paid = dict(Invoice.objects.filter(student_id=inv.student_id).values_list('month', 'paid_uzs'))
+        self.assertEqual(sum(paid.values()), workers * 1_500_000)
+        self.assertEqual(len(paid), Invoice.objects.filter(student_id=inv.student_id).count())
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks (PostgreSQL)')
+class SalaryMonthConcurrencyTests(TransactionTestCase):
+    def test_finalize_waits_for_marks_in_a_month_without_payouts(self):
+        month = date(2025, 9, 1)
+        teacher = User.objects.create_user(phone='+998900000012', password='x', role='teacher')
+        marked = Event()
+
+        def mark():
+            try:
+                with transaction.atomic():
+                    mark_month(month, [{'user': teacher.id, 'amount_uzs': 3_000_000, 'paid': True}])
+                    marked.set()
+                    sleep(0.3)   # finalize starts while these marks are uncommitted
+            finally:
+                connections.close_all()
+
+        thread = Thread(target=mark)
+        thread.start()
+        marked.wait(5)
+        with transaction.atomic():
+            lock = SalaryMonthLock.finalize(month)
+        thread.join()
+        self.assertEqual((lock.total_uzs, lock.headcount), (3_000_000, 1))
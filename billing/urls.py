@@ -6,17 +6,21 @@ from .views import (
     TuitionPlanViewSet,
     InvoiceViewSet,
     PaymentViewSet,           # CRUD for Payment model (to avoid clash with /payments/ report)
+    PaymentImportView,        # bank statement CSV import
     StudentBillingViewSet,
 
     # Reports / summaries
     SummaryView,              # KPI summary (used on dashboard)
     PaymentsView,             # Report list (used by moliya-chiqim.js)
     DebtorsView,              # Debtors report
+    DebtorAgingView,          # Debtor aging buckets
+    ForecastView,             # Income forecast
 
     # Salaries endpoints
     SalariesListView,         # GET list of salaries by month (moliya-oylik.js optional)
     SalariesStaffView,        # GET staff roster for a month (teachers & staff with roles)
     SalariesMarkView,         # POST mark/submit salaries for a month
+    SalariesCalculateView,    # GET preview / POST pre-fill salaries from lessons held
     SalariesFinalizeView,     # POST finalize/lock salaries for a month
 
     # Manual expenses
@@ -34,12 +38,16 @@ urlpatterns = [
     # Reports / summaries
     path('summary/',  SummaryView.as_view(),  name='billing-summary'),
     path('payments/', PaymentsView.as_view(), name='billing-payments'),   # used by moliya-chiqim.js
+    path('payments/import/', PaymentImportView.as_view(), name='billing-payments-import'),
     path('debtors/',  DebtorsView.as_view(),  name='billing-debtors'),
+    path('debtors/aging/', DebtorAgingView.as_view(), name='billing-debtors-aging'),
+    path('forecast/', ForecastView.as_view(), name='billing-forecast'),
 
     # Salaries (used by moliya-oylik.js)
     path('salaries/',          SalariesListView.as_view(),     name='billing-salaries'),
     path('salaries/staff/',    SalariesStaffView.as_view(),    name='billing-salaries-staff'),
     path('salaries/mark/',     SalariesMarkView.as_view(),     name='billing-salaries-mark'),
+    path('salaries/calculate/', SalariesCalculateView.as_view(), name='billing-salaries-calculate'),
     path('salaries/finalize/', SalariesFinalizeView.as_view(), name='billing-salaries-finalize'),
 
 
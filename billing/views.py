@@ -1,18 +1,29 @@
 # billing/views.py
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import date, timedelta
-from django.db import transaction
-from django.db.models import Sum, Q, F
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, Min, OuterRef, Q, Subquery, Sum
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 
-from academics.models import Student, SchoolClass
-from .models import TuitionPlan, Invoice, Payment, SalaryPayout
+from academics.models import ScheduleEntry, Student, SchoolClass
+from .models import TuitionPlan, Invoice, Payment, SalaryPayout, LedgerEntry, StudentBalance
 from .serializers import TuitionPlanSerializer, InvoiceSerializer, PaymentSerializer, ExpenseSerializer
 from .permissions import IsAdminOrAccountantWrite
-from .utils import month_first, parse_month
+from .allocation import allocate_forward
+from .bank_import import import_statement
+from .caching import billing_version, forecast_version
+from .forecast import income_forecast
+from .utils import month_first, next_month, parse_month
 
 
 # =========================
@@ -76,10 +87,59 @@ class TuitionPlanViewSet(viewsets.ModelViewSet):
 # Invoices
 # =========================
 
+class InvoiceKeysetPagination(BasePagination):
+    """
+    Keyset pages over (month DESC, student_id, id) — the Invoice ordering
+    plus id as tie-breaker. ?page_size=50 starts, ?cursor=<next> continues;
+    each page is an index range scan however deep it is.
+    Response: {"next": url|null, "cursor": token|null, "results": [...]}
+    """
+    ordering = ('-month', 'student_id', 'id')
+    page_size = 50
+    max_page_size = 500
+
+    @staticmethod
+    def is_requested(request):
+        return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            size = int(request.query_params.get('page_size') or self.page_size)
+        except ValueError:
+            size = self.page_size
+        size = max(1, min(size, self.max_page_size))
+
+        token = request.query_params.get('cursor')
+        if token:
+            try:
+                m, sid, pk = urlsafe_b64decode(token.encode()).decode().split('|')
+                m, sid, pk = date.fromisoformat(m), int(sid), int(pk)
+            except (ValueError, UnicodeDecodeError):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(
+                Q(month__lt=m) | Q(month=m, student_id__gt=sid) | Q(month=m, student_id=sid, id__gt=pk)
+            )
+        rows = list(queryset.order_by(*self.ordering)[:size + 1])
+        self.next_token = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            self.next_token = urlsafe_b64encode(f'{last.month.isoformat()}|{last.student_id}|{last.pk}'.encode()).decode()
+        return rows
+
+    def get_paginated_response(self, data):
+        url = None
+        if self.next_token:
+            url = replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_token)
+        return Response({'next': url, 'cursor': self.next_token, 'results': data})
+
+
 class InvoiceViewSet(viewsets.ModelViewSet):
     queryset = Invoice.objects.select_related('student', 'student__clazz').all()
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrAccountantWrite]
+    pagination_class = LimitOffsetPagination   # no PAGE_SIZE → only paginates when ?limit= is given
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -91,7 +151,9 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         elif getattr(u, 'role', None) == 'teacher':
             try:
                 t = u.teacher_profile
-                qs = qs.filter(Q(student__clazz__class_teacher=t) | Q(student__clazz__schedule__teacher=t))
+                # EXISTS instead of joining schedule rows, so no DISTINCT is needed
+                teaches = ScheduleEntry.objects.filter(clazz_id=OuterRef('student__clazz_id'), teacher=t)
+                qs = qs.filter(Q(student__clazz__class_teacher=t) | Exists(teaches))
             except Exception:
                 qs = qs.none()
         # Filters
@@ -104,64 +166,132 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             qs = qs.filter(student__clazz_id=clazz)
         if status_f:
             qs = qs.filter(status=status_f)
-        return qs.distinct()
+        return qs
+
+    def _page_response(self, qs):
+        # ?page_size= / ?cursor= → keyset pages; ?limit= → offset pages; else everything
+        keyset = InvoiceKeysetPagination()
+        if keyset.is_requested(self.request):
+            page = keyset.paginate_queryset(qs, self.request, view=self)
+            return keyset.get_paginated_response(self.get_serializer(page, many=True).data)
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(qs, many=True).data)
+
+    GENERATE_MAX_MONTHS = 24
 
     @action(detail=False, methods=['post'])
     def generate(self, request):
         """
         Generate monthly invoices for all active students (optionally filter by class).
-        Query params: month=YYYY-MM, class=<id>, due_day=10, default_amount=<int>
+        Query params: month=YYYY-MM | from=YYYY-MM&to=YYYY-MM, class=<id>, due_day=10, default_amount=<int>
+        Set-based, one transaction: existing invoices are read once and locked,
+        new invoices bulk-inserted (ignore_conflicts on student+month), changed
+        amounts bulk-updated; only rows this request inserted are charged.
         """
         if getattr(request.user, 'role', None) not in ('admin', 'accountant'):
             return Response({'detail': 'Forbidden'}, status=403)
 
-        m = request.query_params.get('month')
-        if not m:
-            return Response({'detail': 'month=YYYY-MM required'}, status=400)
-        month_dt = parse_month(m)
-        class_id = request.query_params.get('class')
-        due_day = int(request.query_params.get('due_day', 10))
-        default_amount = int(request.query_params.get('default_amount', 0))
-
+        qp = request.query_params
+        m_from = qp.get('from') or qp.get('month')
+        m_to = qp.get('to') or m_from
+        if not m_from:
+            return Response({'detail': 'month=YYYY-MM (or from/to) required'}, status=400)
+        try:
+            first, last = parse_month(m_from), parse_month(m_to)
+            due_day = int(qp.get('due_day', 10))
+            default_amount = int(qp.get('default_amount', 0))
+        except ValueError:
+            return Response({'detail': 'month must be YYYY-MM; due_day/default_amount integers'}, status=400)
+        if last < first:
+            return Response({'detail': 'to must not be before from'}, status=400)
+        months = [first]
+        while months[-1] < last:
+            months.append(next_month(months[-1]))
+        if len(months) > self.GENERATE_MAX_MONTHS:
+            return Response({'detail': f'at most {self.GENERATE_MAX_MONTHS} months per request'}, status=400)
+
+        class_id = qp.get('class')
         students = Student.objects.filter(status='active')
         if class_id:
             students = students.filter(clazz_id=class_id)
+        students = list(students.values_list('id', 'clazz_id'))
 
-        created, updated = 0, 0
-        for s in students.select_related('clazz'):
-            plan = getattr(s.clazz, 'tuition_plan', None)
-            amt = plan.amount_uzs if plan else default_amount
-            inv, was_created = Invoice.objects.get_or_create(
-                student=s, month=month_dt,
-                defaults={
-                    'amount_uzs': amt,
-                    'discount_uzs': 0,
-                    'penalty_uzs': 0,
-                    'paid_uzs': 0,
-                    'status': 'unpaid',
-                    'due_date': month_dt.replace(day=min(due_day, 28))
+        plans = dict(TuitionPlan.objects.values_list('clazz_id', 'amount_uzs'))
+        student_ids = [sid for sid, _ in students]
+        now = timezone.now()
+        with transaction.atomic():
+            # locked: status and the charge delta are computed from these rows
+            existing = {
+                (inv.student_id, inv.month): inv
+                for inv in Invoice.objects.select_for_update()
+                .filter(student_id__in=student_ids, month__in=months).order_by('pk')
+                .only('id', 'student_id', 'month', 'amount_uzs', 'discount_uzs', 'penalty_uzs', 'paid_uzs', 'status')
+            }
+
+            to_create, to_update, entries = [], [], []
+            for month_dt in months:
+                due = month_dt.replace(day=min(due_day, 28))
+                for sid, clazz_id in students:
+                    amt = plans.get(clazz_id, default_amount)
+                    inv = existing.get((sid, month_dt))
+                    if inv is None:
+                        to_create.append(Invoice(
+                            student_id=sid, month=month_dt, amount_uzs=amt,
+                            discount_uzs=0, penalty_uzs=0, paid_uzs=0,
+                            status='unpaid', due_date=due,
+                        ))
+                    elif inv.amount_uzs != amt and amt:
+                        entries.append(LedgerEntry(
+                            student_id=sid, invoice_id=inv.pk, kind='charge', amount_uzs=amt - inv.amount_uzs
+                        ))
+                        inv.amount_uzs = amt
+                        inv.recompute_status()
+                        inv.updated_at = now   # bulk_update skips auto_now
+                        to_update.append(inv)
+
+            Invoice.objects.bulk_create(to_create, ignore_conflicts=True, batch_size=1000)
+            Invoice.objects.bulk_update(to_update, ['amount_uzs', 'status', 'updated_at'], batch_size=1000)
+            created = 0
+            if to_create:
+                # ignore_conflicts leaves pks unset and hides lost conflicts. A row
+                # another request created meanwhile (Invoice.save or a parallel
+                # generate) already carries its ledger entries; ours have none yet
+                # → charge only those.
+                ours = {
+                    (sid, m): (pk, amount) for pk, sid, m, amount, posted in Invoice.objects.select_for_update()
+                    .filter(student_id__in=student_ids, month__in=months)
+                    .annotate(posted=Exists(LedgerEntry.objects.filter(invoice_id=OuterRef('pk'))))
+                    .order_by('pk').values_list('id', 'student_id', 'month', 'amount_uzs', 'posted')
+                    if not posted
                 }
-            )
-            if was_created:
-                created += 1
-            else:
-                if inv.amount_uzs != amt and amt:
-                    inv.amount_uzs = amt
-                    inv.recompute_status()
-                    inv.save()
-                    updated += 1
-        return Response({'ok': True, 'created': created, 'updated': updated})
+                for inv in to_create:
+                    pk, amount = ours.get((inv.student_id, inv.month), (None, None))
+                    if pk is None or amount != inv.amount_uzs:
+                        continue   # lost the conflict
+                    created += 1
+                    if inv.amount_uzs:
+                        entries.append(LedgerEntry(
+                            student_id=inv.student_id, invoice_id=pk, kind='charge', amount_uzs=inv.amount_uzs,
+                        ))
+            LedgerEntry.post(entries)
+
+        return Response({
+            'ok': True,
+            'created': created,
+            'updated': len(to_update),
+            'months': [d.strftime('%Y-%m') for d in months],
+        })
 
     @action(detail=False, methods=['get'])
     def overdue(self, request):
-        """List overdue invoices: status != paid AND due_date < today. Optional: month=YYYY-MM, class."""
-        qs = self.get_queryset()
-        today = date.today()
-        qs = qs.filter(~Q(status='paid'), due_date__lt=today)
-        month = self.request.query_params.get('month')
-        if month:
-            qs = qs.filter(month=parse_month(month))
-        return Response(self.serializer_class(qs, many=True).data)
+        """
+        List overdue invoices: status != paid AND due_date < today. Optional: month=YYYY-MM, class.
+        Paginated like list (?page_size=&cursor= keyset, served by the open-invoice partial index).
+        """
+        qs = self.get_queryset().filter(~Q(status='paid'), due_date__lt=timezone.localdate())
+        return self._page_response(qs)
 
     @action(detail=True, methods=['post'])
     def recompute(self, request, pk=None):
@@ -171,47 +301,22 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return Response(self.serializer_class(inv).data)
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        # If DRF has already serialized, we need to rebuild with context to include cumulative balances.
-        # Easier approach: override to build data ourselves:
-
+        """
+        One query. With ?month=YYYY-MM each row carries the student's
+        cumulative balance (total_due - paid over all invoices up to that
+        month) as a correlated SUM on the covering (student, month) index.
+        Pagination is opt-in: ?page_size=&cursor= (keyset) or ?limit=&offset=.
+        """
         qs = self.filter_queryset(self.get_queryset())
-        month_str = request.query_params.get('month')  # YYYY-MM
-        serializer_context = self.get_serializer_context()
-
-        if month_str:
-            month_dt = parse_month(month_str)
-            # Build cumulative balances up to the filtered month for each invoice's student
-            # (total_due - paid) for all invoices where month <= filtered month
-            from collections import defaultdict
-            cum_by_student = defaultdict(int)
-
-            # prefetch all relevant invoices (for performance, limit to involved students)
-            student_ids = list(qs.values_list('student_id', flat=True).distinct())
-            all_up_to = Invoice.objects.filter(
-                student_id__in=student_ids,
-                month__lte=month_dt
-            ).values('student_id', 'month', 'amount_uzs', 'discount_uzs', 'penalty_uzs', 'paid_uzs').order_by(
-                'student_id', 'month')
-
-            # We’ll compute cumulative for each month and store only the value at the filtered month
-            cum_at_month = {}
-            for row in all_up_to:
-                sid = row['student_id']
-                due = (row['amount_uzs'] - row['discount_uzs'] + row['penalty_uzs'])
-                paid = row['paid_uzs']
-                cum_by_student[sid] += int(due) - int(paid)
-
-            # For the serializer to show it per invoice (in that month),
-            # map (student, month_filtered) -> cum_balance
-            cum_balances = {(sid, month_dt.isoformat()): bal for sid, bal in cum_by_student.items()}
-            serializer_context['cum_balances'] = cum_balances
-
-            ser = self.get_serializer(qs, many=True, context=serializer_context)
-            return Response(ser.data)
-
-        # No month filter: just return default
-        return Response(self.get_serializer(qs, many=True, context=serializer_context).data)
+        if request.query_params.get('month'):
+            balance = F('amount_uzs') - F('discount_uzs') + F('penalty_uzs') - F('paid_uzs')
+            cum = (
+                Invoice.objects.filter(student_id=OuterRef('student_id'), month__lte=OuterRef('month'))
+                .order_by().values('student_id')
+                .annotate(total=Sum(balance)).values('total')
+            )
+            qs = qs.annotate(cum_balance=Subquery(cum))
+        return self._page_response(qs)
 
 
 # =========================
@@ -249,91 +354,70 @@ class PaymentViewSet(viewsets.ModelViewSet):
             qs = qs.filter(student_id=student)
         return qs.distinct()
 
-    # NEW: split/allocate surplus of a payment to future months
     def create(self, request, *args, **kwargs):
-        # Validate & create the primary payment normally
+        """
+        Create the payment; any surplus over the invoice's remaining due is
+        allocated forward month by month as child payments. One transaction,
+        serialized per student: future invoices are read once, missing months
+        and child payments are bulk-inserted, invoice totals updated once per
+        invoice.
+        Response: payment fields + "allocation": [{invoice, month, amount_uzs, created}].
+        """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        payment = serializer.save()  # this updates invoice.paid_uzs via Payment.save()
 
-        inv = payment.invoice
-        student = payment.student
-        remaining = Decimal(payment.amount_uzs)
+        with transaction.atomic():
+            # one student's payments queue on the student row: the surplus scan
+            # below inserts the months it finds missing, and two concurrent
+            # overpayments must not both insert the same (student, month)
+            list(Student.objects.select_for_update().filter(pk=serializer.validated_data['student'].pk).values_list('pk'))
+            payment = serializer.save()  # this updates invoice.paid_uzs via Payment.save()
+            allocation = self._allocate_surplus(payment)
+
+        headers = self.get_success_headers(serializer.data)
+        data = dict(self.get_serializer(payment).data)
+        data['allocation'] = allocation
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def _allocate_surplus(self, payment):
+        inv = Invoice.objects.get(pk=payment.invoice_id)  # row locked by Payment.save
 
         # How much of this payment was actually needed for the current invoice?
-        inv.refresh_from_db()
         needed_here = inv.total_due_uzs - (inv.paid_uzs - payment.amount_uzs)
-        if needed_here < 0:
-            needed_here = Decimal(0)
-
-        # Surplus after covering the current invoice
-        surplus = remaining - needed_here
-        # If “payment” itself pushed invoice into negative (rare edge), clamp
-        if surplus < 0:
-            surplus = Decimal(0)
-
-        # If there is surplus, allocate it forward month-by-month
-        if surplus > 0:
-            # figure per-month tuition amount
-            plan_amt = None
-            plan = getattr(student.clazz, 'tuition_plan', None) if getattr(student, 'clazz', None) else None
-            if plan:
-                plan_amt = Decimal(plan.amount_uzs)
-
-            cur_month = inv.month
-            # start from the NEXT month
-            m = next_month(cur_month)
-
-            # Keep allocating until surplus is gone
-            # Safety cap (24 months) to avoid infinite loops if data is odd
-            for _ in range(24):
-                if surplus <= 0:
-                    break
-
-                # ensure invoice exists for month m
-                next_inv, _c = Invoice.objects.get_or_create(
-                    student=student,
-                    month=m,
-                    defaults={
-                        'amount_uzs': plan_amt or inv.amount_uzs,   # fallback to current-month amount
-                        'discount_uzs': 0,
-                        'penalty_uzs': 0,
-                        'paid_uzs': 0,
-                        'status': 'unpaid',
-                        'due_date': m.replace(day=min(10, 28)),     # default due day; tweak if needed
-                        'notes': 'Auto-created by overpayment allocation'
-                    }
-                )
-
-                # how much still needed for that month
-                next_inv.refresh_from_db()
-                need = next_inv.total_due_uzs - next_inv.paid_uzs
-                if need <= 0:
-                    # already fully paid (perhaps from a previous allocation) → move to the next month
-                    m = next_month(m)
-                    continue
-
-                allocate = surplus if surplus <= need else need
-
-                # create a child payment for that next invoice
-                Payment.objects.create(
-                    student=student,
-                    invoice=next_inv,
-                    amount_uzs=allocate,
-                    method=payment.method,
-                    paid_at=payment.paid_at or tz_now(),
-                    receipt_no=payment.receipt_no,
-                    note=f"Auto-alloc from {inv.month.strftime('%Y-%m')}"
-                )
-                surplus -= allocate
+        surplus = Decimal(payment.amount_uzs) - max(needed_here, Decimal(0))
+        return allocate_forward(
+            payment.student_id, payment.student.clazz_id, inv.month, inv.amount_uzs, surplus,
+            method=payment.method, paid_at=payment.paid_at or tz_now(), receipt_no=payment.receipt_no,
+        )
 
-                # move to the next month after trying this one
-                if surplus > 0:
-                    m = next_month(m)
 
-        headers = self.get_success_headers(serializer.data)
-        return Response(self.get_serializer(payment).data, status=status.HTTP_201_CREATED, headers=headers)
+class PaymentImportView(APIView):
+    """
+    POST /api/billing/payments/import/   (multipart: file=<statement.csv>, method=transfer|card, dry_run=1)
+    Bank statement CSV -> payments matched by parent phone / student column,
+    duplicates by receipt_no skipped, surplus carried to later months.
+    See billing.bank_import.import_statement.
+    Response: {imported, payments, invoices, amount_uzs, carried_forward_uzs, duplicates,
+               unmatched: [{line, reason, candidates, row}]}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
 
+    def post(self, request):
+        if getattr(request.user, 'role', '') not in ('admin', 'accountant'):
+            return Response({'detail': 'Forbidden'}, status=403)
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'detail': 'file is required'}, status=400)
+        method = request.data.get('method') or 'transfer'
+        if method not in dict(Payment.METHOD):
+            return Response({'detail': 'Invalid method'}, status=400)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            result = import_statement(upload, method=method, dry_run=dry_run)
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({'detail': str(e)}, status=400)
+        return Response(result, status=200 if dry_run else 201)
 
 
 # =========================
@@ -355,20 +439,50 @@ class StudentBillingViewSet(viewsets.ViewSet):
     def balance(self, request, student_id=None):
         if not self._can_view(request, student_id):
             return Response({'detail': 'Forbidden'}, status=403)
-        inv = Invoice.objects.filter(student_id=student_id)
-        totals = inv.aggregate(
-            total_due=Sum(F('amount_uzs') - F('discount_uzs') + F('penalty_uzs')),
-            total_paid=Sum('paid_uzs')
-        )
-        total_due = int(totals['total_due'] or 0)
-        total_paid = int(totals['total_paid'] or 0)
+        # single-row lookup on the ledger's cached balance
+        b = StudentBalance.objects.filter(student_id=student_id).first()
         return Response({
             'student': int(student_id),
-            'total_due_uzs': total_due,
-            'total_paid_uzs': total_paid,
-            'balance_uzs': total_due - total_paid
+            'total_due_uzs': int(b.due_uzs) if b else 0,
+            'total_paid_uzs': int(b.paid_uzs) if b else 0,
+            'balance_uzs': int(b.balance_uzs) if b else 0,
         })
 
+    @action(detail=False, methods=['get'], url_path='family-balance')
+    def family_balance(self, request):
+        """
+        GET /api/billing/student/family-balance/            (parent: own children)
+        GET /api/billing/student/family-balance/?guardian=<user_id>   (staff)
+        Returns: {"children": [{student, full_name, balance_uzs}], "total_due_uzs", "total_paid_uzs", "balance_uzs"}
+        """
+        u = request.user
+        role = getattr(u, 'role', None)
+        if role == 'parent':
+            guardian_id = u.id
+        elif role in ('admin', 'accountant', 'registrar'):
+            guardian_id = request.query_params.get('guardian')
+            if not guardian_id:
+                return Response({'detail': 'guardian=<user_id> required'}, status=400)
+        else:
+            return Response({'detail': 'Forbidden'}, status=403)
+
+        rows = (
+            Student.objects.filter(guardians__guardian_id=guardian_id)
+            .order_by('last_name', 'first_name')
+            .values('id', 'first_name', 'last_name', 'ledger_balance__due_uzs',
+                    'ledger_balance__paid_uzs', 'ledger_balance__balance_uzs')
+        )
+        children, due, paid = [], 0, 0
+        for r in rows:
+            due += int(r['ledger_balance__due_uzs'] or 0)
+            paid += int(r['ledger_balance__paid_uzs'] or 0)
+            children.append({
+                'student': r['id'],
+                'full_name': f"{r['last_name']} {r['first_name']}".strip(),
+                'balance_uzs': int(r['ledger_balance__balance_uzs'] or 0),
+            })
+        return Response({'children': children, 'total_due_uzs': due, 'total_paid_uzs': paid, 'balance_uzs': due - paid})
+
     @action(detail=False, methods=['get'], url_path='(?P<student_id>[^/.]+)/invoices')
     def invoices(self, request, student_id=None):
         if not self._can_view(request, student_id):
@@ -507,17 +621,179 @@ class PaymentsView(APIView):
 
 
 class DebtorsView(APIView):
+    """
+    GET /api/billing/debtors/?class=<id>&min=<uzs>
+    Students with a positive ledger balance, largest debt first
+    (one indexed read of StudentBalance).
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        # TODO.txt: replace with real debt query
+        role = getattr(request.user, 'role', '')
+        if role not in ('admin', 'accountant', 'registrar', 'operator'):
+            return Response({'detail': 'Forbidden'}, status=403)
+        try:
+            min_debt = int(request.query_params.get('min') or 0)
+        except ValueError:
+            return Response({'detail': 'min must be integer'}, status=400)
+
+        qs = StudentBalance.objects.filter(balance_uzs__gt=min_debt)
+        class_id = request.query_params.get('class')
+        if class_id:
+            qs = qs.filter(student__clazz_id=class_id)
+        rows = qs.order_by('-balance_uzs', 'student_id').values(
+            'student_id', 'student__first_name', 'student__last_name',
+            'student__clazz__name', 'student__parent_phone', 'balance_uzs',
+        )
         data = [
-            {"student_id": 1, "student_name": "Ali Aliyev", "class_name": "7-A", "parent_phone": "+998901112233", "debt": 150000},
-            {"student_id": 2, "student_name": "Dilnoza Karimova", "class_name": "7-A", "parent_phone": "+998909998877", "debt": 200000},
+            {
+                'student_id': r['student_id'],
+                'student_name': f"{r['student__first_name']} {r['student__last_name']}".strip(),
+                'class_name': r['student__clazz__name'] or '',
+                'parent_phone': r['student__parent_phone'] or '',
+                'debt': int(r['balance_uzs']),
+            }
+            for r in rows
         ]
         return Response(data)
 
 
+class DebtorAgingPagination(LimitOffsetPagination):
+    default_limit = 50
+    max_limit = 500
+
+
+class DebtorAgingView(APIView):
+    """
+    GET /api/billing/debtors/aging/?class=<id>&limit=50&offset=0
+    Overdue open invoices (status != paid, due_date < today) aged by days
+    past due_date: 0-30, 31-60, 61-90, 90+.
+    Response:
+    {
+      "as_of": "YYYY-MM-DD", "buckets": ["0-30", "31-60", "61-90", "90+"],
+      "totals":   {"0-30": uzs, ..., "total": uzs, "students": n},
+      "classes":  [{"class_id", "class_name", "0-30", ..., "total", "students"}],
+      "students": {"count", "next", "previous",
+                   "results": [{"student_id", "student_name", "class_name", "parent_phone",
+                                "0-30", ..., "total", "oldest_due"}]}
+    }
+    Each block is one grouped query (partial index on open invoices);
+    the payload is cached per day and billing data version.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    BUCKETS = (('0-30', 0, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None))
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def _bucket_sums(self, today):
+        balance = F('amount_uzs') - F('discount_uzs') + F('penalty_uzs') - F('paid_uzs')
+        sums = {}
+        for label, lo, hi in self.BUCKETS:
+            # days past due in [lo, hi]  <=>  due_date in [today - hi, today - lo]
+            cond = Q(due_date__lte=today - timedelta(days=lo))
+            if hi is not None:
+                cond &= Q(due_date__gte=today - timedelta(days=hi))
+            sums[label] = Sum(balance, filter=cond)
+        sums['total'] = Sum(balance)
+        return sums
+
+    def _row(self, r):
+        out = {label: int(r[label] or 0) for label, _, _ in self.BUCKETS}
+        out['total'] = int(r['total'] or 0)
+        return out
+
+    def get(self, request):
+        role = getattr(request.user, 'role', '')
+        if role not in ('admin', 'accountant', 'registrar', 'operator'):
+            return Response({'detail': 'Forbidden'}, status=403)
+
+        today = timezone.localdate()
+        class_id = request.query_params.get('class') or ''
+        key = 'billing:aging:{}:{}:{}:{}:{}'.format(
+            billing_version(), today.isoformat(), class_id,
+            request.query_params.get('limit') or '', request.query_params.get('offset') or '',
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return Response(cached)
+
+        open_qs = Invoice.objects.filter(~Q(status='paid'), due_date__lt=today)
+        if class_id:
+            open_qs = open_qs.filter(student__clazz_id=class_id)
+        sums = self._bucket_sums(today)
+
+        classes = []
+        totals = dict.fromkeys([b[0] for b in self.BUCKETS] + ['total', 'students'], 0)
+        per_class = (
+            open_qs.values('student__clazz_id', 'student__clazz__name')
+            .annotate(students=Count('student_id', distinct=True), **sums)
+            .order_by('student__clazz__name')
+        )
+        for r in per_class:
+            row = {'class_id': r['student__clazz_id'], 'class_name': r['student__clazz__name'] or '',
+                   **self._row(r), 'students': r['students']}
+            for k in totals:
+                totals[k] += row[k]
+            classes.append(row)
+
+        per_student = (
+            open_qs.values('student_id', 'student__first_name', 'student__last_name',
+                           'student__clazz__name', 'student__parent_phone')
+            .annotate(oldest_due=Min('due_date'), **sums)
+            .order_by('-total', 'student_id')
+        )
+        paginator = DebtorAgingPagination()
+        page = paginator.paginate_queryset(per_student, request, view=self)
+        results = [
+            {
+                'student_id': r['student_id'],
+                'student_name': f"{r['student__first_name']} {r['student__last_name']}".strip(),
+                'class_name': r['student__clazz__name'] or '',
+                'parent_phone': r['student__parent_phone'] or '',
+                **self._row(r),
+                'oldest_due': r['oldest_due'].isoformat(),
+            }
+            for r in page
+        ]
+
+        payload = {
+            'as_of': today.isoformat(),
+            'buckets': [b[0] for b in self.BUCKETS],
+            'totals': totals,
+            'classes': classes,
+            'students': paginator.get_paginated_response(results).data,
+        }
+        cache.set(key, payload, self.CACHE_TIMEOUT)
+        return Response(payload)
+
+
+class ForecastView(APIView):
+    """
+    GET /api/billing/forecast/?months=6   (1..24, starting next month)
+    Expected tuition income per month and class, see billing.forecast.income_forecast.
+    Cached until tuition plans or enrollment change (and per calendar month).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def get(self, request):
+        if getattr(request.user, 'role', '') not in ('admin', 'accountant'):
+            return Response({'detail': 'Forbidden'}, status=403)
+        try:
+            months = int(request.query_params.get('months') or 6)
+        except ValueError:
+            return Response({'detail': 'months must be integer'}, status=400)
+        if not 1 <= months <= 24:
+            return Response({'detail': 'months must be 1..24'}, status=400)
+
+        current = month_first(timezone.localdate())
+        key = f'billing:forecast:{forecast_version()}:{current:%Y-%m}:{months}'
+        data = cache.get(key)
+        if data is None:
+            data = income_forecast(current, months)
+            cache.set(key, data, self.CACHE_TIMEOUT)
+        return Response(data)
+
+
 # =========================
 # Salaries (optional, for /moliya/oylik/)
 # =========================
@@ -539,63 +815,15 @@ class SalariesListView(APIView):
         return Response(data)
 
 
-class SalariesMarkView(APIView):
-    """
-    POST /api/billing/salaries/mark/
-    body: {"month": "YYYY-MM", "items": [{"fio": "...", "date": "YYYY-MM-DD", "paid": true}, ...]}
-    Upserts rows by (month, fio, date).
-    """
-    permission_classes = [permissions.IsAuthenticated]
-
-    def post(self, request):
-        role = getattr(request.user, 'role', '')
-        if role not in ('admin', 'accountant'):
-            return Response({'detail': 'Forbidden'}, status=403)
-
-        m = (request.data.get('month') or '').strip()
-        items = request.data.get('items') or []
-        if not m:
-            return Response({'detail': 'month required (YYYY-MM)'}, status=400)
-        try:
-            mdt = parse_month(m)
-        except Exception:
-            return Response({'detail': 'invalid month format'}, status=400)
-
-        created = 0
-        updated = 0
-        for it in items:
-            fio = (it.get('fio') or '').strip()
-            dt = it.get('date')
-            paid = bool(it.get('paid'))
-            if not fio or not dt:
-                continue
-            try:
-                y, mo, d = map(int, dt.split('-'))
-                from datetime import date as _d
-                dtx = _d(y, mo, d)
-            except Exception:
-                continue
-
-            obj, was_created = SalaryPayout.objects.update_or_create(
-                month=mdt, fio=fio, date=dtx,
-                defaults={'paid': paid}
-            )
-            created += 1 if was_created else 0
-            updated += 0 if was_created else 1
-
-        return Response({'ok': True, 'created': created, 'updated': updated})
-
-
 # billing/views.py  (add imports at top)
 from django.utils import timezone
-from accounts.models import User
-from academics.models import Teacher
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
 from .models import SalaryPayout, SalaryMonthLock
+from .payroll import MonthLocked, calculate_month, mark_month, month_roster, prefill_month
 from .utils import parse_month
 
 
@@ -620,39 +848,8 @@ class SalariesStaffView(APIView):
             m = date.today().strftime('%Y-%m')
         month_dt = parse_month(m)
 
-        locked = SalaryMonthLock.objects.filter(month=month_dt).exists()
-
-        # Which roles to include in salaries page:
-        roles = ('teacher', 'accountant', 'registrar', 'operator', 'admin')
-        staff = list(User.objects.filter(role__in=roles).order_by('last_name', 'first_name'))
-
-        # Map teacher -> specialty
-        teachers = {t.user_id: t for t in Teacher.objects.select_related('specialty')}
-        # Prefetch existing payouts
-        existing = {
-            (sp.user_id): sp
-            for sp in SalaryPayout.objects.filter(month=month_dt, user_id__in=[u.id for u in staff])
-        }
-
-        items = []
-        for u in staff:
-            full = f"{(u.first_name or '').strip()} {(u.last_name or '').strip()}".strip() or (
-                        getattr(u, 'phone', '') or str(u))
-            specialty = ""
-            if u.role == 'teacher':
-                t = teachers.get(u.id)
-                specialty = t.specialty.name if (t and t.specialty) else ""
-            sp = existing.get(u.id)
-            items.append({
-                "user": u.id,
-                "full_name": full,
-                "role": u.role or "",
-                "specialty": specialty,
-                "amount_uzs": int(sp.amount_uzs) if sp else 0,
-                "paid": bool(sp.paid) if sp else False,
-            })
-
-        return Response({"locked": locked, "items": items})
+        # roster, payouts and lock: three queries (billing.payroll)
+        return Response(month_roster(month_dt))
 
 
 # ---- SAVE / UPSERT SALARIES FOR A MONTH ----
@@ -663,7 +860,7 @@ class SalariesMarkView(APIView):
       "month": "YYYY-MM",
       "items":[{"user":12,"amount_uzs":450000,"paid":true}, ...]
     }
-    Block if month is locked.
+    Block if month is locked. Unreadable items come back under "invalid".
     """
     permission_classes = [IsAuthenticated]
 
@@ -676,39 +873,53 @@ class SalariesMarkView(APIView):
         items = request.data.get('items') or []
         if not m:
             return Response({'detail': 'month required (YYYY-MM)'}, status=400)
+        if not isinstance(items, list):
+            return Response({'detail': 'items must be a list'}, status=400)
         try:
             month_dt = parse_month(m)
         except Exception:
             return Response({'detail': 'invalid month format'}, status=400)
 
-        # Check lock
-        if SalaryMonthLock.objects.filter(month=month_dt).exists():
+        try:
+            result = mark_month(month_dt, items)   # lock check + one upsert, one transaction
+        except MonthLocked:
             return Response({'detail': 'This month is locked'}, status=400)
+        return Response({'ok': True, **result})
 
-        created = 0
-        updated = 0
-        for it in items:
-            uid = it.get('user')
-            amt = int(it.get('amount_uzs') or 0)
-            paid = bool(it.get('paid'))
-            if not uid:
-                continue
-            obj, was_created = SalaryPayout.objects.get_or_create(
-                month=month_dt, user_id=uid,
-                defaults={'amount_uzs': amt, 'paid': paid, 'paid_at': timezone.now() if paid else None}
-            )
-            if was_created:
-                created += 1
-            else:
-                obj.amount_uzs = amt
-                # keep paid_at if already paid; set if changing to paid
-                if paid and not obj.paid:
-                    obj.paid_at = timezone.now()
-                obj.paid = paid
-                obj.save(update_fields=['amount_uzs', 'paid', 'paid_at'])
-                updated += 1
 
-        return Response({'ok': True, 'created': created, 'updated': updated})
+# ---- CALCULATE FROM LESSONS HELD ----
+class SalariesCalculateView(APIView):
+    """
+    GET  /api/billing/salaries/calculate/?month=YYYY-MM   -> preview
+    POST /api/billing/salaries/calculate/ {"month":"YYYY-MM"} -> pre-fill unpaid SalaryPayout amounts
+    Lessons = distinct (schedule, date) attendance marks per teacher x PayrollRate.
+    Returns: {"items":[{user, teacher, full_name, lessons, amount_uzs, subjects:[...]}], "written": n, "zeroed": n, "kept_paid": n}
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _month(self, request, raw):
+        if getattr(request.user, 'role', '') not in ('admin', 'accountant'):
+            return None, Response({'detail': 'Forbidden'}, status=403)
+        try:
+            return parse_month((raw or '').strip() or timezone.localdate().strftime('%Y-%m')), None
+        except Exception:
+            return None, Response({'detail': 'invalid month format'}, status=400)
+
+    def get(self, request):
+        month_dt, error = self._month(request, request.query_params.get('month'))
+        if error:
+            return error
+        return Response({'items': calculate_month(month_dt)})
+
+    def post(self, request):
+        month_dt, error = self._month(request, request.data.get('month'))
+        if error:
+            return error
+        try:
+            result = prefill_month(month_dt)
+        except MonthLocked:
+            return Response({'detail': 'This month is locked'}, status=400)
+        return Response({'ok': True, **result})
 
 
 # ---- FINALIZE / LOCK MONTH ----
@@ -736,99 +947,170 @@ class SalariesFinalizeView(APIView):
         if SalaryMonthLock.objects.filter(month=month_dt).exists():
             return Response({'detail': 'Already locked'}, status=400)
 
-        SalaryMonthLock.objects.create(month=month_dt, locked_by=request.user)
-        return Response({'ok': True, 'locked': True})
+        try:
+            with transaction.atomic():
+                lock = SalaryMonthLock.finalize(month_dt, user=request.user)
+        except IntegrityError:   # concurrent finalize of the same month
+            return Response({'detail': 'Already locked'}, status=400)
+        return Response({
+            'ok': True,
+            'locked': True,
+            'total_uzs': int(lock.total_uzs),
+            'headcount': lock.headcount,
+        })
 
 # billing/views.py
 from django.utils.dateparse import parse_date
-from django.db.models import Sum
+from django.db.models import CharField, DateField, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from .models import Payment, SalaryPayout, SalaryMonthLock
+from .export import CSVStreamRenderer, NDJSONStreamRenderer, stream_rows
+from .models import Expense, Payment, SalaryPayout, SalaryMonthLock
 
 # billing/views.py (replace PaymentsView)
 class PaymentsView(APIView):
+    """
+    GET /api/billing/payments/?type=income|expense&from=YYYY-MM-DD&to=YYYY-MM-DD&include_salaries=1
+    &format=csv|ndjson streams the rows (constant memory); default is a JSON list.
+    Rows are merged and ordered by date in the database (UNION ALL ... ORDER BY).
+    """
     permission_classes = [IsAuthenticated]
-
-    def get(self, request):
-        t = (request.query_params.get('type') or 'income').lower()
-        from_str = request.query_params.get('from')
-        to_str = request.query_params.get('to')
-        inc_sal = request.query_params.get('include_salaries') in ('1', 'true', 'yes')
-
-        dfrom = parse_date(from_str) if from_str else None
-        dto   = parse_date(to_str) if to_str else None
-
-        if t == 'income':
-            qs = Payment.objects.all().select_related('student')
-            if dfrom: qs = qs.filter(paid_at__date__gte=dfrom)
-            if dto:   qs = qs.filter(paid_at__date__lte=dto)
-            data = [{
-                "id": p.id,
-                "date": p.paid_at.date().isoformat(),
-                "amount": int(p.amount_uzs),
-                "method": p.method,
-                "reason": f"Talaba to‘lovi — {p.student}",  # adjust if you want full name formatting
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, CSVStreamRenderer, NDJSONStreamRenderer]
+    EXPORT_CHUNK = 2000
+    COLUMNS = ['id', 'date', 'amount', 'method', 'reason', 'kind', 'category', 'category_name']
+    # union column order (all annotations, so every branch selects the same shape)
+    UNION_COLS = ('row_kind', 'row_id', 'day', 'amt', 'pay_method', 'why', 'cat',
+                  'fname', 'lname', 'phone_no', 'for_month')
+
+    def _union_branch(self, qs, **cols):
+        return qs.order_by().annotate(**{c: cols[c] for c in self.UNION_COLS}).values_list(*self.UNION_COLS)
+
+    def _income_rows(self, dfrom, dto):
+        qs = Payment.objects.all()
+        if dfrom: qs = qs.filter(paid_at__date__gte=dfrom)
+        if dto:   qs = qs.filter(paid_at__date__lte=dto)
+        rows = qs.order_by('paid_at', 'id').values_list(
+            'id', 'paid_at', 'amount_uzs', 'method', 'student__last_name', 'student__first_name'
+        )
+        for pk, paid_at, amount, method, last, first in rows.iterator(chunk_size=self.EXPORT_CHUNK):
+            yield {
+                "id": pk,
+                "date": timezone.localdate(paid_at).isoformat(),
+                "amount": int(amount),
+                "method": method,
+                "reason": f"Talaba to‘lovi — {f'{last} {first}'.strip()}",
                 "kind": "income",
-            } for p in qs]
-            return Response(data)
-
-        # Expense = manual expenses + salaries (optional) + lock rollups (optional)
-        rows = []
+            }
 
-        # 1) Manual expenses
+    def _expense_rows(self, dfrom, dto, inc_sal):
+        text, day, month = CharField(), DateField(), DateField()
         ex_qs = Expense.objects.all()
         if dfrom: ex_qs = ex_qs.filter(date__gte=dfrom)
         if dto:   ex_qs = ex_qs.filter(date__lte=dto)
-        for e in ex_qs:
-            rows.append({
-                "id": f"exp-{e.id}",
-                "date": e.date.isoformat(),
-                "amount": int(e.amount_uzs),
-                "method": e.method or "-",
-                "reason": e.reason or e.get_category_display(),
-                "kind": "manual",
-                "category": e.category,
-                "category_name": e.get_category_display(),
-            })
+        union = self._union_branch(
+            ex_qs,
+            row_kind=Value('manual', output_field=text), row_id=F('id'), day=F('date'),
+            amt=F('amount_uzs'), pay_method=F('method'), why=F('reason'), cat=F('category'),
+            fname=Value('', output_field=text), lname=Value('', output_field=text),
+            phone_no=Value('', output_field=text), for_month=Value(None, output_field=month),
+        )
 
-        # 2) Salaries (if asked)
         if inc_sal:
-            qs = SalaryPayout.objects.filter(paid=True).select_related('user')
-            if dfrom: qs = qs.filter(paid_at__date__gte=dfrom)
-            if dto:   qs = qs.filter(paid_at__date__lte=dto)
-            for s in qs:
-                full = f"{(s.user.first_name or '').strip()} {(s.user.last_name or '').strip()}".strip() or getattr(s.user, 'phone', '')
-                rows.append({
-                    "id": f"sal-{s.id}",
-                    "date": s.paid_at.date().isoformat() if s.paid_at else s.month.isoformat(),
-                    "amount": int(s.amount_uzs),
+            sal_qs = SalaryPayout.objects.filter(paid=True)
+            if dfrom: sal_qs = sal_qs.filter(paid_at__date__gte=dfrom)
+            if dto:   sal_qs = sal_qs.filter(paid_at__date__lte=dto)
+            salaries = self._union_branch(
+                sal_qs,
+                row_kind=Value('salary', output_field=text), row_id=F('id'),
+                day=Coalesce(TruncDate('paid_at'), F('month'), output_field=day),
+                amt=F('amount_uzs'), pay_method=Value('salary', output_field=text),
+                why=Value('', output_field=text), cat=Value('', output_field=text),
+                fname=F('user__first_name'), lname=F('user__last_name'), phone_no=F('user__phone'),
+                for_month=F('month'),
+            )
+
+            locks = SalaryMonthLock.objects.all()
+            if dfrom: locks = locks.filter(month__gte=dfrom.replace(day=1))
+            if dto:   locks = locks.filter(month__lte=dto.replace(day=1))
+            month_total = (
+                SalaryPayout.objects.filter(month=OuterRef('month'), paid=True)
+                .order_by().values('month').annotate(s=Sum('amount_uzs')).values('s')
+            )
+            lock_rows = self._union_branch(
+                locks,
+                row_kind=Value('salary_total', output_field=text), row_id=F('id'),
+                day=TruncDate('locked_at'),
+                # stored at finalize; live SUM only for locks that predate the stored totals
+                amt=Coalesce(F('total_uzs'), Subquery(month_total), 0,
+                             output_field=DecimalField(max_digits=12, decimal_places=0)),
+                pay_method=Value('—', output_field=text), why=Value('', output_field=text),
+                cat=Value('', output_field=text), fname=Value('', output_field=text),
+                lname=Value('', output_field=text), phone_no=Value('', output_field=text),
+                for_month=F('month'),
+            )
+            union = union.union(salaries, lock_rows, all=True)
+
+        # same order the old in-memory sort produced: date, then manual < salary < salary_total
+        union = union.order_by('day', 'row_kind', 'row_id')
+        categories = dict(Expense.CATEGORY)
+        for kind, pk, d, amount, method, reason, cat, first, last, phone, for_month in (
+            union.iterator(chunk_size=self.EXPORT_CHUNK)
+        ):
+            if kind == 'manual':
+                yield {
+                    "id": f"exp-{pk}",
+                    "date": d.isoformat(),
+                    "amount": int(amount),
+                    "method": method or "-",
+                    "reason": reason or categories.get(cat, cat),
+                    "kind": "manual",
+                    "category": cat,
+                    "category_name": categories.get(cat, cat),
+                }
+            elif kind == 'salary':
+                full = f"{(first or '').strip()} {(last or '').strip()}".strip() or (phone or '')
+                yield {
+                    "id": f"sal-{pk}",
+                    "date": d.isoformat(),
+                    "amount": int(amount),
                     "method": "salary",
                     "reason": f"Oylik — {full}",
                     "kind": "salary",
-                })
-
-            locks = SalaryMonthLock.objects.all()
-            if dfrom:
-                locks = locks.filter(month__gte=dfrom.replace(day=1))
-            if dto:
-                locks = locks.filter(month__lte=dto.replace(day=1))
-            for lock in locks:
-                total = SalaryPayout.objects.filter(month=lock.month, paid=True).aggregate(s=Sum('amount_uzs'))['s'] or 0
-                rows.append({
-                    "id": f"lock-{lock.id}",
-                    "date": lock.locked_at.date().isoformat(),
-                    "amount": int(total),
+                }
+            else:
+                yield {
+                    "id": f"lock-{pk}",
+                    "date": d.isoformat(),
+                    "amount": int(amount),
                     "method": "—",
-                    "reason": f"Oyliklar yakuni — {lock.month.strftime('%Y-%m')}",
+                    "reason": f"Oyliklar yakuni — {for_month.strftime('%Y-%m')}",
                     "kind": "salary_total",
-                })
+                }
+
+    def get(self, request):
+        t = (request.query_params.get('type') or 'income').lower()
+        from_str = request.query_params.get('from')
+        to_str = request.query_params.get('to')
+        inc_sal = request.query_params.get('include_salaries') in ('1', 'true', 'yes')
+        fmt = (request.query_params.get('format') or '').lower()
 
-        # sort by date ASC before returning (UI also sorts but this helps)
-        rows.sort(key=lambda r: r.get('date') or '')
-        return Response(rows)
+        dfrom = parse_date(from_str) if from_str else None
+        dto   = parse_date(to_str) if to_str else None
+
+        if t == 'income':
+            rows = self._income_rows(dfrom, dto)
+        else:
+            # Expense = manual expenses + salaries (optional) + lock rollups (optional)
+            rows = self._expense_rows(dfrom, dto, inc_sal)
+
+        if fmt in ('csv', 'ndjson'):
+            name = f"{t}-{from_str or 'all'}-{to_str or 'all'}"
+            return stream_rows(rows, fmt, self.COLUMNS, name)
+        return Response(list(rows))
 
 
 # billing/views.py (append imports)
@@ -877,22 +1159,21 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
-from .models import Payment
-try:
-    from .models import Expense  # your manual expense model
-except Exception:
-    Expense = None  # allow code to run while model is being added
+from .models import Invoice
+from .summary import summary_figures
 
 class SummaryView(APIView):
     """
-    GET /api/billing/summary/?from=YYYY-MM-DD&to=YYYY-MM-DD
+    GET /api/billing/summary/?from=YYYY-MM-DD&to=YYYY-MM-DD&include_salaries=1
     Response:
     {
       from, to,
       income, expense, balance, debtors_count,
       income_by_method: {cash, card, transfer},
-      expense_by_method:{cash, card, transfer}
+      expense_by_method:{cash, card, transfer}   # salaries are counted into 'transfer'
     }
+    Closed months come from FinancialMonthSnapshot (billing.summary); the rest
+    is one conditional-aggregation query per source table.
     """
     permission_classes = [IsAuthenticated]
 
@@ -912,41 +1193,30 @@ class SummaryView(APIView):
             first, last = self._month_bounds(today)
             f_str = f_str or first.isoformat()
             t_str = t_str or last.isoformat()
+        try:
+            d1, d2 = _date.fromisoformat(f_str), _date.fromisoformat(t_str)
+        except ValueError:
+            return Response({'detail': 'from/to must be YYYY-MM-DD'}, status=400)
 
-        # incomes
-        pay_qs = Payment.objects.filter(paid_at__date__gte=f_str, paid_at__date__lte=t_str)
-        income_total = pay_qs.aggregate(total=Sum('amount_uzs'))['total'] or 0
-        income_by_method = {}
-        for m, _ in getattr(Payment, 'METHOD', (('cash','Naqd'), ('card','Karta'), ('transfer','O‘tkazma'))):
-            income_by_method[m] = pay_qs.filter(method=m).aggregate(total=Sum('amount_uzs'))['total'] or 0
-
-        # expenses
-        expense_total = 0
-        expense_by_method = {'cash': 0, 'card': 0, 'transfer': 0}
-        if Expense is not None:
-            ex_qs = Expense.objects.filter(date__gte=f_str, date__lte=t_str)
-            expense_total = ex_qs.aggregate(total=Sum('amount_uzs'))['total'] or 0
-            for m, _ in getattr(Expense, 'METHOD', (('cash','Naqd'), ('card','Karta'), ('transfer','O‘tkazma'))):
-                expense_by_method[m] = ex_qs.filter(method=m).aggregate(total=Sum('amount_uzs'))['total'] or 0
+        fig = summary_figures(d1, d2)
+        income_total = fig['income']
+        expense_total = fig['expense']
+        expense_by_method = fig['expense_by_method']
 
-        # optional: real debtors_count (keep placeholder if not implemented)
-        debtors_count = 0
-        try:
-            from .models import Invoice
-            debtors_count = Invoice.objects.filter(~Q(status='paid')).values('student').distinct().count()
-        except Exception:
-            pass
+        # salaries (paid only) — counted into the 'transfer' bucket
+        if request.query_params.get('include_salaries') in ('1', 'true', 'yes'):
+            expense_total += fig['salaries']
+            expense_by_method['transfer'] += fig['salaries']
 
-        balance = int(income_total) - int(expense_total)
+        debtors_count = Invoice.objects.filter(~Q(status='paid')).values('student').distinct().count()
 
         return Response({
             'from': f_str,
             'to': t_str,
             'income': int(income_total),
             'expense': int(expense_total),
-            'balance': int(balance),
+            'balance': int(income_total) - int(expense_total),
             'debtors_count': int(debtors_count),
-            'income_by_method': {k: int(v or 0) for k, v in income_by_method.items()},
-            'expense_by_method': {k: int(v or 0) for k, v in expense_by_method.items()},
+            'income_by_method': fig['income_by_method'],
+            'expense_by_method': expense_by_method,
         })
-
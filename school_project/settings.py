@@ -77,8 +77,19 @@ else:
         }
     }
 
+# CACHE (shared backend, e.g. redis, is needed for cross-worker snapshots)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='school-cache'),
+    }
+}
+
 AUTH_USER_MODEL = 'accounts.User'
 
+# covering (INCLUDE) indexes are PostgreSQL-only; the local SQLite fallback just skips them
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 LANGUAGE_CODE = 'uz'
 TIME_ZONE = 'Asia/Tashkent'
 USE_I18N = True
@@ -127,6 +138,14 @@ CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL', cast=bool, default=True)
 
 ALLOW_DAILY_GRADES = True
 
+# Late-payment penalties (manage.py accrue_penalties); all zero = disabled
+BILLING_PENALTY = {
+    'flat_uzs': config('PENALTY_FLAT_UZS', cast=int, default=0),
+    'percent_per_day': config('PENALTY_PERCENT_PER_DAY', default='0'),
+    'cap_uzs': config('PENALTY_CAP_UZS', cast=int, default=0),
+    'grace_days': config('PENALTY_GRACE_DAYS', cast=int, default=0),
+}
+
 CSRF_TRUSTED_ORIGINS = [
     'https://212.47.71.155',
     'http://212.47.71.155',